@@ -0,0 +1,139 @@
+"""
+Account deletion as a tracked background job. DELETE /users/me saves a job
+and returns; the job then deletes the Firebase Auth account, then every
+collection holding the user's data in parallel, saving its progress after
+each step so GET /users/me/deletion can report it.
+
+Every step is safe to repeat, so a job interrupted by a crash or restart is
+simply run again: resume_unfinished picks up "pending" and "running" jobs at
+startup. With several workers more than one may resume the same job, which
+costs duplicate reads but deletes nothing twice.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from firebase_admin import auth as firebase_auth
+
+logger = logging.getLogger(__name__)
+
+# Deletion jobs running at once in this process; each also deletes its
+# collections in parallel
+CONCURRENCY = int(os.getenv("ACCOUNT_DELETION_CONCURRENCY", "4"))
+
+
+def new_job(uid: str) -> dict:
+    now = datetime.now(timezone.utc)
+    return {
+        "uid": uid,
+        "status": "pending",
+        "auth_deleted": False,
+        # Records deleted per collection, filled in as each one finishes
+        "collections": {},
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+async def _save(store, job: dict, **changes) -> None:
+    job.update(changes, updated_at=datetime.now(timezone.utc))
+    await store.deletion_jobs.save(dict(job, collections=dict(job["collections"])))
+
+
+async def _delete_auth_user(uid: str) -> None:
+    try:
+        await run_in_threadpool(firebase_auth.delete_user, uid)
+    except firebase_auth.UserNotFoundError:
+        pass  # deleted by an earlier run of this job
+
+
+async def delete_account(store, job: dict) -> None:
+    """
+    Runs job to completion. The Auth account goes first: if that fails the
+    data is still intact and the user can retry. Orphaned data is
+    recoverable; an orphaned Auth account is not.
+    """
+    uid = job["uid"]
+    await _save(store, job, status="running", error=None)
+    if not job["auth_deleted"]:
+        await _delete_auth_user(uid)
+        await _save(store, job, auth_deleted=True)
+
+    async def delete_collection(name: str) -> None:
+        job["collections"][name] = await store.delete_user_collection(uid, name)
+        await _save(store, job)
+
+    # A resumed job repeats the collection it was in the middle of; the
+    # finished ones are skipped
+    remaining = [name for name in await store.user_collections(uid) if name not in job["collections"]]
+    await asyncio.gather(*(delete_collection(name) for name in remaining))
+    await store.delete_user_record(uid)
+    await _save(store, job, status="done")
+    logger.info("Account deleted for user %s (%d records)", uid, sum(job["collections"].values()))
+
+
+class AccountDeleter:
+    """Runs deletion jobs as tasks on the event loop, one per uid and at most concurrency at once."""
+
+    def __init__(self, concurrency: int = 4):
+        self.concurrency = concurrency
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+
+    def start(self, store, job: dict) -> bool:
+        """Starts job unless one for the same user is already running here."""
+        uid = job["uid"]
+        task = self._tasks.get(uid)
+        if task is not None and not task.done():
+            return False
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Semaphores belong to the loop they were first used on
+            self._loop, self._slots = loop, asyncio.Semaphore(self.concurrency)
+        self.started += 1
+        self._tasks[uid] = loop.create_task(self._run(store, job))
+        return True
+
+    async def _run(self, store, job: dict) -> None:
+        uid = job["uid"]
+        async with self._slots:
+            try:
+                await delete_account(store, job)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.exception("Account deletion failed for user %s", uid)
+                try:
+                    await _save(store, job, status="failed", error=type(e).__name__)
+                except Exception:
+                    logger.exception("Could not record failed account deletion for user %s", uid)
+            finally:
+                if self._tasks.get(uid) is asyncio.current_task():
+                    del self._tasks[uid]
+
+    async def resume_unfinished(self, store) -> int:
+        """Restarts jobs a previous process left unfinished; returns how many."""
+        jobs = await store.deletion_jobs.unfinished()
+        started = sum(self.start(store, job) for job in jobs)
+        if started:
+            logger.info("Resumed %d unfinished account deletions", started)
+        return started
+
+    def stats(self) -> dict:
+        return {
+            "running": sum(not task.done() for task in self._tasks.values()),
+            "started": self.started,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+deleter = AccountDeleter(concurrency=CONCURRENCY)
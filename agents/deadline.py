@@ -0,0 +1,93 @@
+import asyncio
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterator, Optional
+
+# Absolute time.monotonic() deadline for the current request, if any.
+# Context variables follow asyncio tasks and run_in_threadpool calls, so the
+# budget set by a handler reaches every agent and model call beneath it.
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("llm_deadline", default=None)
+
+# Not worth starting a model call (or a retry/fallback) with less than this left
+MIN_ATTEMPT_SECONDS = float(os.getenv("LLM_MIN_ATTEMPT_SECONDS", "3"))
+
+# How long past the deadline run_with_deadline waits before cancelling outright
+_HARD_STOP_GRACE_SECONDS = 1.0
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's time budget ran out before the work could finish."""
+
+
+class ClientDisconnected(Exception):
+    """The HTTP client went away, so the remaining work was abandoned."""
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[None]:
+    """Sets a budget for the enclosed work. Nested scopes can only shorten it."""
+    if seconds is None:
+        yield
+        return
+    new_deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(new_deadline if current is None else min(current, new_deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current budget, or None when no deadline is set."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check(min_seconds: Optional[float] = None) -> None:
+    """Raises DeadlineExceeded unless min_seconds (default MIN_ATTEMPT_SECONDS) remain."""
+    left = remaining()
+    if left is not None and left < (MIN_ATTEMPT_SECONDS if min_seconds is None else min_seconds):
+        raise DeadlineExceeded("Request deadline exceeded")
+
+
+def clamp_timeout(timeout: float) -> float:
+    """Per-call timeout shrunk to the remaining budget; raises if too little is left."""
+    check()
+    left = remaining()
+    return timeout if left is None else min(timeout, left)
+
+
+async def run_with_deadline(
+    coro_fn: Callable[[], Awaitable[Any]],
+    seconds: float,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    poll_interval: float = 0.5,
+) -> Any:
+    """
+    Runs coro_fn() under a deadline_scope of seconds. The work is cancelled
+    if is_disconnected() reports the client has gone (ClientDisconnected) or
+    if it overruns the budget (DeadlineExceeded).
+    """
+    with deadline_scope(seconds):
+        task = asyncio.ensure_future(coro_fn())  # the task inherits the deadline
+        hard_stop = time.monotonic() + seconds + _HARD_STOP_GRACE_SECONDS
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if is_disconnected is not None and await is_disconnected():
+                raise ClientDisconnected("Client disconnected")
+            if time.monotonic() >= hard_stop:
+                raise DeadlineExceeded("Request deadline exceeded")
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,173 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable, Dict
+
+
+class HedgeStats:
+    """
+    Counters for hedged model calls plus a window of primary-model latencies,
+    so the hedge budget can be tuned against the primary's observed p95.
+    """
+
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self._latencies: deque = deque(maxlen=window)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def record(self, hedged: bool, hedge_won: bool) -> None:
+        with self._lock:
+            self.calls += 1
+            self.hedged += hedged
+            self.hedge_wins += hedge_won
+
+    def record_primary_latency(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def _percentile(self, samples: list, q: float) -> float:
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            samples = sorted(self._latencies)
+            return {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_rate": self.hedged / self.calls if self.calls else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "hedge_win_rate": self.hedge_wins / self.hedged if self.hedged else 0.0,
+                "primary_p50_seconds": self._percentile(samples, 0.50),
+                "primary_p95_seconds": self._percentile(samples, 0.95),
+            }
+
+
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+
+
+def _submit(fn: Callable[[], Any]):
+    # Worker threads don't inherit context variables (e.g. the request deadline)
+    return _executor.submit(contextvars.copy_context().run, fn)
+
+
+def _timed(fn: Callable[[], Any], stats: HedgeStats) -> Callable[[], Any]:
+    def run():
+        start = time.monotonic()
+        result = fn()
+        stats.record_primary_latency(time.monotonic() - start)
+        return result
+    return run
+
+
+def run_hedged(
+    primary: Callable[[], Any],
+    fallback: Callable[[], Any],
+    budget: float,
+    stats: HedgeStats,
+    is_valid: Callable[[Any], bool],
+    should_fallback: Callable[[Exception], bool],
+) -> Any:
+    """
+    Calls primary; if it has not answered within budget seconds, starts
+    fallback in parallel and returns the first valid response. A primary
+    failure inside the budget falls back sequentially, as without hedging.
+    Threads can't be interrupted, so the losing call finishes in the
+    background and its result is discarded.
+    """
+    primary_future = _submit(_timed(primary, stats))
+    try:
+        result = primary_future.result(timeout=budget)
+        stats.record(hedged=False, hedge_won=False)
+        return result
+    except FutureTimeoutError:
+        pass
+    except Exception as e:
+        stats.record(hedged=False, hedge_won=False)
+        if should_fallback(e):
+            return fallback()
+        raise
+
+    fallback_future = _submit(fallback)
+    pending = {primary_future, fallback_future}
+    last_result, last_error = None, None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                last_error = e
+                continue
+            if is_valid(result):
+                for other in pending:
+                    other.cancel()
+                stats.record(hedged=True, hedge_won=future is fallback_future)
+                return result
+            last_result = result
+    stats.record(hedged=True, hedge_won=False)
+    if last_result is not None:
+        return last_result
+    raise last_error
+
+
+async def run_hedged_async(
+    primary: Callable[[], Awaitable[Any]],
+    fallback: Callable[[], Awaitable[Any]],
+    budget: float,
+    stats: HedgeStats,
+    is_valid: Callable[[Any], bool],
+    should_fallback: Callable[[Exception], bool],
+) -> Any:
+    """asyncio version of run_hedged; the losing request is cancelled."""
+    async def timed_primary():
+        start = time.monotonic()
+        result = await primary()
+        stats.record_primary_latency(time.monotonic() - start)
+        return result
+
+    primary_task = asyncio.ensure_future(timed_primary())
+    tasks = [primary_task]
+    try:
+        done, _ = await asyncio.wait({primary_task}, timeout=budget)
+        if done:
+            stats.record(hedged=False, hedge_won=False)
+            try:
+                return primary_task.result()
+            except Exception as e:
+                if should_fallback(e):
+                    return await fallback()
+                raise
+
+        fallback_task = asyncio.ensure_future(fallback())
+        tasks.append(fallback_task)
+        pending = set(tasks)
+        last_result, last_error = None, None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    result = task.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if is_valid(result):
+                    stats.record(hedged=True, hedge_won=task is fallback_task)
+                    return result
+                last_result = result
+        stats.record(hedged=True, hedge_won=False)
+        if last_result is not None:
+            return last_result
+        raise last_error
+    finally:
+        # Cancel the loser (or everything, if our caller was cancelled)
+        for task in tasks:
+            if not task.done():
+                task.cancel()
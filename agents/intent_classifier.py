@@ -0,0 +1,155 @@
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INTENTS = ("log_nutrition", "suggest_recipe", "vision_scan", "general_chat")
+
+# Intents whose orchestrator reply is only an acknowledgement, so a confident
+# local decision can skip the LLM entirely. general_chat always needs the model.
+BYPASS_INTENTS = ("log_nutrition", "suggest_recipe", "vision_scan")
+
+_EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_examples.jsonl")
+
+# Set above 1.0 to disable the local bypass
+DEFAULT_THRESHOLD = float(os.getenv("INTENT_CLASSIFIER_THRESHOLD", "0.85"))
+
+# What has to follow "I had" / "I ate" for it to be about a meal: an amount
+# or a food, within a few words ("I had 2 eggs", not "I had a bad day")
+_AMOUNT = r"(\d+(\.\d+)?|one|two|three|four|five|six|half|(bowl|cup|plate|slice|piece|glass|serving|handful|can|bottle|portion)s? of)"
+_FOOD = (
+    r"(eggs?|toast|bread|bagel|rice|pasta|spaghetti|noodles|ramen|pho|chicken|beef|steak|pork|bacon|fish|salmon|tuna"
+    r"|salad|soup|sandwich|wrap|burger|cheeseburger|kebab|pizza|oatmeal|oats|cereal|granola|yogh?urt|fruit|apples?"
+    r"|bananas?|berries|avocado|cheese|milk|milkshake|latte|coffee|tea|juice|smoothie|shake|coke|soda|beer|wine"
+    r"|cookies?|cake|chocolate|chips|fries|tacos?|burrito|sushi|curry|beans|lentils|tofu|vegetables|veggies"
+    r"|potato(es)?|nuts|almonds|cashews|peanut|muffin|pancakes?|waffles?|omelett?e|lasagna|stir fry"
+    r"|breakfast|lunch|dinner|snack|meal)"
+)
+
+# High-precision patterns. A match is fed to the model as a feature; it
+# does not decide the intent on its own.
+_RULES: Dict[str, List[re.Pattern]] = {
+    "log_nutrition": [
+        re.compile(
+            r"\b(i|i've|i have|just)\s+(just\s+)?(had|ate|eaten|drank|snacked on)\s+"
+            rf"([\w'-]+\s+){{0,3}}?{_AMOUNT}?\s*\b({_AMOUNT}|{_FOOD})\b"
+        ),
+        re.compile(r"\b(log|track|record|add)\b.*\b(meal|breakfast|lunch|dinner|snack|to my log)\b"),
+        re.compile(r"^(breakfast|lunch|dinner|snack)\s*(was|:)"),
+        re.compile(r"\bfor (breakfast|lunch|dinner) i (had|ate)\b"),
+    ],
+    "suggest_recipe": [
+        re.compile(r"\bwhat (can|should|could) i (cook|make|bake|eat|prepare)\b"),
+        re.compile(r"\b(suggest|give me|show me|find me|recommend|any|some|easy|quick)\b.*\brecipes?\b"),
+        re.compile(r"\brecipes? (ideas?|suggestions?|using|with)\b"),
+        re.compile(r"\b(dinner|lunch|breakfast|meal) ideas?\b"),
+        re.compile(r"\bwhat'?s for (dinner|lunch|breakfast)\b"),
+    ],
+    "vision_scan": [
+        re.compile(r"\bscan(ning|ned)?\b"),
+        re.compile(r"\b(photo|picture|image|camera|snap)\b.*\b(fridge|receipt|pantry|groceries|shopping|food)\b"),
+        re.compile(r"\b(fridge|receipt|pantry|groceries|shopping)\b.*\b(photo|picture|image)\b"),
+        re.compile(r"\bupload\b.*\breceipt\b"),
+    ],
+}
+
+_TOKEN_RE = re.compile(r"[a-z']+|\d+(?:\.\d+)?")
+
+
+def _rule_hits(text: str) -> List[str]:
+    return [intent for intent, patterns in _RULES.items() if any(p.search(text) for p in patterns)]
+
+
+def _features(text: str) -> List[str]:
+    tokens = ["<num>" if t[0].isdigit() else t for t in _TOKEN_RE.findall(text)]
+    feats = ["<bias>"] + tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+    if len(tokens) <= 2:
+        feats.append("<short>")
+    feats.extend(f"<rule:{intent}>" for intent in _rule_hits(text))
+    return feats
+
+
+def load_examples(path: str = _EXAMPLES_PATH) -> List[Tuple[str, str]]:
+    """Bundled labelled set: one {"text", "intent"} JSON object per line."""
+    with open(path, encoding="utf-8") as f:
+        return [(row["text"], row["intent"]) for row in map(json.loads, f) if row]
+
+
+class IntentClassifier:
+    """
+    Local intent classifier: keyword/pattern rules plus a softmax-regression
+    model over unigram/bigram features, trained in pure Python from the
+    bundled labelled set. Classifies a message in microseconds.
+    """
+
+    def __init__(self, examples: Optional[Iterable[Tuple[str, str]]] = None,
+                 epochs: int = 30, learning_rate: float = 0.3, l2: float = 1e-4, seed: int = 0):
+        self._weights: Dict[str, Dict[str, float]] = {intent: {} for intent in INTENTS}
+        self.train(load_examples() if examples is None else list(examples), epochs, learning_rate, l2, seed)
+
+    def train(self, examples: List[Tuple[str, str]], epochs: int, learning_rate: float,
+              l2: float, seed: int) -> None:
+        data = [(_features(text.lower()), intent) for text, intent in examples]
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(data)
+            lr = learning_rate / (1 + epoch * 0.1)
+            for feats, label in data:
+                probs = self._probabilities(feats)
+                for intent in INTENTS:
+                    grad = probs[intent] - (1.0 if intent == label else 0.0)
+                    w = self._weights[intent]
+                    for f in feats:
+                        w[f] = w.get(f, 0.0) * (1 - lr * l2) - lr * grad
+
+    def _probabilities(self, feats: List[str]) -> Dict[str, float]:
+        scores = {
+            intent: sum(w.get(f, 0.0) for f in feats)
+            for intent, w in self._weights.items()
+        }
+        top = max(scores.values())
+        exp = {intent: math.exp(s - top) for intent, s in scores.items()}
+        total = sum(exp.values())
+        return {intent: e / total for intent, e in exp.items()}
+
+    def classify(self, message: str) -> Tuple[str, float]:
+        """Returns (intent, confidence), the model's most probable intent."""
+        probs = self._probabilities(_features(message.lower().strip()))
+        intent = max(probs, key=probs.get)
+        return intent, probs[intent]
+
+
+_classifier: Optional[IntentClassifier] = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier() -> IntentClassifier:
+    """Lazily trained process-wide classifier (a few ms, once)."""
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = IntentClassifier()
+    return _classifier
+
+
+def classify_for_bypass(message: str, threshold: Optional[float] = None) -> Optional[str]:
+    """
+    Returns the intent when it is confident enough to skip the orchestrator
+    LLM call, otherwise None. Never bypasses for general_chat.
+    """
+    threshold = DEFAULT_THRESHOLD if threshold is None else threshold
+    try:
+        intent, confidence = get_classifier().classify(message)
+    except Exception as e:
+        logger.warning("Intent classifier failed, deferring to LLM: %s", e)
+        return None
+    if intent in BYPASS_INTENTS and confidence >= threshold:
+        return intent
+    return None
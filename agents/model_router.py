@@ -0,0 +1,182 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Sequence
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class _ModelHealth:
+    def __init__(self, window: int):
+        self.outcomes: deque = deque(maxlen=window)   # True = success
+        self.latencies: deque = deque(maxlen=window)  # seconds, successful calls only
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.open_for = 0.0
+        self.probe_started_at = None
+
+
+class ModelRouter:
+    """
+    Process-wide model health tracker and circuit breaker shared by every
+    agent. Rolling success rate and latency are kept per model; sustained
+    rate limits / timeouts open that model's circuit so requests go straight
+    to a healthy model instead of paying a failed round trip first. After a
+    cool-down one half-open probe is let through; success closes the
+    circuit, failure re-opens it with a doubled cool-down.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        failure_rate: float = 0.5,
+        min_samples: int = 10,
+        window: int = 50,
+        open_seconds: float = 30.0,
+        max_open_seconds: float = 300.0,
+        probe_timeout: float = 120.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.failure_rate = failure_rate
+        self.min_samples = min_samples
+        self.window = window
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.probe_timeout = probe_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._models: Dict[str, _ModelHealth] = {}
+
+    def _health(self, model: str) -> _ModelHealth:
+        health = self._models.get(model)
+        if health is None:
+            health = self._models[model] = _ModelHealth(self.window)
+        return health
+
+    def _refresh(self, health: _ModelHealth, now: float) -> None:
+        if health.state == OPEN and now - health.opened_at >= health.open_for:
+            health.state = HALF_OPEN
+            health.probe_started_at = None
+
+    def _open(self, health: _ModelHealth, now: float) -> None:
+        # Re-opening after a failed probe backs off exponentially
+        if health.state == HALF_OPEN:
+            health.open_for = min(health.open_for * 2, self.max_open_seconds)
+        else:
+            health.open_for = self.open_seconds
+        health.state = OPEN
+        health.opened_at = now
+        health.probe_started_at = None
+
+    def order(self, models: Sequence[str]) -> List[str]:
+        """Models in preference order with healthy ones first and open circuits last."""
+        rank = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+        now = self._clock()
+        with self._lock:
+            states = {}
+            for m in models:
+                health = self._health(m)
+                self._refresh(health, now)
+                states[m] = health.state
+        return sorted(models, key=lambda m: rank[states[m]])
+
+    def state(self, model: str) -> str:
+        now = self._clock()
+        with self._lock:
+            health = self._health(model)
+            self._refresh(health, now)
+            return health.state
+
+    def allow(self, model: str) -> bool:
+        """
+        Gate checked immediately before calling model. Closed circuits always
+        pass; a half-open circuit passes one probe at a time; open ones don't.
+        """
+        now = self._clock()
+        with self._lock:
+            health = self._health(model)
+            self._refresh(health, now)
+            if health.state == CLOSED:
+                return True
+            if health.state == HALF_OPEN:
+                stale = (
+                    health.probe_started_at is not None
+                    and now - health.probe_started_at >= self.probe_timeout
+                )
+                if health.probe_started_at is None or stale:
+                    health.probe_started_at = now
+                    return True
+            return False
+
+    def release_probe(self, model: str) -> None:
+        """
+        For a call let through by allow() that ended without a success or
+        failure being recorded (cancelled, out of budget, or an error that
+        says nothing about the model): the next caller may probe at once
+        instead of waiting out probe_timeout. No-op unless half-open.
+        """
+        with self._lock:
+            health = self._models.get(model)
+            if health is not None and health.state == HALF_OPEN:
+                health.probe_started_at = None
+
+    def record_success(self, model: str, latency: float) -> None:
+        with self._lock:
+            health = self._health(model)
+            health.outcomes.append(True)
+            health.latencies.append(latency)
+            health.consecutive_failures = 0
+            if health.state != CLOSED:
+                health.state = CLOSED
+                health.probe_started_at = None
+
+    def record_failure(self, model: str) -> None:
+        """Record a rate-limit / timeout / unavailable failure for model."""
+        now = self._clock()
+        with self._lock:
+            health = self._health(model)
+            health.outcomes.append(False)
+            health.consecutive_failures += 1
+            if health.state == HALF_OPEN:
+                self._open(health, now)
+                return
+            if health.state == OPEN:
+                return
+            samples = len(health.outcomes)
+            failures = samples - sum(health.outcomes)
+            if (
+                health.consecutive_failures >= self.failure_threshold
+                or (samples >= self.min_samples and failures / samples >= self.failure_rate)
+            ):
+                self._open(health, now)
+
+    def stats(self) -> Dict[str, dict]:
+        now = self._clock()
+        with self._lock:
+            result = {}
+            for model, health in self._models.items():
+                self._refresh(health, now)
+                samples = len(health.outcomes)
+                latencies = sorted(health.latencies)
+                result[model] = {
+                    "state": health.state,
+                    "samples": samples,
+                    "success_rate": sum(health.outcomes) / samples if samples else None,
+                    "consecutive_failures": health.consecutive_failures,
+                    "latency_p50_seconds": latencies[len(latencies) // 2] if latencies else None,
+                    "latency_p95_seconds": (
+                        latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else None
+                    ),
+                    "open_remaining_seconds": (
+                        max(0.0, health.opened_at + health.open_for - now) if health.state == OPEN else 0.0
+                    ),
+                }
+            return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._models.clear()
@@ -1,27 +1,37 @@
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import schemas
 from gemini_client import API_KEY
-from .utils import clean_json_response, generate_with_fallback
+from .deadline import DeadlineExceeded
+from .utils import (
+    JsonParseError,
+    generate_with_fallback,
+    generate_with_fallback_async,
+    invalidate_cached_response,
+    json_stats,
+    parse_json_response,
+    response_schema_for,
+)
 
 logger = logging.getLogger(__name__)
 
 _MAX_RETRIES = 3
+# Macro estimates for an identical meal description do not go stale
+_CACHE_TTL_SECONDS = 3600
+# Summaries embed the log list in the prompt, so new logs miss the cache anyway
+_SUMMARY_CACHE_TTL_SECONDS = 300
+# A repaired (possibly truncated) estimate is only usable if every macro survived
+_MEAL_KEYS = ("calories", "protein", "carbs", "fat")
+_MEAL_SCHEMA = response_schema_for(schemas.NutritionLogBase, exclude=("date",))
 
 
-def analyze_meal(meal_description: str) -> Dict[str, Any]:
-    """
-    Analyzes a natural language meal description and estimates macros and calories.
-    Retries up to _MAX_RETRIES times if the model returns invalid JSON.
-    """
-    if not API_KEY:
-        raise ValueError("Gemini API key is not configured.")
-
-    prompt = f"""
+def _meal_prompt(meal_description: str) -> str:
+    return f"""
     Analyze the following meal description and estimate its nutritional content.
     Meal: "{meal_description}"
 
@@ -39,57 +49,98 @@ def analyze_meal(meal_description: str) -> Dict[str, Any]:
     Example: {{"meal_name": "Grilled Chicken Salad", "calories": 420, "protein": 38, "carbs": 18, "fat": 22}}
     """
 
-    last_error: Exception | None = None
 
-    for attempt in range(1, _MAX_RETRIES + 1):
-        response = None
-        try:
-            response = generate_with_fallback(prompt)
+def _parse_meal(response) -> Dict[str, Any]:
+    if not response.parts:
+        raise ValueError("Model returned an empty response.")
 
-            if not response.parts:
-                raise ValueError("Model returned an empty response.")
+    text_response = response.text.strip()
+    if not text_response:
+        raise ValueError("Model returned blank text.")
 
-            text_response = response.text.strip()
-            if not text_response:
-                raise ValueError("Model returned blank text.")
+    return parse_json_response(text_response, expect=dict, required_keys=_MEAL_KEYS)
 
-            result = clean_json_response(text_response)
 
-            if not isinstance(result, dict):
-                raise ValueError(f"Expected a JSON object, got: {type(result).__name__}")
+def _on_meal_attempt_failure(e: Exception, response, attempt: int, prompt: str) -> Exception:
+    """
+    Shared except-branch of the sync and async retry loops.
+    Raises when the error should not be retried, otherwise returns it.
+    """
+    invalidate_cached_response(prompt, response_schema=_MEAL_SCHEMA)
+    if isinstance(e, (ValueError, DeadlineExceeded)) and not isinstance(e, JsonParseError):
+        raise e
 
-            return result
+    raw_preview = response.text[:200] if response is not None else ""
 
-        except ValueError:
-            raise
-        except Exception as e:
-            raw_preview = response.text[:200] if response is not None else ""
+    if "429" in str(e) or "ResourceExhausted" in str(e):
+        raise ValueError("The AI is currently busy. Please wait a moment and try again.")
 
-            if "429" in str(e) or "ResourceExhausted" in str(e):
-                raise ValueError("The AI is currently busy. Please wait a moment and try again.")
+    logger.warning(
+        "Nutrition agent attempt %d/%d failed: %s | raw: %r",
+        attempt, _MAX_RETRIES, e, raw_preview,
+    )
+    return e
 
-            logger.warning(
-                "Nutrition agent attempt %d/%d failed: %s | raw: %r",
-                attempt, _MAX_RETRIES, e, raw_preview,
-            )
-            last_error = e
 
+def _meal_retries_exhausted(last_error: Optional[Exception]) -> ValueError:
     logger.error("Nutrition agent failed after %d attempts. Last error: %s", _MAX_RETRIES, last_error)
-    raise ValueError(
+    return ValueError(
         "The AI could not analyse the meal after several attempts. Please try again."
     )
 
 
-def generate_health_summary(logs: List[Dict[str, Any]]) -> str:
+def analyze_meal(meal_description: str) -> Dict[str, Any]:
     """
-    Generates a brief health summary and recommendations based on recent nutrition logs.
+    Analyzes a natural language meal description and estimates macros and calories.
+    Malformed JSON is repaired locally first; only output that cannot be
+    repaired is regenerated, up to _MAX_RETRIES times, as long as the
+    request's deadline budget leaves time for another attempt.
     """
     if not API_KEY:
         raise ValueError("Gemini API key is not configured.")
 
-    if not logs:
-        return "No nutrition logs found. Start logging your meals to get insights!"
+    prompt = _meal_prompt(meal_description)
+    last_error: Exception | None = None
+
+    for attempt in range(1, _MAX_RETRIES + 1):
+        if attempt > 1:
+            json_stats.record("retries")
+        response = None
+        try:
+            response = generate_with_fallback(
+                prompt, cache_ttl=_CACHE_TTL_SECONDS, response_schema=_MEAL_SCHEMA,
+            )
+            return _parse_meal(response)
+        except Exception as e:
+            last_error = _on_meal_attempt_failure(e, response, attempt, prompt)
+
+    raise _meal_retries_exhausted(last_error)
+
+
+async def analyze_meal_async(meal_description: str) -> Dict[str, Any]:
+    """Async variant of analyze_meal; awaits the model instead of blocking a thread."""
+    if not API_KEY:
+        raise ValueError("Gemini API key is not configured.")
+
+    prompt = _meal_prompt(meal_description)
+    last_error: Exception | None = None
+
+    for attempt in range(1, _MAX_RETRIES + 1):
+        if attempt > 1:
+            json_stats.record("retries")
+        response = None
+        try:
+            response = await generate_with_fallback_async(
+                prompt, cache_ttl=_CACHE_TTL_SECONDS, response_schema=_MEAL_SCHEMA,
+            )
+            return _parse_meal(response)
+        except Exception as e:
+            last_error = _on_meal_attempt_failure(e, response, attempt, prompt)
+
+    raise _meal_retries_exhausted(last_error)
+
 
+def _summary_prompt(logs: List[Dict[str, Any]]) -> str:
     logs_context = "\n".join([
         f"- {log['date']}: {log['meal_name']} "
         f"({log['calories']} kcal, {log['protein']}g protein, "
@@ -97,7 +148,7 @@ def generate_health_summary(logs: List[Dict[str, Any]]) -> str:
         for log in logs
     ])
 
-    prompt = f"""
+    return f"""
     You are an expert nutritionist AI. Analyze the user's recent meal logs:
     {logs_context}
 
@@ -107,11 +158,46 @@ def generate_health_summary(logs: List[Dict[str, Any]]) -> str:
     Keep it brief and conversational. Do not use JSON. Do not use <think> blocks.
     """
 
+
+_NO_LOGS_SUMMARY = "No nutrition logs found. Start logging your meals to get insights!"
+_BUSY_SUMMARY = "The AI is currently busy generating your summary. Please refresh in a moment!"
+
+
+def generate_health_summary(logs: List[Dict[str, Any]]) -> str:
+    """
+    Generates a brief health summary and recommendations based on recent nutrition logs.
+    """
+    if not API_KEY:
+        raise ValueError("Gemini API key is not configured.")
+
+    if not logs:
+        return _NO_LOGS_SUMMARY
+
+    try:
+        response = generate_with_fallback(_summary_prompt(logs), cache_ttl=_SUMMARY_CACHE_TTL_SECONDS)
+        return response.text.strip()
+    except Exception as e:
+        if "429" in str(e) or "ResourceExhausted" in str(e):
+            return _BUSY_SUMMARY
+        logger.error("Health summary failed: %s", e)
+        raise
+
+
+async def generate_health_summary_async(logs: List[Dict[str, Any]]) -> str:
+    """Async variant of generate_health_summary."""
+    if not API_KEY:
+        raise ValueError("Gemini API key is not configured.")
+
+    if not logs:
+        return _NO_LOGS_SUMMARY
+
     try:
-        response = generate_with_fallback(prompt)
+        response = await generate_with_fallback_async(
+            _summary_prompt(logs), cache_ttl=_SUMMARY_CACHE_TTL_SECONDS,
+        )
         return response.text.strip()
     except Exception as e:
         if "429" in str(e) or "ResourceExhausted" in str(e):
-            return "The AI is currently busy generating your summary. Please refresh in a moment!"
+            return _BUSY_SUMMARY
         logger.error("Health summary failed: %s", e)
         raise
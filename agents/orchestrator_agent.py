@@ -1,24 +1,46 @@
 import json
-import google.generativeai as genai
 from typing import Dict, Any, List, Optional
 
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import schemas
 from gemini_client import API_KEY
-from .utils import clean_json_response
+from .intent_classifier import INTENTS, classify_for_bypass
+from .utils import (
+    generate_with_fallback,
+    generate_with_fallback_async,
+    parse_json_response,
+    response_schema_for,
+)
 
-def process_chat(message: str, history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
-    """
-    Takes a natural language message and determines the user's intent to route to the correct agent.
-    Returns a dict with 'intent' and an optional 'response' or 'extracted_data'.
-    """
-    if not API_KEY:
-        raise ValueError("Gemini API key is not configured.")
+_MACRO_KEYS = ("calories", "protein", "carbs", "fat")
 
-    model = genai.GenerativeModel("models/gemma-3-27b-it")
+_NUTRITION_KEY_PROMPT = """    - "nutrition": If log_nutrition, an object estimating the meal's nutritional content with keys
+      "meal_name" (short title), "calories", "protein", "carbs", "fat" (integers; grams for macros).
+      Example: {"meal_name": "Grilled Chicken Salad", "calories": 420, "protein": 38, "carbs": 18, "fat": 22}
+      Otherwise, null.
+"""
 
+
+# Structured-output schemas: the reply fields of ChatResponse (nutrition_log is
+# written server-side), with intent pinned to the known intents.
+_INTENT_PROPERTY = {"intent": {"type": "string", "enum": list(INTENTS)}}
+_CHAT_SCHEMA = response_schema_for(
+    schemas.ChatResponse, exclude=("nutrition_log",), extra_properties=_INTENT_PROPERTY,
+)
+_CHAT_WITH_NUTRITION_SCHEMA = response_schema_for(
+    schemas.ChatResponse,
+    exclude=("nutrition_log",),
+    extra_properties={
+        **_INTENT_PROPERTY,
+        "nutrition": {**response_schema_for(schemas.NutritionLogBase, exclude=("date",)), "nullable": True},
+    },
+)
+
+
+def _chat_prompt(message: str, history: Optional[List[Dict[str, str]]], include_nutrition: bool = False) -> str:
     history_text = ""
     if history:
         history_text = "\nRecent conversation history:\n"
@@ -26,7 +48,7 @@ def process_chat(message: str, history: Optional[List[Dict[str, str]]] = None) -
             role = "User" if msg.get("role") == "user" else "xoxo"
             history_text += f'  {role}: "{msg.get("content", "")}"\n'
 
-    prompt = f"""
+    return f"""
     You are xoxo, the Orchestrator for a Smart Inventory & Nutrition app.
     You can help users: log meals for nutrition tracking, suggest recipes from their pantry, or have general conversations.
     {history_text}
@@ -46,22 +68,123 @@ def process_chat(message: str, history: Optional[List[Dict[str, str]]] = None) -
     - "intent": One of the exact strings above.
     - "extracted_data": If log_nutrition, put the food description. Otherwise, empty string.
     - "response": A friendly, brief text response from xoxo acknowledging their request.
+{_NUTRITION_KEY_PROMPT if include_nutrition else ""}    """
+
+
+_LOCAL_REPLIES = {
+    "log_nutrition": "Got it! Logging that meal for you now.",
+    "suggest_recipe": "Let me find some recipes you can make with what's in your pantry!",
+    "vision_scan": "Sure! Upload a photo of your fridge or receipt and I'll add the items for you.",
+}
+
+
+def _local_reply(intent: str, message: str) -> Dict[str, Any]:
+    """Reply for a message the local classifier routed without an LLM call."""
+    return {
+        "intent": intent,
+        "response": _LOCAL_REPLIES[intent],
+        "extracted_data": message if intent == "log_nutrition" else "",
+    }
+
+
+def _local_intent(message: str, include_nutrition: bool) -> Optional[str]:
     """
+    The bypass intent, if any. A meal to be logged needs the model's
+    estimate, so with include_nutrition log_nutrition goes to the combined
+    call, which returns the reply and the macros together.
+    """
+    intent = classify_for_bypass(message)
+    if include_nutrition and intent == "log_nutrition":
+        return None
+    return intent
+
 
+def extract_nutrition(result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Returns the combined-mode "nutrition" payload when it is usable, else None.
+    Macros are coerced to numbers; a missing or non-numeric macro rejects it.
+    """
+    payload = result.get("nutrition")
+    if result.get("intent") != "log_nutrition" or not isinstance(payload, dict):
+        return None
     try:
-        response = model.generate_content(prompt)
-        text_response = response.text.strip()
-        return clean_json_response(text_response)
-    except Exception as e:
-        if "429" in str(e) or "ResourceExhausted" in str(e):
-            return {
-                "intent": "general_chat",
-                "response": "I'm a bit overwhelmed with requests right now. Please wait a few seconds and try again!",
-                "extracted_data": ""
-            }
-        print(f"Orchestrator error: {str(e)}")
+        macros = {k: float(payload[k]) for k in _MACRO_KEYS}
+    except (KeyError, TypeError, ValueError):
+        return None
+    meal_name = str(payload.get("meal_name") or result.get("extracted_data") or "Unknown Meal")
+    return {"meal_name": meal_name, **macros}
+
+
+def _fallback_reply(e: Exception) -> Dict[str, Any]:
+    if "429" in str(e) or "ResourceExhausted" in str(e):
         return {
             "intent": "general_chat",
-            "response": "I'm sorry, I'm having trouble connecting to my brain right now.",
+            "response": "I'm a bit overwhelmed with requests right now. Please wait a few seconds and try again!",
             "extracted_data": ""
         }
+    print(f"Orchestrator error: {str(e)}")
+    return {
+        "intent": "general_chat",
+        "response": "I'm sorry, I'm having trouble connecting to my brain right now.",
+        "extracted_data": ""
+    }
+
+
+def process_chat(
+    message: str,
+    history: Optional[List[Dict[str, str]]] = None,
+    include_nutrition: bool = False,
+) -> Dict[str, Any]:
+    """
+    Takes a natural language message and determines the user's intent to route to the correct agent.
+    Returns a dict with 'intent' and an optional 'response' or 'extracted_data'.
+    With include_nutrition=True the same generation also estimates the meal's
+    macros under 'nutrition' (see extract_nutrition), saving a second model call.
+    Obvious action intents are decided by the local classifier without any
+    model call; only ambiguous messages and general chat reach the LLM.
+    """
+    if not API_KEY:
+        raise ValueError("Gemini API key is not configured.")
+
+    local_intent = _local_intent(message, include_nutrition)
+    if local_intent is not None:
+        return _local_reply(local_intent, message)
+
+    prompt = _chat_prompt(message, history, include_nutrition)
+
+    try:
+        # Routed through the shared model chain; chat replies are never replayed from cache
+        response = generate_with_fallback(
+            prompt, chain="chat", use_cache=False,
+            response_schema=_CHAT_WITH_NUTRITION_SCHEMA if include_nutrition else _CHAT_SCHEMA,
+        )
+        text_response = response.text.strip()
+        return parse_json_response(text_response, expect=dict)
+    except Exception as e:
+        return _fallback_reply(e)
+
+
+async def process_chat_async(
+    message: str,
+    history: Optional[List[Dict[str, str]]] = None,
+    include_nutrition: bool = False,
+) -> Dict[str, Any]:
+    """Async variant of process_chat for the async /agents/chat handler."""
+    if not API_KEY:
+        raise ValueError("Gemini API key is not configured.")
+
+    local_intent = _local_intent(message, include_nutrition)
+    if local_intent is not None:
+        return _local_reply(local_intent, message)
+
+    prompt = _chat_prompt(message, history, include_nutrition)
+
+    try:
+        response = await generate_with_fallback_async(
+            prompt, chain="chat", use_cache=False,
+            response_schema=_CHAT_WITH_NUTRITION_SCHEMA if include_nutrition else _CHAT_SCHEMA,
+        )
+        text_response = response.text.strip()
+        return parse_json_response(text_response, expect=dict)
+    except Exception as e:
+        return _fallback_reply(e)
@@ -1,12 +1,24 @@
 import logging
-from typing import List, Dict, Any
+from typing import AsyncIterator, List, Dict, Any, Optional
 
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import schemas
 from gemini_client import API_KEY
-from .utils import clean_json_response, generate_with_fallback
+from .deadline import DeadlineExceeded
+from .utils import (
+    JsonArrayStreamParser,
+    JsonParseError,
+    generate_with_fallback,
+    generate_with_fallback_async,
+    invalidate_cached_response,
+    json_stats,
+    parse_json_response,
+    response_schema_for,
+    stream_with_fallback_async,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -58,65 +70,165 @@ Example of correct format:
 """
 
 _MAX_RETRIES = 3
+# Identical pantry + preferences within this window reuse the last suggestions
+_CACHE_TTL_SECONDS = 600
+_RECIPES_SCHEMA = response_schema_for(schemas.RecipeResponse, many=True)
 
 
-def suggest_recipes(pantry_items: List[Dict[str, Any]], preferences: str = "", time_of_day: str = "") -> List[Dict[str, Any]]:
-    """
-    Sends the user's pantry items to Gemini to get suggested recipes.
-    Retries up to _MAX_RETRIES times if the model returns invalid JSON.
-    """
-    if not API_KEY:
-        raise ValueError("Gemini API key is not configured.")
-
+def _recipe_prompt(pantry_items: List[Dict[str, Any]], preferences: str, time_of_day: str) -> str:
     pantry_context = "\n".join(
         [f"- {item['name']}: {item['quantity']} {item['unit']}" for item in pantry_items]
     ) or "No items in pantry."
 
-    prompt = _PROMPT_TEMPLATE.format(
+    return _PROMPT_TEMPLATE.format(
         pantry_context=pantry_context,
         preferences=preferences or "None",
         time_of_day=time_of_day or "Any",
     )
 
-    last_error: Exception | None = None
 
-    for attempt in range(1, _MAX_RETRIES + 1):
-        response = None
-        try:
-            response = generate_with_fallback(prompt)
+def _parse_recipes(response) -> List[Dict[str, Any]]:
+    # Guard against blocked/empty responses
+    if not response.parts:
+        raise ValueError("Model returned an empty response (possibly blocked by safety filters).")
 
-            # Guard against blocked/empty responses
-            if not response.parts:
-                raise ValueError("Model returned an empty response (possibly blocked by safety filters).")
+    text_response = response.text.strip()
+    if not text_response:
+        raise ValueError("Model returned blank text.")
 
-            text_response = response.text.strip()
-            if not text_response:
-                raise ValueError("Model returned blank text.")
+    result = parse_json_response(text_response, expect=list)
+    if not result:
+        raise JsonParseError("Expected a non-empty JSON array of recipes.")
 
-            result = clean_json_response(text_response)
+    return result
 
-            # Validate it's a non-empty list
-            if not isinstance(result, list) or len(result) == 0:
-                raise ValueError(f"Expected a JSON array, got: {type(result).__name__}")
 
-            return result
+def _on_recipe_attempt_failure(e: Exception, response, attempt: int, prompt: str) -> Exception:
+    """
+    Shared except-branch of the sync and async retry loops.
+    Raises when the error should not be retried, otherwise returns it.
+    """
+    invalidate_cached_response(prompt, response_schema=_RECIPES_SCHEMA)
+    if isinstance(e, (ValueError, DeadlineExceeded)) and not isinstance(e, JsonParseError):
+        raise e  # propagate rate-limit / config / out-of-time errors immediately
 
-        except ValueError:
-            raise  # propagate rate-limit / config errors immediately
-        except Exception as e:
-            raw_preview = response.text[:300] if response is not None else ""
+    raw_preview = response.text[:300] if response is not None else ""
 
-            if "429" in str(e) or "ResourceExhausted" in str(e):
-                raise ValueError("The Recipe AI is currently busy. Please wait a moment and try again.")
+    if "429" in str(e) or "ResourceExhausted" in str(e):
+        raise ValueError("The Recipe AI is currently busy. Please wait a moment and try again.")
 
-            logger.warning(
-                "Recipe agent attempt %d/%d failed: %s | raw preview: %r",
-                attempt, _MAX_RETRIES, e, raw_preview,
-            )
-            last_error = e
+    logger.warning(
+        "Recipe agent attempt %d/%d failed: %s | raw preview: %r",
+        attempt, _MAX_RETRIES, e, raw_preview,
+    )
+    return e
 
+
+def _recipe_retries_exhausted(last_error: Optional[Exception]) -> ValueError:
     logger.error("Recipe agent failed after %d attempts. Last error: %s", _MAX_RETRIES, last_error)
-    raise ValueError(
+    return ValueError(
         "The AI could not generate a valid recipe response after several attempts. "
         "Please try again in a moment."
     )
+
+
+def suggest_recipes(pantry_items: List[Dict[str, Any]], preferences: str = "", time_of_day: str = "") -> List[Dict[str, Any]]:
+    """
+    Sends the user's pantry items to Gemini to get suggested recipes.
+    Malformed JSON is repaired locally first; only output that cannot be
+    repaired is regenerated, up to _MAX_RETRIES times, as long as the
+    request's deadline budget leaves time for another attempt.
+    """
+    if not API_KEY:
+        raise ValueError("Gemini API key is not configured.")
+
+    prompt = _recipe_prompt(pantry_items, preferences, time_of_day)
+    last_error: Exception | None = None
+
+    for attempt in range(1, _MAX_RETRIES + 1):
+        if attempt > 1:
+            json_stats.record("retries")
+        response = None
+        try:
+            response = generate_with_fallback(
+                prompt, cache_ttl=_CACHE_TTL_SECONDS, response_schema=_RECIPES_SCHEMA,
+            )
+            return _parse_recipes(response)
+        except Exception as e:
+            last_error = _on_recipe_attempt_failure(e, response, attempt, prompt)
+
+    raise _recipe_retries_exhausted(last_error)
+
+
+async def suggest_recipes_async(pantry_items: List[Dict[str, Any]], preferences: str = "", time_of_day: str = "") -> List[Dict[str, Any]]:
+    """Async variant of suggest_recipes; awaits the model instead of blocking a thread."""
+    if not API_KEY:
+        raise ValueError("Gemini API key is not configured.")
+
+    prompt = _recipe_prompt(pantry_items, preferences, time_of_day)
+    last_error: Exception | None = None
+
+    for attempt in range(1, _MAX_RETRIES + 1):
+        if attempt > 1:
+            json_stats.record("retries")
+        response = None
+        try:
+            response = await generate_with_fallback_async(
+                prompt, cache_ttl=_CACHE_TTL_SECONDS, response_schema=_RECIPES_SCHEMA,
+            )
+            return _parse_recipes(response)
+        except Exception as e:
+            last_error = _on_recipe_attempt_failure(e, response, attempt, prompt)
+
+    raise _recipe_retries_exhausted(last_error)
+
+
+async def stream_recipes_async(
+    pantry_items: List[Dict[str, Any]], preferences: str = "", time_of_day: str = "",
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streams recipes one at a time, each as soon as its JSON object closes in
+    the model output. Uses the same prompt and cache entry as suggest_recipes.
+    Not retried: once a recipe has been yielded the request cannot restart.
+    """
+    if not API_KEY:
+        raise ValueError("Gemini API key is not configured.")
+
+    prompt = _recipe_prompt(pantry_items, preferences, time_of_day)
+    parser = JsonArrayStreamParser()
+    chunks: List[str] = []
+    emitted = 0
+
+    try:
+        async for chunk in stream_with_fallback_async(
+            prompt, cache_ttl=_CACHE_TTL_SECONDS, response_schema=_RECIPES_SCHEMA,
+        ):
+            chunks.append(chunk)
+            for recipe in parser.feed(chunk):
+                if isinstance(recipe, dict):
+                    emitted += 1
+                    yield recipe
+    except Exception as e:
+        invalidate_cached_response(prompt, response_schema=_RECIPES_SCHEMA)
+        if "429" in str(e) or "ResourceExhausted" in str(e):
+            raise ValueError("The Recipe AI is currently busy. Please wait a moment and try again.")
+        if emitted:
+            logger.warning("Recipe stream broke off after %d recipe(s): %s", emitted, e)
+            return
+        raise
+
+    if emitted:
+        return
+
+    # Output was not a recognisable array prefix — try the full-text parser once
+    try:
+        result = parse_json_response("".join(chunks).strip())
+    except Exception as e:
+        invalidate_cached_response(prompt, response_schema=_RECIPES_SCHEMA)
+        logger.warning("Recipe stream produced no parsable recipes: %s", e)
+        raise ValueError(
+            "The AI could not generate a valid recipe response. Please try again in a moment."
+        )
+    for recipe in result if isinstance(result, list) else [result]:
+        if isinstance(recipe, dict):
+            yield recipe
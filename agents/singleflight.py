@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, Type
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """
+    Thread-safe request coalescing: concurrent do() calls with the same key
+    share one execution of fn and all receive its result or its exception.
+    The key is forgotten as soon as the call finishes — this is not a cache.
+    A caller that joins an in-flight call waits at most timeout seconds
+    (TimeoutError) — the shared call itself keeps running.
+
+    Exceptions of the unshared types belong to the caller that ran fn (e.g.
+    its own deadline running out), so callers that joined it start over
+    and run or join the call again themselves.
+    """
+
+    def __init__(self, unshared: Tuple[Type[BaseException], ...] = ()):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.unshared = unshared
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        deadline = None if timeout is None else time.monotonic() + max(timeout, 0.0)
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                    self.executions += 1
+                else:
+                    self.coalesced += 1
+            if leader:
+                return self._lead(key, call, fn)
+            if not call.done.wait(None if deadline is None else max(deadline - time.monotonic(), 0.0)):
+                raise TimeoutError("Timed out waiting for an in-flight call")
+            if isinstance(call.error, self.unshared):
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+    def _lead(self, key: Hashable, call: _Call, fn: Callable[[], Any]) -> Any:
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls),
+            }
+
+
+class AsyncSingleFlight:
+    """
+    asyncio counterpart of SingleFlight. The shared call runs as its own task
+    and every caller awaits it through asyncio.shield, so one caller being
+    cancelled (e.g. client disconnect) or timing out does not cancel it for
+    the others. Callers that joined a task which was cancelled or failed with
+    an unshared exception start over, as in SingleFlight.
+    """
+
+    def __init__(self, unshared: Tuple[Type[BaseException], ...] = ()):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self.unshared = unshared
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]],
+                 timeout: Optional[float] = None) -> Any:
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + max(timeout, 0.0)
+        while True:
+            task = self._tasks.get(key)
+            joined = task is not None and not task.done() and task.get_loop() is loop
+            if joined:
+                self.coalesced += 1
+            else:
+                task = loop.create_task(fn())
+                self._tasks[key] = task
+                self.executions += 1
+                task.add_done_callback(lambda t, k=key: self._forget(k, t))
+            try:
+                if deadline is None:
+                    return await asyncio.shield(task)
+                return await asyncio.wait_for(asyncio.shield(task), max(deadline - loop.time(), 0.0))
+            except BaseException:
+                if joined and task.done() and (task.cancelled() or isinstance(task.exception(), self.unshared)):
+                    continue
+                raise
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved so orphaned failures aren't logged as unhandled
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._tasks),
+        }
@@ -1,9 +1,21 @@
+import hashlib
 import json
 import logging
+import os
 import re
-from typing import Any
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Sequence, Tuple, Type
 
 import google.generativeai as genai
+from pydantic import BaseModel
+
+from . import deadline
+from .cache import ResponseCache
+from .deadline import DeadlineExceeded
+from .hedging import HedgeStats, run_hedged, run_hedged_async
+from .model_router import CLOSED, ModelRouter
+from .singleflight import AsyncSingleFlight, SingleFlight
 
 logger = logging.getLogger(__name__)
 
@@ -15,14 +27,87 @@ _FALLBACK_MODEL = "models/gemma-3-12b-it"
 _VISION_PRIMARY = "gemini-2.5-flash"
 _VISION_FALLBACK = "gemini-2.0-flash"
 
+# Orchestrator keeps Gemma 27B as its first choice but now has a fallback
+_CHAT_PRIMARY = "models/gemma-3-27b-it"
+
+# Hedging: when the primary has not answered within hedge_after seconds the
+# fallback is raced against it instead of waiting out the full timeout.
+_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+
+# Structured output: models that support it are asked for JSON matching a
+# response schema instead of being told "return ONLY JSON" in prose.
+_STRUCTURED_OUTPUT_ENABLED = os.getenv("LLM_STRUCTURED_OUTPUT", "true").lower() == "true"
+
+
+class _ModelChain(NamedTuple):
+    models: Tuple[str, ...]
+    timeout: float
+    label: str
+    hedge_after: float
+    hedge_stats: HedgeStats
+
+
+_TEXT_CHAIN = _ModelChain(
+    models=(_PRIMARY_MODEL, _FALLBACK_MODEL),
+    timeout=60,
+    label="model",
+    hedge_after=float(os.getenv("LLM_HEDGE_AFTER_SECONDS", "10")),
+    hedge_stats=HedgeStats(),
+)
+_VISION_CHAIN = _ModelChain(
+    models=(_VISION_PRIMARY, _VISION_FALLBACK),
+    timeout=120,
+    label="vision model",
+    hedge_after=float(os.getenv("LLM_VISION_HEDGE_AFTER_SECONDS", "20")),
+    hedge_stats=HedgeStats(),
+)
+_CHAT_CHAIN = _ModelChain(
+    models=(_CHAT_PRIMARY, _PRIMARY_MODEL),
+    timeout=60,
+    label="chat model",
+    hedge_after=float(os.getenv("LLM_HEDGE_AFTER_SECONDS", "10")),
+    hedge_stats=HedgeStats(),
+)
+_TEXT_CHAINS = {"text": _TEXT_CHAIN, "chat": _CHAT_CHAIN}
+
+# Shared by every agent: per-model health and circuit breaker state, so a
+# model that keeps returning 429s/timeouts is skipped instead of retried first.
+model_router = ModelRouter(
+    failure_threshold=int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5")),
+    open_seconds=float(os.getenv("LLM_CIRCUIT_OPEN_SECONDS", "30")),
+)
+
+# In-process response cache shared by every agent. Keyed on the model chain
+# plus a hash of the normalised prompt, so identical requests (page refreshes,
+# double submits) are answered without another Gemini call.
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512")),
+    default_ttl=float(os.getenv("LLM_CACHE_TTL_SECONDS", "300")),
+)
+_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+
+# Concurrent identical prompts (double submits, retries after a 500) share
+# one upstream call instead of each spending quota. Same key as the cache.
+# A leader's DeadlineExceeded is its own budget running out, not an answer
+# for followers with time left.
+sync_flights = SingleFlight(unshared=(DeadlineExceeded,))
+async_flights = AsyncSingleFlight(unshared=(DeadlineExceeded,))
+
 
 def _is_rate_limited(exc: Exception) -> bool:
     msg = str(exc)
     return "429" in msg or "ResourceExhausted" in msg or "quota" in msg.lower()
 
 
+def _is_timeout(exc: Exception) -> bool:
+    msg = str(exc).lower()
+    return isinstance(exc, TimeoutError) or "timeout" in msg or "deadline" in msg
+
+
 def _should_fallback(exc: Exception) -> bool:
     """True for any primary-model failure that the fallback model might succeed on."""
+    if isinstance(exc, DeadlineExceeded):
+        return False  # the request's own budget ran out — no time for another model
     msg = str(exc).lower()
     return (
         _is_rate_limited(exc)
@@ -33,51 +118,633 @@ def _should_fallback(exc: Exception) -> bool:
     )
 
 
-def generate_with_fallback(prompt_or_content: Any) -> Any:
+def _hash_content(prompt_or_content: Any, digest) -> None:
+    """Feeds a prompt, or a list of prompt parts / inline images, into digest."""
+    if isinstance(prompt_or_content, str):
+        # Whitespace-insensitive so re-indented templates share entries
+        digest.update(" ".join(prompt_or_content.split()).encode("utf-8"))
+    elif isinstance(prompt_or_content, (bytes, bytearray)):
+        digest.update(hashlib.sha256(prompt_or_content).digest())
+    elif isinstance(prompt_or_content, dict):
+        for k in sorted(prompt_or_content):
+            digest.update(f"\x1e{k}=".encode("utf-8"))
+            _hash_content(prompt_or_content[k], digest)
+    elif isinstance(prompt_or_content, (list, tuple)):
+        for part in prompt_or_content:
+            digest.update(b"\x1f")
+            _hash_content(part, digest)
+    else:
+        digest.update(repr(prompt_or_content).encode("utf-8"))
+
+
+def cache_key(models: Tuple[str, ...], prompt_or_content: Any,
+              schema: Optional[dict] = None) -> Tuple[Tuple[str, ...], str]:
+    """
+    Cache key for a prompt sent through the given model chain. The response
+    schema (and whether structured output is on) changes what the model
+    returns, so it is part of the key.
+    """
+    digest = hashlib.sha256()
+    _hash_content(prompt_or_content, digest)
+    digest.update(f"\x1dstructured={_STRUCTURED_OUTPUT_ENABLED}".encode("utf-8"))
+    if schema is not None:
+        digest.update(b"\x1dschema=" + json.dumps(schema, sort_keys=True).encode("utf-8"))
+    return models, digest.hexdigest()
+
+
+def invalidate_cached_response(prompt_or_content: Any, vision: bool = False,
+                               response_schema: Optional[dict] = None) -> None:
+    """
+    Drops a cached response, e.g. when the caller could not parse it.
+    Without this an agent's retry loop would be handed the same bad output.
+    """
+    chain = _VISION_CHAIN if vision else _TEXT_CHAIN
+    response_cache.discard(cache_key(chain.models, prompt_or_content, response_schema))
+
+
+def _is_cacheable(response: Any) -> bool:
+    """Only keep responses with content — blocked/empty ones are worth retrying."""
+    try:
+        return bool(response.parts) and bool(response.text.strip())
+    except Exception:
+        return False
+
+
+def _cache_lookup(models: Tuple[str, ...], content: Any, use_cache: bool, schema: Optional[dict] = None):
+    """
+    Returns (key, cached_response). key is None when the call opted out of
+    reuse, in which case it is neither cached nor coalesced.
+    """
+    if not use_cache:
+        return None, None
+    key = cache_key(models, content, schema)
+    return key, response_cache.get(key) if _CACHE_ENABLED else None
+
+
+def _store(key, response: Any, cache_ttl: Optional[float]) -> None:
+    if key is not None and _CACHE_ENABLED and _is_cacheable(response):
+        response_cache.put(key, response, ttl=cache_ttl)
+
+
+def _log_fallback(label: str, failed: str, next_model: str, exc: Exception) -> None:
+    logger.warning(
+        "Primary %s %s failed (%s) — falling back to %s",
+        label, failed, type(exc).__name__, next_model,
+    )
+
+
+def _record_outcome(model_name: str, start: float, exc: Optional[Exception], clamped: bool = False) -> bool:
+    """
+    Feeds the shared router; only quota/timeout/availability errors count
+    against a model. clamped means the call's timeout was cut to the
+    request's remaining budget, so timing out says nothing about the model.
+    Returns whether an outcome was recorded; callers release a half-open
+    probe they hold when it was not.
+    """
+    if exc is None:
+        model_router.record_success(model_name, time.monotonic() - start)
+        return True
+    if _should_fallback(exc) and not (clamped and _is_timeout(exc)):
+        model_router.record_failure(model_name)
+        return True
+    return False
+
+
+def _supports_structured_output(model_name: str) -> bool:
+    """Gemma models reject response_mime_type / response_schema."""
+    return _STRUCTURED_OUTPUT_ENABLED and "gemma" not in model_name
+
+
+def _request_kwargs(model_name: str, timeout: float, schema: Optional[dict]) -> dict:
+    kwargs: Dict[str, Any] = {"request_options": {"timeout": timeout}}
+    if schema is not None and _supports_structured_output(model_name):
+        kwargs["generation_config"] = {
+            "response_mime_type": "application/json",
+            "response_schema": schema,
+        }
+    return kwargs
+
+
+def _call_model(model_name: str, content: Any, timeout: float, schema: Optional[dict] = None) -> Any:
+    recorded = False
+    try:
+        budget = deadline.clamp_timeout(timeout)
+        start = time.monotonic()
+        try:
+            model = genai.GenerativeModel(model_name)
+            response = model.generate_content(content, **_request_kwargs(model_name, budget, schema))
+        except Exception as e:
+            recorded = _record_outcome(model_name, start, e, clamped=budget < timeout)
+            raise
+        recorded = _record_outcome(model_name, start, None)
+        return response
+    finally:
+        if not recorded:
+            model_router.release_probe(model_name)
+
+
+async def _call_model_async(model_name: str, content: Any, timeout: float,
+                            schema: Optional[dict] = None) -> Any:
+    recorded = False
+    try:
+        budget = deadline.clamp_timeout(timeout)
+        start = time.monotonic()
+        try:
+            model = genai.GenerativeModel(model_name)
+            response = await model.generate_content_async(
+                content, **_request_kwargs(model_name, budget, schema),
+            )
+        except Exception as e:
+            recorded = _record_outcome(model_name, start, e, clamped=budget < timeout)
+            raise
+        recorded = _record_outcome(model_name, start, None)
+        return response
+    finally:
+        # No verdict (out of budget before sending, cancelled, or an error
+        # that says nothing about the model's health): free the probe
+        if not recorded:
+            model_router.release_probe(model_name)
+
+
+def _routed_models(chain: _ModelChain):
+    """
+    Yields the models to try, healthiest first. Models behind an open circuit
+    are skipped, except that the last one is still tried if nothing else
+    was — a request is never failed without at least one upstream attempt.
+    """
+    models = model_router.order(chain.models)
+    attempted = False
+    for i, model_name in enumerate(models):
+        if model_router.allow(model_name) or (i == len(models) - 1 and not attempted):
+            attempted = True
+            yield model_name, models[i + 1] if i + 1 < len(models) else None
+        else:
+            logger.info("Skipping %s %s — circuit open", chain.label, model_name)
+
+
+def _can_hedge(chain: _ModelChain, hedge: bool) -> bool:
+    return hedge and len(chain.models) == 2 and all(
+        model_router.state(m) == CLOSED for m in chain.models
+    )
+
+
+def chain_healthy(chain: str = "text") -> bool:
+    """
+    True when every model in the chain has a closed circuit. Optional
+    background work checks this so it never competes with user requests
+    for quota while a model is rate limited or down.
+    """
+    return all(model_router.state(m) == CLOSED for m in _TEXT_CHAINS[chain].models)
+
+
+def _call_chain(chain: _ModelChain, content: Any, hedge: bool, schema: Optional[dict]) -> Any:
+    """Runs content through the routed model chain, moving on only for fallback-worthy errors."""
+    if _can_hedge(chain, hedge):
+        models = chain.models
+        return run_hedged(
+            lambda: _call_model(models[0], content, chain.timeout, schema),
+            lambda: _call_model(models[1], content, chain.timeout, schema),
+            chain.hedge_after, chain.hedge_stats, _is_cacheable, _should_fallback,
+        )
+
+    last_error: Optional[Exception] = None
+    for model_name, next_model in _routed_models(chain):
+        try:
+            return _call_model(model_name, content, chain.timeout, schema)
+        except Exception as e:
+            if _should_fallback(e) and next_model is not None:
+                _log_fallback(chain.label, model_name, next_model, e)
+                last_error = e
+                continue
+            raise
+    if last_error is not None:
+        raise last_error
+    raise RuntimeError(f"All {chain.label}s failed. Please try again later.")
+
+
+async def _call_chain_async(chain: _ModelChain, content: Any, hedge: bool, schema: Optional[dict]) -> Any:
+    """Async twin of _call_chain built on generate_content_async — never blocks the event loop."""
+    if _can_hedge(chain, hedge):
+        models = chain.models
+        return await run_hedged_async(
+            lambda: _call_model_async(models[0], content, chain.timeout, schema),
+            lambda: _call_model_async(models[1], content, chain.timeout, schema),
+            chain.hedge_after, chain.hedge_stats, _is_cacheable, _should_fallback,
+        )
+
+    last_error: Optional[Exception] = None
+    for model_name, next_model in _routed_models(chain):
+        try:
+            return await _call_model_async(model_name, content, chain.timeout, schema)
+        except Exception as e:
+            if _should_fallback(e) and next_model is not None:
+                _log_fallback(chain.label, model_name, next_model, e)
+                last_error = e
+                continue
+            raise
+    if last_error is not None:
+        raise last_error
+    raise RuntimeError(f"All {chain.label}s failed. Please try again later.")
+
+
+def _as_deadline_error(exc: TimeoutError) -> Exception:
+    """A follower whose own budget ran out while waiting on a coalesced call."""
+    if isinstance(exc, DeadlineExceeded) or not deadline.expired():
+        return exc
+    error = DeadlineExceeded("Request deadline exceeded")
+    error.__cause__ = exc
+    return error
+
+
+def _generate(chain: _ModelChain, content: Any, use_cache: bool,
+              cache_ttl: Optional[float], hedge: Optional[bool], schema: Optional[dict]) -> Any:
+    """Cache lookup, then one coalesced upstream call per distinct in-flight prompt."""
+    hedge = _HEDGE_ENABLED if hedge is None else hedge
+    key, cached = _cache_lookup(chain.models, content, use_cache, schema)
+    if cached is not None:
+        return cached
+    if key is None:
+        return _call_chain(chain, content, hedge, schema)
+
+    def leader() -> Any:
+        response = _call_chain(chain, content, hedge, schema)
+        _store(key, response, cache_ttl)
+        return response
+
+    try:
+        return sync_flights.do(key, leader, timeout=deadline.remaining())
+    except TimeoutError as e:
+        raise _as_deadline_error(e)
+
+
+async def _generate_async(chain: _ModelChain, content: Any, use_cache: bool,
+                          cache_ttl: Optional[float], hedge: Optional[bool],
+                          schema: Optional[dict]) -> Any:
+    """Async twin of _generate."""
+    hedge = _HEDGE_ENABLED if hedge is None else hedge
+    key, cached = _cache_lookup(chain.models, content, use_cache, schema)
+    if cached is not None:
+        return cached
+    if key is None:
+        return await _call_chain_async(chain, content, hedge, schema)
+
+    async def leader() -> Any:
+        response = await _call_chain_async(chain, content, hedge, schema)
+        _store(key, response, cache_ttl)
+        return response
+
+    try:
+        return await async_flights.do(key, leader, timeout=deadline.remaining())
+    except TimeoutError as e:
+        raise _as_deadline_error(e)
+
+
+def hedging_stats() -> dict:
+    """Hedge rate, hedge win rate and primary latency percentiles per chain."""
+    return {
+        "text": _TEXT_CHAIN.hedge_stats.snapshot(),
+        "chat": _CHAT_CHAIN.hedge_stats.snapshot(),
+        "vision": _VISION_CHAIN.hedge_stats.snapshot(),
+    }
+
+
+def coalescing_stats() -> dict:
+    """Upstream executions vs. calls that piggy-backed on an identical in-flight one."""
+    return {"sync": sync_flights.stats(), "async": async_flights.stats()}
+
+
+def llm_stats() -> dict:
+    """Everything the generation layer tracks, for the admin stats endpoint."""
+    return {
+        "cache": response_cache.stats(),
+        "coalescing": coalescing_stats(),
+        "hedging": hedging_stats(),
+        "models": model_router.stats(),
+        "json": json_stats.snapshot(),
+    }
+
+
+def generate_with_fallback(
+    prompt_or_content: Any,
+    *,
+    use_cache: bool = True,
+    cache_ttl: Optional[float] = None,
+    hedge: Optional[bool] = None,
+    chain: str = "text",
+    response_schema: Optional[dict] = None,
+) -> Any:
     """
     Calls generate_content with _PRIMARY_MODEL (gemini-2.5-flash).
     Falls back to _FALLBACK_MODEL (gemma-3-12b-it) on rate limits, timeouts,
     or service unavailability.
+
+    Responses are served from response_cache when the same prompt was answered
+    within cache_ttl seconds (cache default when None). Pass use_cache=False
+    for call sites whose output must not be reused.
+
+    hedge=True (default: LLM_HEDGE_ENABLED) races the fallback model against
+    the primary once the primary has been silent for LLM_HEDGE_AFTER_SECONDS.
+
+    Model order is decided by model_router: a model whose circuit is open
+    is skipped. chain="chat" selects the orchestrator's Gemma 27B chain.
+
+    Inside a deadline_scope each call's timeout is cut to the remaining
+    budget, and no model (primary or fallback) is started once less than
+    deadline.MIN_ATTEMPT_SECONDS is left — DeadlineExceeded is raised instead.
+
+    With response_schema (see response_schema_for) models that support it
+    return JSON matching the schema; Gemma models still get the plain
+    prompt, so callers keep parsing the text as before.
     """
-    for model_name in (_PRIMARY_MODEL, _FALLBACK_MODEL):
+    return _generate(_TEXT_CHAINS[chain], prompt_or_content, use_cache, cache_ttl, hedge, response_schema)
+
+
+async def generate_with_fallback_async(
+    prompt_or_content: Any,
+    *,
+    use_cache: bool = True,
+    cache_ttl: Optional[float] = None,
+    hedge: Optional[bool] = None,
+    chain: str = "text",
+    response_schema: Optional[dict] = None,
+) -> Any:
+    """Async variant of generate_with_fallback for async def handlers."""
+    return await _generate_async(
+        _TEXT_CHAINS[chain], prompt_or_content, use_cache, cache_ttl, hedge, response_schema,
+    )
+
+
+async def stream_with_fallback_async(
+    prompt_or_content: Any,
+    *,
+    use_cache: bool = True,
+    cache_ttl: Optional[float] = None,
+    response_schema: Optional[dict] = None,
+) -> AsyncIterator[str]:
+    """
+    Streams text chunks from the text model chain as they are generated.
+    Fallback is only possible until the first chunk has been yielded; after
+    that an upstream failure propagates to the consumer. A cached response is
+    replayed as a single chunk, and a completed stream populates the cache.
+    """
+    key, cached = _cache_lookup(_TEXT_CHAIN.models, prompt_or_content, use_cache, response_schema)
+    if cached is not None:
+        yield cached.text
+        return
+
+    last_error: Optional[Exception] = None
+    for model_name, next_model in _routed_models(_TEXT_CHAIN):
+        started = False
+        recorded = False
         try:
+            budget = deadline.clamp_timeout(_TEXT_CHAIN.timeout)
+            start = time.monotonic()
             model = genai.GenerativeModel(model_name)
-            return model.generate_content(
+            response = await model.generate_content_async(
                 prompt_or_content,
-                request_options={"timeout": 60},
+                stream=True,
+                **_request_kwargs(model_name, budget, response_schema),
             )
+            async for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue  # chunk without text parts (e.g. finish metadata)
+                if text:
+                    started = True
+                    yield text
+            recorded = _record_outcome(model_name, start, None)
+            _store(key, response, cache_ttl)
+            return
+        except DeadlineExceeded:
+            raise
         except Exception as e:
-            if _should_fallback(e) and model_name == _PRIMARY_MODEL:
-                logger.warning(
-                    "Primary model %s failed (%s) — falling back to %s",
-                    _PRIMARY_MODEL, type(e).__name__, _FALLBACK_MODEL,
-                )
+            recorded = _record_outcome(model_name, start, e, clamped=budget < _TEXT_CHAIN.timeout)
+            if not started and _should_fallback(e) and next_model is not None:
+                _log_fallback(_TEXT_CHAIN.label, model_name, next_model, e)
+                last_error = e
                 continue
             raise
+        finally:
+            # Also reached when the consumer stops iterating (GeneratorExit)
+            if not recorded:
+                model_router.release_probe(model_name)
+    if last_error is not None:
+        raise last_error
     raise RuntimeError("All models failed. Please try again later.")
 
 
-def generate_vision_with_fallback(parts: list) -> Any:
+def generate_vision_with_fallback(
+    parts: list,
+    *,
+    use_cache: bool = True,
+    cache_ttl: Optional[float] = None,
+    hedge: Optional[bool] = None,
+    response_schema: Optional[dict] = None,
+) -> Any:
     """
     Vision-capable fallback: gemini-2.5-flash → gemini-2.0-flash.
     Gemma models don't support image input so a separate chain is used.
+    Cached like generate_with_fallback; image parts are keyed by content hash.
+    Hedging uses LLM_VISION_HEDGE_AFTER_SECONDS as its budget.
     """
-    for model_name in (_VISION_PRIMARY, _VISION_FALLBACK):
-        try:
-            model = genai.GenerativeModel(model_name)
-            return model.generate_content(
-                parts,
-                request_options={"timeout": 120},
-            )
-        except Exception as e:
-            if _should_fallback(e) and model_name == _VISION_PRIMARY:
-                logger.warning(
-                    "Primary vision model %s failed (%s) — falling back to %s",
-                    _VISION_PRIMARY, type(e).__name__, _VISION_FALLBACK,
-                )
+    return _generate(_VISION_CHAIN, parts, use_cache, cache_ttl, hedge, response_schema)
+
+
+async def generate_vision_with_fallback_async(
+    parts: list,
+    *,
+    use_cache: bool = True,
+    cache_ttl: Optional[float] = None,
+    hedge: Optional[bool] = None,
+    response_schema: Optional[dict] = None,
+) -> Any:
+    """Async variant of generate_vision_with_fallback."""
+    return await _generate_async(_VISION_CHAIN, parts, use_cache, cache_ttl, hedge, response_schema)
+
+
+def _openapi_schema(node: dict, defs: dict) -> dict:
+    """One pydantic JSON-schema node in the OpenAPI subset Gemini accepts."""
+    if "$ref" in node:
+        return _openapi_schema(defs[node["$ref"].rsplit("/", 1)[-1]], defs)
+    if "anyOf" in node:
+        options = [o for o in node["anyOf"] if o.get("type") != "null"]
+        schema = _openapi_schema(options[0], defs)
+        if len(options) < len(node["anyOf"]):
+            schema["nullable"] = True
+        return schema
+    schema = {k: node[k] for k in ("type", "description", "enum") if k in node}
+    if "properties" in node:
+        schema["properties"] = {k: _openapi_schema(v, defs) for k, v in node["properties"].items()}
+        schema["required"] = list(node.get("required", []))
+    if "items" in node:
+        schema["items"] = _openapi_schema(node["items"], defs)
+    return schema
+
+
+def response_schema_for(
+    model: Type[BaseModel],
+    *,
+    many: bool = False,
+    exclude: Sequence[str] = (),
+    extra_properties: Optional[Dict[str, dict]] = None,
+) -> dict:
+    """
+    Gemini response_schema derived from a pydantic model in schemas.py.
+    $refs are inlined, Optional fields become nullable and keywords Gemini
+    rejects (title, default, format) are dropped. many=True wraps it in an
+    array; exclude drops server-side fields; extra_properties are added as
+    optional properties.
+    """
+    raw = model.model_json_schema()
+    schema = _openapi_schema(raw, raw.get("$defs", {}))
+    for name in exclude:
+        schema["properties"].pop(name, None)
+    schema["required"] = [k for k in schema["required"] if k not in exclude]
+    if extra_properties:
+        schema["properties"].update(extra_properties)
+    return {"type": "array", "items": schema} if many else schema
+
+
+class JsonExtractor:
+    """
+    Single-pass, resumable replacement for the regex pipeline behind
+    clean_json_response. Text is fed in chunks (e.g. as a response streams
+    in) and scanned once: <think>/<thinking> blocks are skipped, markdown
+    fence spans are recorded and brackets are balanced, with regexes
+    jumping straight to the next significant character and over whole
+    string literals. A token split across chunks is resumed on the next
+    feed(). close() returns the parsed value: the last fenced block if any,
+    else the first complete object or array (whichever opens first, the
+    other as fallback), else the whole text.
+    """
+
+    _SIGNIFICANT = re.compile(r'[][{}"`<]')
+    _MARKERS = re.compile(r'[`<]')
+    _STRING = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+    _THINK_TAGS = ("<thinking>", "<think>")
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        self._think_close: Optional[str] = None   # closing tag while inside a think block
+        self._think_start = -1
+        self._think_body = -1
+        self._think_spans: List[Tuple[int, int]] = []
+        self._fence_start = -1                    # content start of the open fence
+        self._fences: List[Tuple[int, int]] = []
+        # Per bracket type: [start, depth, end]; only the type that opened
+        # first (_primary) is authoritative, the other is its fallback
+        self._slots: Dict[str, List[int]] = {}
+        self._primary: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        return self._buf
+
+    def feed(self, chunk: str) -> None:
+        self._buf += chunk
+        self._pos = self._scan(self._buf, self._pos, fences=True)
+
+    def _balancing(self) -> bool:
+        return self._primary is None or self._slots[self._primary][2] == -1
+
+    def _in_value(self) -> bool:
+        return any(slot[1] > 0 for slot in self._slots.values())
+
+    def _scan(self, buf: str, pos: int, fences: bool) -> int:
+        """Scans buf from pos; returns where to resume once more text arrives."""
+        n = len(buf)
+        while pos < n:
+            if self._think_close is not None:
+                end = buf.find(self._think_close, pos)
+                if end == -1:
+                    return max(pos, n - len(self._think_close) + 1)
+                pos = end + len(self._think_close)
+                self._think_spans.append((self._think_start, pos))
+                self._think_close = None
                 continue
-            raise
-    raise RuntimeError("All vision models failed. Please try again later.")
+            if self._fence_start != -1:
+                # Fence content is only parsed if the fence closes, so skip to its end
+                end = buf.find("```", pos)
+                if end == -1:
+                    return max(pos, n - 2)
+                self._fences.append((self._fence_start, end))
+                self._fence_start = -1
+                pos = end + 3
+                continue
+
+            m = (self._SIGNIFICANT if self._balancing() else self._MARKERS).search(buf, pos)
+            if m is None:
+                return n
+            i = m.start()
+            ch = buf[i]
+            pos = i + 1
+            if ch == "`":
+                if not fences:
+                    continue
+                if n - i < 7 and "```json".startswith(buf[i:]):
+                    return i  # possibly a fence (and its language tag) split across chunks
+                if buf.startswith("```", i):
+                    pos = i + 3
+                    if buf.startswith("json", pos):
+                        pos += 4
+                    self._fence_start = pos
+            elif ch == "<":
+                rest = buf[i:i + 10]
+                tag = next((t for t in self._THINK_TAGS if rest.startswith(t)), None)
+                if tag is not None:
+                    self._think_close = "</" + tag[1:]
+                    self._think_start = i
+                    pos = self._think_body = i + len(tag)
+                elif len(rest) < 10 and any(t.startswith(rest) for t in self._THINK_TAGS):
+                    return i
+            elif ch == '"':
+                if not self._in_value():
+                    continue  # a quote in prose before the JSON starts
+                string = self._STRING.match(buf, i)
+                if string is None:
+                    return i  # the string continues in a later chunk
+                pos = string.end()
+            elif ch in "[{":
+                slot = self._slots.get(ch)
+                if slot is None:
+                    self._slots[ch] = [i, 1, -1]
+                    if self._primary is None:
+                        self._primary = ch
+                elif slot[2] == -1:
+                    slot[1] += 1
+            else:
+                slot = self._slots.get("[" if ch == "]" else "{")
+                if slot is not None and slot[2] == -1:
+                    slot[1] -= 1
+                    if slot[1] == 0:
+                        slot[2] = i + 1
+        return pos
+
+    def close(self) -> Any:
+        buf = self._buf
+        if self._think_close is not None:
+            # Unterminated reasoning block: its text is kept, as if it were prose
+            self._think_close = None
+            self._scan(buf, self._think_body, fences=True)
+        if self._fence_start != -1 and not self._fences:
+            # Unterminated fence: balance brackets through its content after all
+            start, self._fence_start = self._fence_start, -1
+            self._scan(buf, start, fences=False)
+        if self._fences:
+            start, end = self._fences[-1]
+            return json.loads(buf[start:end].strip())
+        if self._primary is not None:
+            for opener in (self._primary, "{" if self._primary == "[" else "["):
+                slot = self._slots.get(opener)
+                if slot is not None and slot[2] != -1:
+                    return json.loads(buf[slot[0]:slot[2]])
+        # No JSON value found — let json.loads raise (or parse a bare scalar)
+        text = buf
+        for start, end in reversed(self._think_spans):
+            text = text[:start] + text[end:]
+        return json.loads(text.strip())
 
 
 def clean_json_response(text: str) -> Any:
@@ -85,67 +752,256 @@ def clean_json_response(text: str) -> Any:
     Extracts and parses JSON from a response string that might contain
     Gemma <think> blocks or markdown code fences.
     """
-    text = text.strip()
+    extractor = JsonExtractor()
+    extractor.feed(text)
+    return extractor.close()
 
-    # Strip Gemma reasoning blocks before attempting extraction
-    text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL).strip()
-    text = re.sub(r'<thinking>.*?</thinking>', '', text, flags=re.DOTALL).strip()
 
-    # Try markdown code blocks first (```json ... ``` or ``` ... ```)
-    matches = re.findall(r'```(?:json)?\s*(.*?)\s*```', text, re.DOTALL)
-    if matches:
-        json_str = matches[-1].strip()
-    else:
-        json_str = _extract_first_json(text)
-
-    return json.loads(json_str)
+class JsonParseError(ValueError):
+    """Model output that neither parsed nor repaired into the expected JSON shape."""
 
 
-def _extract_first_json(text: str) -> str:
+class JsonParseStats:
     """
-    Bracket-counting extractor: finds the first complete JSON object or array.
-    Starts from whichever of '{' or '[' appears first in the text, so that
-    bare arrays like '[{"name":"Milk"}]' are not incorrectly reduced to the
-    inner object.
+    How agent output was turned into JSON: parsed as-is, repaired locally,
+    or given up on. Each repair is one full regeneration saved; retries
+    counts the regenerations the agents' retry loops still had to make.
     """
-    brace_idx = text.find('{')
-    bracket_idx = text.find('[')
 
-    if brace_idx == -1 and bracket_idx == -1:
-        return text  # no JSON found — let json.loads raise
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.parsed = 0
+        self.repaired = 0
+        self.unrepairable = 0
+        self.retries = 0
 
-    if brace_idx == -1:
-        pairs = [('[', ']')]
-    elif bracket_idx == -1:
-        pairs = [('{', '}')]
-    elif bracket_idx < brace_idx:
-        pairs = [('[', ']'), ('{', '}')]
-    else:
-        pairs = [('{', '}'), ('[', ']')]
-
-    for start_char, end_char in pairs:
-        idx = text.find(start_char)
-        if idx == -1:
-            continue
-        depth = 0
-        in_string = False
-        escape_next = False
-        for i, ch in enumerate(text[idx:], start=idx):
-            if escape_next:
-                escape_next = False
-                continue
-            if ch == '\\' and in_string:
-                escape_next = True
-                continue
-            if ch == '"' and not escape_next:
-                in_string = not in_string
-                continue
-            if in_string:
+    def record(self, outcome: str) -> None:
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "parsed": self.parsed,
+                "repaired": self.repaired,
+                "unrepairable": self.unrepairable,
+                "retries": self.retries,
+            }
+
+
+json_stats = JsonParseStats()
+
+_REASONING_RE = re.compile(r'<(think|thinking)>.*?</\1>', re.DOTALL)
+_MAX_REPAIR_STARTS = 5
+
+
+def _drop_trailing_comma(out: List[str]) -> None:
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ',':
+        out.pop()
+
+
+def _repair_from(text: str) -> Any:
+    """
+    Single left-to-right pass over text, which starts at '{' or '['. Trailing
+    commas and stray closers are dropped, single-quoted strings are
+    re-quoted, and scanning stops once the outer value closes, which
+    discards trailing prose. A truncated value is cut back to its last
+    complete top-level element and its brackets are closed.
+    """
+    out: List[str] = []
+    stack: List[str] = []          # closers still owed, innermost last
+    safe: Optional[Tuple[int, Tuple[str, ...]]] = None
+    quote = None
+    escape = False
+    for ch in text:
+        if quote is not None:
+            if escape:
+                escape = False
+                out.append(ch if ch == "'" else '\\' + ch)
+            elif ch == '\\':
+                escape = True
+            elif ch == quote:
+                quote = None
+                out.append('"')
+            elif ch == '"':
+                out.append('\\"')  # only reachable inside a single-quoted string
+            elif ch == '\n':
+                out.append('\\n')
+            else:
+                out.append(ch)
+        elif ch in '"\'':
+            quote = ch
+            out.append('"')
+        elif ch in '{[':
+            stack.append('}' if ch == '{' else ']')
+            out.append(ch)
+        elif ch in '}]':
+            if ch not in stack:
                 continue
-            if ch == start_char:
-                depth += 1
-            elif ch == end_char:
-                depth -= 1
-                if depth == 0:
-                    return text[idx:i + 1]
-    return text
+            while True:
+                closer = stack.pop()
+                _drop_trailing_comma(out)
+                out.append(closer)
+                if closer == ch:
+                    break
+            if not stack:
+                return json.loads("".join(out))
+            if len(stack) == 1:
+                safe = (len(out), tuple(stack))
+        else:
+            if ch == ',' and len(stack) == 1:
+                safe = (len(out), tuple(stack))
+            out.append(ch)
+
+    if safe is None:
+        raise JsonParseError("Model output was truncated before its first complete element.")
+    length, owed = safe
+    del out[length:]
+    _drop_trailing_comma(out)
+    out.extend(reversed(owed))
+    return json.loads("".join(out))
+
+
+def repair_json(text: str) -> Any:
+    """
+    Local repair for malformed model JSON: prose around the value, trailing
+    commas, single quotes, unbalanced brackets and truncated output.
+    Brackets in leading prose (e.g. "[3 ideas]") are skipped by trying the
+    next few candidate start positions. Raises JsonParseError if nothing
+    parseable remains.
+    """
+    text = _REASONING_RE.sub('', text)
+    last_error: Optional[Exception] = None
+    starts = [i for i, ch in enumerate(text) if ch in '{['][:_MAX_REPAIR_STARTS]
+    for start in starts:
+        try:
+            return _repair_from(text[start:])
+        except (ValueError, IndexError) as e:
+            last_error = e
+    raise JsonParseError(f"Could not repair model JSON: {last_error or 'no JSON value found'}")
+
+
+def _has_shape(result: Any, expect: Optional[type], required_keys: Sequence[str]) -> bool:
+    if expect is not None and not isinstance(result, expect):
+        return False
+    return not required_keys or (isinstance(result, dict) and all(k in result for k in required_keys))
+
+
+def parse_json_response(text: str, expect: Optional[type] = None,
+                        required_keys: Sequence[str] = ()) -> Any:
+    """
+    clean_json_response, falling back to repair_json when the text does not
+    parse or does not have the expected shape (expect type, plus
+    required_keys for objects). Agents call this before spending a retry on
+    a full regeneration. Raises JsonParseError when both fail.
+    """
+    try:
+        result = clean_json_response(text)
+        if _has_shape(result, expect, required_keys):
+            json_stats.record("parsed")
+            return result
+    except ValueError:
+        pass
+    try:
+        result = repair_json(text)
+    except JsonParseError:
+        result = None
+    if result is not None and _has_shape(result, expect, required_keys):
+        json_stats.record("repaired")
+        return result
+    json_stats.record("unrepairable")
+    expected = expect.__name__ if expect is not None else "JSON"
+    raise JsonParseError(f"Model output is not a valid {expected} response.")
+
+
+class JsonArrayStreamParser:
+    """
+    Incremental parser for a streamed JSON array of objects.
+    Feed it text chunks as they arrive; feed() returns every top-level array
+    element whose closing brace has been seen so far. Leading <think> blocks,
+    markdown fences and prose before the array are skipped.
+    """
+
+    _THINK_OPEN = re.compile(r'<think(?:ing)?>')
+    _THINK_CLOSED = re.compile(r'<(think|thinking)>.*?</\1>', re.DOTALL)
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0          # next unscanned index into _buf
+        self._in_array = False
+        self._depth = 0        # bracket depth relative to the outer array
+        self._in_string = False
+        self._escape = False
+        self._elem_start = -1
+        self.done = False
+
+    def feed(self, chunk: str) -> list:
+        if self.done:
+            return []
+        self._buf += chunk
+        if not self._in_array and not self._find_array_start():
+            return []
+        return self._scan()
+
+    def _find_array_start(self) -> bool:
+        text = self._THINK_CLOSED.sub('', self._buf)
+        if self._THINK_OPEN.search(text):
+            return False  # reasoning block still open — wait for more text
+        search_from = 0
+        while True:
+            idx = text.find('[', search_from)
+            if idx == -1:
+                # Keep only a short tail in case "<think>" is split across chunks
+                self._buf = text[-16:]
+                return False
+            rest = text[idx + 1:].lstrip()
+            if not rest:
+                self._buf = text[idx:]
+                return False
+            if rest[0] in '{]':
+                self._buf = text[idx + 1:]
+                self._pos = 0
+                self._in_array = True
+                self._depth = 1
+                return True
+            search_from = idx + 1  # a bracket in prose, e.g. "[3 recipes]"
+
+    def _scan(self) -> list:
+        items = []
+        buf = self._buf
+        i = self._pos
+        n = len(buf)
+        while i < n:
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                if self._depth == 1:
+                    self._elem_start = i
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 1 and self._elem_start != -1:
+                    items.append(json.loads(buf[self._elem_start:i + 1]))
+                    self._elem_start = -1
+                elif self._depth == 0:
+                    self.done = True
+                    break
+            i += 1
+
+        # Drop everything already consumed so the buffer stays one element long
+        keep_from = self._elem_start if self._elem_start != -1 else i
+        self._buf = buf[keep_from:]
+        self._pos = i - keep_from
+        if self._elem_start != -1:
+            self._elem_start = 0
+        return items
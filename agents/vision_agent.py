@@ -5,18 +5,22 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import schemas
 from gemini_client import API_KEY
-from .utils import clean_json_response, generate_vision_with_fallback
+from .deadline import DeadlineExceeded
+from .utils import (
+    generate_vision_with_fallback,
+    generate_vision_with_fallback_async,
+    invalidate_cached_response,
+    parse_json_response,
+    response_schema_for,
+)
 
-def parse_fridge_image(image_bytes: bytes, mime_type: str) -> List[Dict[str, Any]]:
-    """
-    Sends an image of a fridge or receipt to Gemini Vision to extract grocery items.
-    Returns a list of dictionaries with name, quantity, and unit.
-    """
-    if not API_KEY:
-        raise ValueError("Gemini API key is not configured.")
+# Re-scanning the same photo (retry after a slow response) reuses the result
+_CACHE_TTL_SECONDS = 600
+_ITEMS_SCHEMA = response_schema_for(schemas.PantryItemBase, many=True, exclude=("expiry_date",))
 
-    prompt = """
+_PROMPT = """
     Analyze this image of groceries (either from a fridge/pantry or a receipt).
     Identify all the distinct food items visible.
     For each item, estimate the quantity and provide an appropriate unit (e.g., "count", "kg", "liters", "grams").
@@ -36,18 +40,57 @@ def parse_fridge_image(image_bytes: bytes, mime_type: str) -> List[Dict[str, Any
     ]
     Do not include markdown code block formatting like ```json in your response, just the raw JSON.
     """
-    
+
+
+def _vision_parts(image_bytes: bytes, mime_type: str) -> list:
     image_part = {
         "mime_type": mime_type,
         "data": image_bytes
     }
-    
+    return [_PROMPT, image_part]
+
+
+def _scan_failed(e: Exception, parts: list) -> ValueError:
+    invalidate_cached_response(parts, vision=True, response_schema=_ITEMS_SCHEMA)
+    if "429" in str(e) or "ResourceExhausted" in str(e):
+        return ValueError("The Vision AI is currently busy. Please wait a moment and try again.")
+    return ValueError("Gemini did not return valid JSON.")
+
+
+def parse_fridge_image(image_bytes: bytes, mime_type: str) -> List[Dict[str, Any]]:
+    """
+    Sends an image of a fridge or receipt to Gemini Vision to extract grocery items.
+    Returns a list of dictionaries with name, quantity, and unit.
+    """
+    if not API_KEY:
+        raise ValueError("Gemini API key is not configured.")
+
+    parts = _vision_parts(image_bytes, mime_type)
     try:
-        response = generate_vision_with_fallback([prompt, image_part])
+        response = generate_vision_with_fallback(
+            parts, cache_ttl=_CACHE_TTL_SECONDS, response_schema=_ITEMS_SCHEMA,
+        )
         text_response = response.text.strip()
-        return clean_json_response(text_response)
+        return parse_json_response(text_response, expect=list)
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        if "429" in str(e) or "ResourceExhausted" in str(e):
-            raise ValueError("The Vision AI is currently busy. Please wait a moment and try again.")
-        raise ValueError("Gemini did not return valid JSON.") from e
+        raise _scan_failed(e, parts) from e
 
+
+async def parse_fridge_image_async(image_bytes: bytes, mime_type: str) -> List[Dict[str, Any]]:
+    """Async variant of parse_fridge_image for the async vision scan handler."""
+    if not API_KEY:
+        raise ValueError("Gemini API key is not configured.")
+
+    parts = _vision_parts(image_bytes, mime_type)
+    try:
+        response = await generate_vision_with_fallback_async(
+            parts, cache_ttl=_CACHE_TTL_SECONDS, response_schema=_ITEMS_SCHEMA,
+        )
+        text_response = response.text.strip()
+        return parse_json_response(text_response, expect=list)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        raise _scan_failed(e, parts) from e
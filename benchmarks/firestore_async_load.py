@@ -0,0 +1,195 @@
+"""
+Load benchmark for the async request path (firestore_db.get_async_firestore).
+
+Drives the real app (main.app) in-process over httpx's ASGI transport with
+FIRESTORE_BACKEND=memory: every request goes through the converted routers,
+the storage layer and a real AsyncClient, whose RPCs are served by
+memory_firestore after a fixed latency (asyncio.sleep). Each simulated
+user (one per concurrent client) cycles through GET /pantry, GET
+/nutrition, GET /nutrition/daily, GET /recipes/saved and POST
+/agents/recipe/suggest; the recipe model call is stubbed with a sleep
+(--llm-ms), so the numbers show how much a single worker keeps in flight,
+not Gemini's or Firestore's own speed. Sign-in and rate limits are bypassed.
+
+Each concurrency level runs in a fresh process so its peak RSS
+(ru_maxrss) is its own. Reported: requests/s, latency percentiles, peak
+thread count, share of one CPU, and peak RSS with its growth over the
+idle (seeded, warmed-up) process. On a single core:
+
+    16 concurrent:      125 req/s   p50   25 ms   p95  529 ms   threads 17   cpu  29%   rss 135.2 MB (+2.8)
+    64 concurrent:      367 req/s   p50   57 ms   p95  590 ms   threads 41   cpu  73%   rss 141.4 MB (+6.9)
+    256 concurrent:     404 req/s   p50  460 ms   p95 1076 ms   threads 41   cpu  89%   rss 162.0 MB (+18.5)
+
+(20 ms per RPC, 500 ms per model call.) The threads are FastAPI's
+threadpool running the sync dependencies (get_current_user, get_storage)
+for a moment each; no request holds one while it waits on Firestore or
+the model, so the count stops at the pool's 40 while requests in flight
+keep rising. p95 is the suggest calls, which wait out the model.
+
+    python -m benchmarks.firestore_async_load [--requests 2000] [--concurrency 16,64,256] [--rpc-ms 20] [--llm-ms 500]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Before the app is imported: firestore_db picks the backend at import time
+os.environ["FIRESTORE_BACKEND"] = "memory"
+os.environ["STORAGE_BACKEND"] = "firestore"
+
+SEEDED_AT = datetime(2026, 3, 1, tzinfo=timezone.utc)
+MEAL = {"meal_name": "Oats", "calories": 350, "protein": 12, "carbs": 60, "fat": 6, "date": "2026-03-02"}
+RECIPE = {
+    "name": "Tomato omelette",
+    "reasoning": "Uses the eggs and tomatoes",
+    "missing_ingredients": [],
+    "instructions": ["Beat the eggs", "Cook with the tomatoes"],
+    "estimated_calories": 420,
+    "estimated_protein": 24,
+}
+
+
+def _seed(users: int, pantry_size: int) -> None:
+    """Pantry, logs, saved recipes and a pro subscription (no quota writes) per user."""
+    import memory_firestore
+    db = memory_firestore.client()
+    for u in range(users):
+        user = db.collection("users").document(f"user-{u}")
+        for i in range(pantry_size):
+            user.collection("pantry").document(f"item-{i}").set(
+                {"name": f"Ingredient {i}", "quantity": float(i % 7 + 1), "unit": "grams",
+                 "expiry_date": "2026-06-01", "date_added": SEEDED_AT}
+            )
+        for i in range(5):
+            user.collection("nutrition_logs").document(f"log-{i}").set({**MEAL, "rolled_up": True})
+        user.collection("nutrition_daily").document(MEAL["date"]).set(
+            {"date": MEAL["date"], "calories": 1750, "protein": 60, "carbs": 300, "fat": 30, "meals": 5}
+        )
+        for i in range(2):
+            user.collection("saved_recipes").document(f"recipe-{i}").set({**RECIPE, "saved_at": SEEDED_AT})
+        user.collection("subscription").document("data").set({"tier": "pro"})
+
+
+def build_app(llm_seconds: float):
+    import logging
+    from fastapi import Request
+
+    import main
+    from agents import recipe_agent
+    from dependencies import get_current_user
+    from limiter import limiter
+
+    logging.disable(logging.INFO)  # the app logs every suggestion
+
+    async def suggest_recipes_async(items, preferences, time_of_day):
+        await asyncio.sleep(llm_seconds)
+        return [RECIPE] * 3
+
+    recipe_agent.suggest_recipes_async = suggest_recipes_async
+    limiter.enabled = False
+
+    def bench_user(request: Request) -> dict:
+        return {"uid": request.headers["X-Bench-User"]}
+
+    main.app.dependency_overrides[get_current_user] = bench_user
+    return main.app
+
+
+def _route(n: int, user: str):
+    """The n-th request of a user's cycle."""
+    kind = n % 5
+    if kind == 0:
+        return "GET", "/pantry", None
+    if kind == 1:
+        return "GET", "/nutrition", None
+    if kind == 2:
+        return "GET", "/nutrition/daily?from=2026-03-01&to=2026-03-07", None
+    if kind == 3:
+        return "GET", "/recipes/saved", None
+    # Different preferences each time, so the suggestion cache never answers
+    return "POST", "/agents/recipe/suggest", {"preferences": f"{user} #{n}", "time_of_day": "dinner"}
+
+
+async def run_load(app, requests: int, concurrency: int) -> dict:
+    import httpx
+
+    latencies = []
+    peak_threads = threading.active_count()
+    remaining = iter(range(requests))
+
+    async def worker(client, user):
+        nonlocal peak_threads
+        headers = {"X-Bench-User": user}
+        for n in remaining:
+            method, path, body = _route(n, user)
+            start = time.perf_counter()
+            resp = await client.request(method, path, json=body, headers=headers)
+            latencies.append(time.perf_counter() - start)
+            resp.raise_for_status()
+            peak_threads = max(peak_threads, threading.active_count())
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for kind in range(5):  # warm up every route
+            method, path, body = _route(kind, "user-0")
+            (await client.request(method, path, json=body, headers={"X-Bench-User": "user-0"})).raise_for_status()
+        rss_idle = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start, cpu_start = time.perf_counter(), time.process_time()
+        await asyncio.gather(*(worker(client, f"user-{u}") for u in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+
+    latencies.sort()
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KiB on Linux
+    return {
+        "rps": requests / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+        "threads": peak_threads,
+        "cpu_pct": 100 * cpu / elapsed,
+        "rss_mb": rss_peak / 1024,
+        "rss_growth_mb": (rss_peak - rss_idle) / 1024,
+    }
+
+
+def _run_level(args: argparse.Namespace, concurrency: int) -> dict:
+    """One concurrency level, in its own process (see main)."""
+    import memory_firestore
+    _seed(concurrency, args.pantry)
+    memory_firestore.backend.latency = args.rpc_ms / 1000  # seeded without it
+    app = build_app(args.llm_ms / 1000)
+    return asyncio.run(run_load(app, args.requests, concurrency))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", default="16,64,256", help="comma-separated levels, one process each")
+    parser.add_argument("--rpc-ms", type=float, default=20.0)
+    parser.add_argument("--llm-ms", type=float, default=500.0, help="stubbed recipe model latency")
+    parser.add_argument("--pantry", type=int, default=10, help="pantry items per user")
+    args = parser.parse_args()
+
+    print(f"requests:          {args.requests}")
+    print(f"latency:           {args.rpc_ms:.0f} ms per RPC, {args.llm_ms:.0f} ms per recipe model call")
+    ctx = multiprocessing.get_context("spawn")
+    for concurrency in (int(c) for c in args.concurrency.split(",")):
+        # A fresh process per level: ru_maxrss is a high-water mark
+        with ProcessPoolExecutor(1, mp_context=ctx) as pool:
+            result = pool.submit(_run_level, args, concurrency).result()
+        print(
+            f"{f'{concurrency} concurrent:':<18}{result['rps']:5.0f} req/s   p50 {result['p50_ms']:4.0f} ms   "
+            f"p95 {result['p95_ms']:4.0f} ms   threads {result['threads']}   cpu {result['cpu_pct']:3.0f}%   "
+            f"rss {result['rss_mb']:.1f} MB (+{result['rss_growth_mb']:.1f})"
+        )
+
+
+if __name__ == "__main__":
+    main()
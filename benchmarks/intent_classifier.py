@@ -0,0 +1,65 @@
+"""
+Benchmark for agents/intent_classifier.py.
+
+Reports accuracy and bypass rate (share of messages that skip the orchestrator
+LLM call) on the bundled labelled set, using k-fold cross-validation so the
+model is never scored on examples it was trained on, plus per-message latency.
+
+    python -m benchmarks.intent_classifier [--threshold 0.85] [--folds 5]
+"""
+import argparse
+import random
+import sys
+import os
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.intent_classifier import (  # noqa: E402
+    BYPASS_INTENTS, DEFAULT_THRESHOLD, IntentClassifier, load_examples,
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--folds", type=int, default=5)
+    args = parser.parse_args()
+
+    examples = load_examples()
+    random.Random(0).shuffle(examples)
+
+    correct = bypassed = bypass_correct = chat_bypassed = 0
+    for k in range(args.folds):
+        test = examples[k::args.folds]
+        train = [ex for i, ex in enumerate(examples) if i % args.folds != k]
+        clf = IntentClassifier(train)
+        for text, label in test:
+            intent, confidence = clf.classify(text)
+            correct += intent == label
+            if intent in BYPASS_INTENTS and confidence >= args.threshold:
+                bypassed += 1
+                bypass_correct += intent == label
+                chat_bypassed += label == "general_chat"
+
+    n = len(examples)
+    clf = IntentClassifier(examples)
+    start = time.perf_counter()
+    rounds = 20
+    for _ in range(rounds):
+        for text, _label in examples:
+            clf.classify(text)
+    per_call_us = (time.perf_counter() - start) / (rounds * n) * 1e6
+
+    print(f"examples:            {n} ({args.folds}-fold cross-validation)")
+    print(f"threshold:           {args.threshold:.2f}")
+    print(f"accuracy:            {correct / n:.1%}")
+    print(f"bypass rate:         {bypassed / n:.1%}")
+    print(f"bypass precision:    {bypass_correct / bypassed:.1%}" if bypassed else "bypass precision:    n/a")
+    chats = sum(label == "general_chat" for _text, label in examples)
+    print(f"chat bypassed:       {chat_bypassed}/{chats} general_chat examples")
+    print(f"classify latency:    {per_call_us:.1f} µs/message")
+
+
+if __name__ == "__main__":
+    main()
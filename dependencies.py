@@ -1,18 +1,57 @@
+import hashlib
 import logging
+import os
+import time
 
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer
 from firebase_admin import auth as firebase_auth
 
-from firestore_db import get_firestore
+from agents.cache import ResponseCache
+from storage import get_storage
 
 logger = logging.getLogger(__name__)
 security = HTTPBearer()
 
+# Decoded ID-token claims keyed by a hash of the token, each kept until the
+# token's exp. The app sends the same token on every call of a page load;
+# only the first pays for signature verification (and any key fetch).
+token_cache = ResponseCache(
+    max_entries=int(os.getenv("AUTH_TOKEN_CACHE_MAX_ENTRIES", "4096")),
+    default_ttl=3600.0,
+)
+# With revocation checks on, every request is a round trip to Firebase Auth:
+# cached claims would keep accepting a revoked token, so the cache is bypassed.
+CHECK_REVOKED = os.getenv("AUTH_CHECK_REVOKED", "false").lower() == "true"
+
+# Subscription tier per uid. It changes about once a month but was read on
+# every require_pro call and recipe suggestion. Writers in this process
+# call invalidate_user_tier; the TTL bounds staleness for other workers
+# unless the snapshot listener is enabled.
+tier_cache = ResponseCache(
+    max_entries=int(os.getenv("TIER_CACHE_MAX_ENTRIES", "10000")),
+    default_ttl=float(os.getenv("TIER_CACHE_TTL_SECONDS", "300")),
+)
+# Multi-worker deployments: follow subscription writes made by other
+# workers. The listener's initial snapshot reads every subscription
+# document once per worker start.
+TIER_LISTENER_ENABLED = os.getenv("TIER_CACHE_LISTENER", "false").lower() == "true"
+
+
+def _verify_token(token: str) -> dict:
+    if CHECK_REVOKED:
+        return firebase_auth.verify_id_token(token, check_revoked=True)
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    decoded = token_cache.get(key)
+    if decoded is None:
+        decoded = firebase_auth.verify_id_token(token)
+        token_cache.put(key, decoded, ttl=decoded.get("exp", 0) - time.time())  # no exp claim: not cached
+    return decoded
+
 
 def get_current_user(creds=Depends(security)) -> dict:
     try:
-        decoded = firebase_auth.verify_id_token(creds.credentials)
+        decoded = _verify_token(creds.credentials)
     except firebase_auth.ExpiredIdTokenError:
         raise HTTPException(401, "Token expired")
     except Exception as e:
@@ -31,13 +70,37 @@ def get_current_user(creds=Depends(security)) -> dict:
     return decoded
 
 
-def get_user_tier(user_id: str, db) -> str:
-    doc = db.collection("users").document(user_id).collection("subscription").document("data").get()
-    return doc.to_dict().get("tier", "free") if doc.exists else "free"
+async def get_user_tier(user_id: str, store) -> str:
+    tier = tier_cache.get(user_id)
+    if tier is None:
+        tier = await store.subscriptions.get_tier(user_id)
+        tier_cache.put(user_id, tier)
+    return tier
+
+
+def invalidate_user_tier(user_id: str) -> None:
+    """Called after any write to users/{uid}/subscription."""
+    tier_cache.discard(user_id)
+
+
+def _on_subscription_change(docs, changes, read_time) -> None:
+    for change in changes:
+        # users/{uid}/subscription/{doc}: the grandparent is the user
+        invalidate_user_tier(change.document.reference.parent.parent.id)
+
+
+def start_tier_listener(db):
+    """
+    Watches every user's subscription documents (Firestore storage only)
+    and evicts their cached tier on change.
+    """
+    watch = db.collection_group("subscription").on_snapshot(_on_subscription_change)
+    logger.info("Subscription tier listener started")
+    return watch
 
 
-def require_pro(user=Depends(get_current_user), db=Depends(get_firestore)):
-    if get_user_tier(user["uid"], db) != "pro":
+async def require_pro(user=Depends(get_current_user), store=Depends(get_storage)):
+    if await get_user_tier(user["uid"], store) != "pro":
         raise HTTPException(
             403,
             "This feature requires a Pro subscription. Upgrade on the Account page.",
@@ -1,10 +1,184 @@
-from firebase_admin import firestore
+import contextvars
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from firebase_admin import firestore, firestore_async
+from starlette.datastructures import MutableHeaders
+
+logger = logging.getLogger(__name__)
 
 _client = None
+_async_client = None
+
+# GAPIC methods that each cost one round trip to Firestore
+_RPC_METHODS = (
+    "batch_get_documents",
+    "batch_write",
+    "begin_transaction",
+    "commit",
+    "list_collection_ids",
+    "list_documents",
+    "partition_query",
+    "rollback",
+    "run_aggregation_query",
+    "run_query",
+)
+
+# "memory" serves every client from memory_firestore instead of a Firestore project
+FIRESTORE_BACKEND = os.getenv("FIRESTORE_BACKEND", "firestore").lower()
+
+RPC_HEADER = "X-Firestore-RPCs"
+# A request making more round trips than this is logged as a warning
+RPC_WARN_THRESHOLD = int(os.getenv("FIRESTORE_RPC_WARN_THRESHOLD", "25"))
+
+
+class RpcCounter:
+    def __init__(self):
+        self.count = 0
+
+
+# Counter for the request being handled; follows run_in_threadpool calls
+_current: contextvars.ContextVar[Optional[RpcCounter]] = contextvars.ContextVar("firestore_rpcs", default=None)
+_stats_lock = threading.Lock()
+_route_stats: Dict[str, Dict[str, int]] = {}
 
 
 def get_firestore():
     global _client
     if _client is None:
-        _client = firestore.client()
+        if FIRESTORE_BACKEND == "memory":
+            import memory_firestore
+            _client = memory_firestore.client()
+        else:
+            _client = firestore.client()
+        count_rpcs(_client._firestore_api)
     return _client
+
+
+def get_async_firestore():
+    """
+    AsyncClient for async handlers: their RPCs are awaited on the event loop
+    instead of each holding a threadpool thread. Background threads and the
+    remaining sync handlers keep using get_firestore.
+    """
+    global _async_client
+    if _async_client is None:
+        if FIRESTORE_BACKEND == "memory":
+            import memory_firestore
+            _async_client = memory_firestore.async_client()
+        else:
+            _async_client = firestore_async.client()
+        count_rpcs(_async_client._firestore_api)
+    return _async_client
+
+
+def doc_to_dict(doc) -> dict:
+    """Snapshot data with the document id under "id", as the list endpoints return it."""
+    d = doc.to_dict() or {}
+    d["id"] = doc.id
+    return d
+
+
+def stream_dicts(query, fields: Optional[Sequence[str]] = None, include_id: bool = False) -> List[dict]:
+    """
+    Runs query and returns each document's data. fields projects the read
+    server-side with select(), so fields the caller never looks at are not
+    sent or deserialised; an empty sequence returns no data at all, only
+    the documents' names.
+    """
+    if fields is not None:
+        query = query.select(list(fields))
+    return [doc_to_dict(doc) if include_id else (doc.to_dict() or {}) for doc in query.stream()]
+
+
+async def stream_dicts_async(query, fields: Optional[Sequence[str]] = None, include_id: bool = False) -> List[dict]:
+    """stream_dicts for AsyncClient queries."""
+    if fields is not None:
+        query = query.select(list(fields))
+    return [doc_to_dict(doc) if include_id else (doc.to_dict() or {}) async for doc in query.stream()]
+
+
+def count_rpcs(api) -> None:
+    """
+    Wraps api's RPC methods so each call is charged to the current request's
+    counter. Works for the async GAPIC client too: the wrapper counts when
+    the call is made and hands back the coroutine unchanged.
+    """
+    for name in _RPC_METHODS:
+        method = getattr(api, name, None)
+        if method is not None:
+            setattr(api, name, _counted(method))
+
+
+def _counted(method):
+    def call(*args, **kwargs):
+        counter = _current.get()
+        if counter is not None:
+            counter.count += 1
+        return method(*args, **kwargs)
+    return call
+
+
+@contextmanager
+def rpc_scope() -> Iterator[RpcCounter]:
+    """Counts the Firestore RPCs made by the enclosed work."""
+    counter = RpcCounter()
+    token = _current.set(counter)
+    try:
+        yield counter
+    finally:
+        _current.reset(token)
+
+
+def record_request(route: str, rpcs: int) -> None:
+    with _stats_lock:
+        stats = _route_stats.setdefault(route, {"requests": 0, "rpcs": 0, "max_rpcs": 0})
+        stats["requests"] += 1
+        stats["rpcs"] += rpcs
+        stats["max_rpcs"] = max(stats["max_rpcs"], rpcs)
+    if rpcs > RPC_WARN_THRESHOLD:
+        logger.warning("%s made %d Firestore RPCs", route, rpcs)
+    else:
+        logger.debug("%s made %d Firestore RPCs", route, rpcs)
+
+
+def rpc_stats() -> Dict[str, dict]:
+    """Per-route request count and Firestore round trips, for the admin stats endpoint."""
+    with _stats_lock:
+        return {
+            route: {**stats, "mean_rpcs": stats["rpcs"] / stats["requests"]}
+            for route, stats in _route_stats.items()
+        }
+
+
+class FirestoreRpcMiddleware:
+    """
+    ASGI middleware that counts each request's Firestore round trips,
+    returns the count in the X-Firestore-RPCs header and records it per
+    route. Work a streaming response does after its headers are sent is
+    recorded but not in the header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with rpc_scope() as counter:
+            async def send_with_count(message):
+                if message["type"] == "http.response.start":
+                    MutableHeaders(scope=message).append(RPC_HEADER, str(counter.count))
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_count)
+            finally:
+                route = scope.get("route")
+                if route is not None:  # unmatched paths would grow the stats without bound
+                    record_request(f"{scope['method']} {route.path}", counter.count)
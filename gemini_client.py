@@ -14,13 +14,16 @@ if API_KEY:
 def ask_gemini(prompt: str) -> str:
     """
     Sends a prompt to Gemma 3 27B and returns the text response.
+    Goes through the agents' shared model router, so it falls back to
+    Gemini when Gemma is rate limited or its circuit is open.
     """
     if not API_KEY:
         return "Error: Gemini API key not configured."
     
     try:
-        model = genai.GenerativeModel("models/gemma-3-27b-it")
-        response = model.generate_content(prompt)
+        # Imported lazily: agents modules import API_KEY from here
+        from agents.utils import generate_with_fallback
+        response = generate_with_fallback(prompt, chain="chat", use_cache=False)
         return response.text
     except Exception as e:
         return f"Error communicating with Gemini: {str(e)}"
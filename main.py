@@ -10,8 +10,10 @@ from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from limiter import limiter
 
+import dependencies
 import firebase_admin_setup
-from routers import pantry, nutrition, recipes, payments, users
+from firestore_db import FirestoreRpcMiddleware, RPC_HEADER
+from routers import pantry, nutrition, recipes, payments, users, chat
 
 # ── Logging ─────────────────────────────────────────────────────────────────
 logging.basicConfig(
@@ -54,7 +56,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Page-Token", RPC_HEADER],
 )
+app.add_middleware(FirestoreRpcMiddleware)
 
 
 def _cors_headers(request: Request) -> dict:
@@ -118,6 +122,27 @@ def startup_event():
     firebase_admin_setup.init_firebase()
     logger.info("Firebase Admin initialised")
 
+    if dependencies.TIER_LISTENER_ENABLED:
+        from firestore_db import FIRESTORE_BACKEND, get_firestore
+        from storage import STORAGE_BACKEND
+        if STORAGE_BACKEND != "firestore":
+            logger.warning("TIER_CACHE_LISTENER ignored: subscriptions are not stored in Firestore")
+        elif FIRESTORE_BACKEND == "memory":
+            logger.warning("TIER_CACHE_LISTENER ignored: the memory Firestore backend has no snapshot listeners")
+        else:
+            dependencies.start_tier_listener(get_firestore())
+
+
+@app.on_event("startup")
+async def resume_account_deletions():
+    """Picks up account deletions a crash or restart interrupted."""
+    import account_deletion
+    from storage import app_storage
+    try:
+        await account_deletion.deleter.resume_unfinished(app_storage())
+    except Exception as e:
+        logger.warning("Could not resume account deletions: %s", e)
+
 
 # ── Health ────────────────────────────────────────────────────────────────────
 @app.get("/health")
@@ -143,3 +168,4 @@ app.include_router(nutrition.router)
 app.include_router(recipes.router)
 app.include_router(payments.router)
 app.include_router(users.router)
+app.include_router(chat.router)
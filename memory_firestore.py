@@ -0,0 +1,758 @@
+"""
+In-memory Firestore backend for offline benchmarks and concurrency tests.
+
+MemoryFirestore implements the GAPIC RPCs the Firestore client libraries
+call (commit, batch_get_documents, run_query, transactions, ...) against
+process-local data, so a real firestore.Client or AsyncClient runs on top
+of it unchanged: document references, queries, batches, merge writes,
+Increment and the other field transforms, preconditions and @transactional
+all go through the same client code as in production. Transactions take
+per-document locks on what they read, as Firestore's server SDK
+transactions do, so racing read-modify-write transactions serialise
+instead of losing updates. Every RPC can be delayed by a fixed latency.
+
+Not emulated: snapshot listeners (on_snapshot), aggregation queries,
+read_time reads and index requirements.
+
+Selected with FIRESTORE_BACKEND=memory (see firestore_db.get_firestore);
+FIRESTORE_MEMORY_LATENCY_MS sets the per-RPC latency.
+"""
+import asyncio
+import itertools
+import math
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Set
+
+import proto
+from google.api_core.exceptions import AlreadyExists, Aborted, FailedPrecondition, InvalidArgument, NotFound
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+from google.cloud.firestore_v1.types import common, document, firestore as firestore_types, query as query_types, write
+from google.protobuf.timestamp_pb2 import Timestamp
+
+PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID") or "memory"
+RPC_LATENCY_SECONDS = float(os.getenv("FIRESTORE_MEMORY_LATENCY_MS", "0")) / 1000
+# A transaction waiting longer than this for another's lock is aborted
+LOCK_TIMEOUT_SECONDS = 10.0
+
+_Document = document.Document.pb()
+_Value = document.Value.pb()
+_Direction = query_types.StructuredQuery.Direction
+_FieldOp = query_types.StructuredQuery.FieldFilter.Operator
+_UnaryOp = query_types.StructuredQuery.UnaryFilter.Operator
+_CompositeOp = query_types.StructuredQuery.CompositeFilter.Operator
+
+_RANGE_OPS = {_FieldOp.LESS_THAN, _FieldOp.LESS_THAN_OR_EQUAL, _FieldOp.GREATER_THAN, _FieldOp.GREATER_THAN_OR_EQUAL}
+_INEQUALITY_OPS = _RANGE_OPS | {_FieldOp.NOT_EQUAL, _FieldOp.NOT_IN}
+_INT64_MIN, _INT64_MAX = -(2 ** 63), 2 ** 63 - 1
+
+
+class _LockBusy(Exception):
+    """A transactional call found a document locked by another transaction."""
+
+
+def _raw(message_cls, value):
+    """Raw protobuf for a request field passed as a proto-plus message, raw message or dict."""
+    if value is None:
+        return None
+    if isinstance(value, proto.Message):
+        return type(value).pb(value)
+    if isinstance(value, dict):
+        return message_cls.pb(message_cls(value))
+    return value
+
+
+# ── Values ───────────────────────────────────────────────────────────────────
+
+def _key(value) -> tuple:
+    """Sort/equality key following Firestore's cross-type value ordering."""
+    kind = value.WhichOneof("value_type")
+    if kind == "boolean_value":
+        return (1, value.boolean_value)
+    if kind == "integer_value":
+        return (2, 1, value.integer_value)
+    if kind == "double_value":
+        return (2, 0) if math.isnan(value.double_value) else (2, 1, value.double_value)
+    if kind == "timestamp_value":
+        return (3, value.timestamp_value.seconds, value.timestamp_value.nanos)
+    if kind == "string_value":
+        return (4, value.string_value)
+    if kind == "bytes_value":
+        return (5, value.bytes_value)
+    if kind == "reference_value":
+        return (6, tuple(value.reference_value.split("/")))
+    if kind == "geo_point_value":
+        return (7, value.geo_point_value.latitude, value.geo_point_value.longitude)
+    if kind == "array_value":
+        return (8, tuple(_key(v) for v in value.array_value.values))
+    if kind == "map_value":
+        return (9, tuple(sorted((k, _key(v)) for k, v in value.map_value.fields.items())))
+    return (0,)  # null
+
+
+def _name_key(name: str) -> tuple:
+    return (6, tuple(name.split("/")))
+
+
+def _number(value) -> Optional[float]:
+    kind = value.WhichOneof("value_type") if value is not None else None
+    if kind == "integer_value":
+        return value.integer_value
+    if kind == "double_value":
+        return value.double_value
+    return None
+
+
+def _number_value(number):
+    if isinstance(number, int):
+        return _Value(integer_value=min(max(number, _INT64_MIN), _INT64_MAX))
+    return _Value(double_value=number)
+
+
+def _parts(field_path: str) -> tuple:
+    return FieldPath.from_api_repr(field_path).parts
+
+
+def _get_field(fields, parts):
+    for part in parts[:-1]:
+        if part not in fields or fields[part].WhichOneof("value_type") != "map_value":
+            return None
+        fields = fields[part].map_value.fields
+    return fields[parts[-1]] if parts[-1] in fields else None
+
+
+def _set_field(fields, parts, value) -> None:
+    for part in parts[:-1]:
+        node = fields[part]
+        if node.WhichOneof("value_type") != "map_value":
+            node.Clear()
+            node.map_value.SetInParent()
+        fields = node.map_value.fields
+    fields[parts[-1]].CopyFrom(value)
+
+
+def _delete_field(fields, parts) -> None:
+    for part in parts[:-1]:
+        if part not in fields or fields[part].WhichOneof("value_type") != "map_value":
+            return
+        fields = fields[part].map_value.fields
+    if parts[-1] in fields:
+        del fields[parts[-1]]
+
+
+def _project(doc, field_paths) -> "_Document":
+    out = _Document(name=doc.name, create_time=doc.create_time, update_time=doc.update_time)
+    for path in field_paths:
+        parts = _parts(path)
+        value = _get_field(doc.fields, parts)
+        if value is not None:
+            _set_field(out.fields, parts, value)
+    return out
+
+
+# ── Writes ───────────────────────────────────────────────────────────────────
+
+def _apply_transform(fields, transform, commit_time):
+    parts = _parts(transform.field_path)
+    current = _get_field(fields, parts)
+    kind = transform.WhichOneof("transform_type")
+    if kind == "set_to_server_value":
+        result = _Value(timestamp_value=commit_time)
+    elif kind == "increment":
+        base, operand = _number(current), _number(transform.increment)
+        if base is None:
+            result = transform.increment
+        elif isinstance(base, int) and isinstance(operand, int):
+            result = _number_value(base + operand)
+        else:
+            result = _number_value(float(base) + float(operand))
+    elif kind in ("maximum", "minimum"):
+        operand = getattr(transform, kind)
+        base = _number(current)
+        pick = max if kind == "maximum" else min
+        if base is not None and pick(base, _number(operand)) == base:
+            return current
+        result = operand
+    else:
+        existing = list(current.array_value.values) if current is not None and current.HasField("array_value") else []
+        elements = getattr(transform, kind).values
+        if kind == "append_missing_elements":
+            keys = {_key(v) for v in existing}
+            for element in elements:
+                if _key(element) not in keys:
+                    existing.append(element)
+                    keys.add(_key(element))
+        else:
+            removed = {_key(v) for v in elements}
+            existing = [v for v in existing if _key(v) not in removed]
+        result = _Value()
+        result.array_value.SetInParent()
+        result.array_value.values.extend(existing)
+    _set_field(fields, parts, result)
+    return result
+
+
+class _Transaction:
+    def __init__(self, read_only: bool):
+        self.read_only = read_only
+        self.reads: Dict[str, Optional[tuple]] = {}  # name -> update time when read
+        self.locks: Set[str] = set()
+
+
+class MemoryFirestore:
+    """
+    Process-local Firestore data plus the RPCs the client libraries make.
+    Thread-safe; one instance can back any number of sync and async clients.
+    """
+
+    def __init__(self, latency: float = 0.0, lock_timeout: float = LOCK_TIMEOUT_SECONDS):
+        self.latency = latency
+        self.lock_timeout = lock_timeout
+        self._cond = threading.Condition()
+        self._collections: Dict[str, Dict[str, "_Document"]] = {}  # collection path -> id -> doc
+        self._transactions: Dict[bytes, _Transaction] = {}
+        self._locks: Dict[str, bytes] = {}  # document name -> owning transaction
+        self._txn_ids = itertools.count(1)
+        self._last_micros = 0
+
+    def reset(self) -> None:
+        with self._cond:
+            self._collections.clear()
+            self._transactions.clear()
+            self._locks.clear()
+            self._cond.notify_all()
+
+    # ── Storage ──────────────────────────────────────────────────────────────
+
+    def _now(self) -> Timestamp:
+        # Strictly increasing, so every commit has its own update_time
+        self._last_micros = max(time.time_ns() // 1000, self._last_micros + 1)
+        ts = Timestamp()
+        ts.FromMicroseconds(self._last_micros)
+        return ts
+
+    def _lookup(self, name: str):
+        collection, _, doc_id = name.rpartition("/")
+        return self._collections.get(collection, {}).get(doc_id)
+
+    def _store(self, name: str, doc) -> None:
+        collection, _, doc_id = name.rpartition("/")
+        if doc is not None:
+            self._collections.setdefault(collection, {})[doc_id] = doc
+            return
+        docs = self._collections.get(collection)
+        if docs is not None:
+            docs.pop(doc_id, None)
+            if not docs:
+                del self._collections[collection]
+
+    # ── Transactions ─────────────────────────────────────────────────────────
+
+    def _transaction(self, transaction_id: Optional[bytes]) -> Optional[_Transaction]:
+        if not transaction_id:
+            return None
+        txn = self._transactions.get(transaction_id)
+        if txn is None:
+            raise InvalidArgument("Transaction is invalid or has expired.")
+        return txn
+
+    def _lock(self, transaction_id: bytes, txn: _Transaction, names, blocking: bool) -> None:
+        deadline = time.monotonic() + self.lock_timeout
+        for name in names:
+            while self._locks.get(name, transaction_id) != transaction_id:
+                remaining = deadline - time.monotonic()
+                if not blocking:
+                    raise _LockBusy(name)
+                if remaining <= 0:
+                    raise Aborted(f"Transaction lock timeout on {name}")
+                self._cond.wait(remaining)
+            self._locks[name] = transaction_id
+            txn.locks.add(name)
+
+    def _release(self, transaction_id: bytes) -> None:
+        txn = self._transactions.pop(transaction_id, None)
+        if txn is None:
+            return
+        for name in txn.locks:
+            if self._locks.get(name) == transaction_id:
+                del self._locks[name]
+        self._cond.notify_all()
+
+    def _read_locked(self, transaction_id, txn, read, blocking: bool) -> dict:
+        """
+        Runs read() (returning documents by name, None for missing ones) and,
+        inside a read-write transaction, locks what it returned. If another
+        transaction holds one of those locks the read waits and runs again,
+        so the result is never older than the lock.
+        """
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            docs = read()
+            if txn is None or txn.read_only:
+                return docs
+            try:
+                self._lock(transaction_id, txn, docs, blocking=False)
+            except _LockBusy as e:
+                remaining = deadline - time.monotonic()
+                if not blocking:
+                    raise
+                if remaining <= 0:
+                    raise Aborted(f"Transaction lock timeout on {e}")
+                self._cond.wait(remaining)
+                continue
+            for name, doc in docs.items():
+                txn.reads.setdefault(name, _version(doc))
+            return docs
+
+    def begin_transaction(self, request) -> firestore_types.BeginTransactionResponse:
+        options = _raw(common.TransactionOptions, request.get("options"))
+        read_only = options is not None and options.HasField("read_only")
+        with self._cond:
+            transaction_id = next(self._txn_ids).to_bytes(8, "big")
+            self._transactions[transaction_id] = _Transaction(read_only)
+        return firestore_types.BeginTransactionResponse(transaction=transaction_id)
+
+    def rollback(self, request) -> None:
+        with self._cond:
+            self._release(request["transaction"])
+
+    # ── Reads ────────────────────────────────────────────────────────────────
+
+    def batch_get_documents(self, request, blocking: bool = True) -> List[firestore_types.BatchGetDocumentsResponse]:
+        mask = _raw(common.DocumentMask, request.get("mask"))
+        names = list(request["documents"])
+        with self._cond:
+            transaction_id = request.get("transaction")
+            txn = self._transaction(transaction_id)
+            docs = self._read_locked(
+                transaction_id, txn, lambda: {name: self._lookup(name) for name in names}, blocking,
+            )
+            read_time = self._now()
+            responses = []
+            for name in names:
+                doc = docs[name]
+                if doc is None:
+                    response = firestore_types.BatchGetDocumentsResponse(missing=name, read_time=read_time)
+                else:
+                    found = _project(doc, mask.field_paths) if mask is not None else doc
+                    response = firestore_types.BatchGetDocumentsResponse(found=found, read_time=read_time)
+                responses.append(response)
+        return responses
+
+    def run_query(self, request, blocking: bool = True) -> List[firestore_types.RunQueryResponse]:
+        structured = _raw(query_types.StructuredQuery, request["structured_query"])
+        with self._cond:
+            transaction_id = request.get("transaction")
+            txn = self._transaction(transaction_id)
+            skipped = 0
+
+            def read():
+                nonlocal skipped
+                docs, skipped = self._query(request["parent"], structured)
+                return {doc.name: doc for doc in docs}
+
+            docs = list(self._read_locked(transaction_id, txn, read, blocking).values())
+            read_time = self._now()
+            if structured.HasField("select"):
+                docs = [_project(doc, [f.field_path for f in structured.select.fields]) for doc in docs]
+        if not docs:
+            return [firestore_types.RunQueryResponse(read_time=read_time, skipped_results=skipped)]
+        return [
+            firestore_types.RunQueryResponse(document=doc, read_time=read_time, skipped_results=skipped if i == 0 else 0)
+            for i, doc in enumerate(docs)
+        ]
+
+    def _query(self, parent: str, structured):
+        candidates = []
+        for selector in structured.from_:
+            if selector.all_descendants:
+                prefix = parent + "/"
+                for path, docs in self._collections.items():
+                    if path.startswith(prefix) and path.rpartition("/")[2] == selector.collection_id:
+                        candidates.extend(docs.values())
+            else:
+                candidates.extend(self._collections.get(f"{parent}/{selector.collection_id}", {}).values())
+
+        orders = [(o.field.field_path, o.direction) for o in structured.order_by]
+        ordered = {field for field, _ in orders}
+        last_direction = orders[-1][1] if orders else _Direction.ASCENDING
+        if structured.HasField("where"):
+            for field in sorted(_inequality_fields(structured.where)):
+                if field not in ordered:
+                    orders.append((field, last_direction))
+                    ordered.add(field)
+            candidates = [doc for doc in candidates if _matches(doc, structured.where)]
+        if "__name__" not in ordered:
+            orders.append(("__name__", last_direction))
+
+        # Documents without an ordered-by field are left out, as in Firestore
+        fields = [(field, None if field == "__name__" else _parts(field), direction) for field, direction in orders]
+        rows = []
+        for doc in candidates:
+            keys = []
+            for _, parts, _ in fields:
+                if parts is None:
+                    keys.append(_name_key(doc.name))
+                    continue
+                value = _get_field(doc.fields, parts)
+                if value is None:
+                    break
+                keys.append(_key(value))
+            else:
+                rows.append((keys, doc))
+        for i in reversed(range(len(fields))):
+            rows.sort(key=lambda row: row[0][i], reverse=fields[i][2] == _Direction.DESCENDING)
+
+        directions = [direction for _, _, direction in fields]
+        if structured.HasField("start_at"):
+            start = structured.start_at
+            cursor = [_key(v) for v in start.values]
+            rows = [r for r in rows if _compare(r[0], cursor, directions) >= (0 if start.before else 1)]
+        if structured.HasField("end_at"):
+            end = structured.end_at
+            cursor = [_key(v) for v in end.values]
+            rows = [r for r in rows if _compare(r[0], cursor, directions) <= (-1 if end.before else 0)]
+
+        skipped = min(structured.offset, len(rows))
+        rows = rows[skipped:]
+        if structured.HasField("limit"):
+            rows = rows[:structured.limit.value]
+        return [doc for _, doc in rows], skipped
+
+    def list_collection_ids(self, request) -> List[str]:
+        prefix = request["parent"] + "/"
+        with self._cond:
+            ids = {path[len(prefix):].split("/", 1)[0] for path in self._collections if path.startswith(prefix)}
+        return sorted(ids)
+
+    def list_documents(self, request) -> List["_Document"]:
+        collection = f"{request['parent']}/{request['collection_id']}"
+        mask = _raw(common.DocumentMask, request.get("mask"))
+        with self._cond:
+            docs = {doc.name: doc for doc in self._collections.get(collection, {}).values()}
+            if request.get("show_missing"):
+                # Missing documents that still have subcollections under them
+                prefix = collection + "/"
+                for path in self._collections:
+                    if path.startswith(prefix):
+                        name = prefix + path[len(prefix):].split("/", 1)[0]
+                        docs.setdefault(name, _Document(name=name))
+            result = [_project(doc, mask.field_paths) if mask is not None else doc for doc in docs.values()]
+        return sorted(result, key=lambda doc: doc.name)
+
+    # ── Writes ───────────────────────────────────────────────────────────────
+
+    def commit(self, request, blocking: bool = True) -> firestore_types.CommitResponse:
+        writes = [_raw(write.Write, w) for w in request.get("writes") or []]
+        with self._cond:
+            transaction_id = request.get("transaction")
+            txn = self._transaction(transaction_id)
+            if txn is not None:
+                try:
+                    self._lock(transaction_id, txn, [_write_name(w) for w in writes], blocking)
+                    for name, version in txn.reads.items():
+                        if _version(self._lookup(name)) != version:
+                            raise Aborted("Transaction contention on " + name)
+                except _LockBusy:
+                    raise
+                except Exception:
+                    self._release(transaction_id)
+                    raise
+            commit_time = self._now()
+            try:
+                results = self._apply(writes, commit_time)
+            finally:
+                if txn is not None:
+                    self._release(transaction_id)
+        return firestore_types.CommitResponse(write_results=results, commit_time=commit_time)
+
+    def batch_write(self, request) -> firestore_types.BatchWriteResponse:
+        """Applies each write on its own; one failing does not stop the rest."""
+        results, statuses = [], []
+        with self._cond:
+            for w in request.get("writes") or []:
+                try:
+                    results.extend(self._apply([_raw(write.Write, w)], self._now()))
+                    statuses.append({"code": 0})
+                except (NotFound, AlreadyExists, FailedPrecondition) as e:
+                    results.append(write.WriteResult())
+                    statuses.append({"code": e.grpc_status_code.value[0], "message": e.message})
+        return firestore_types.BatchWriteResponse(write_results=results, status=statuses)
+
+    def _apply(self, writes, commit_time) -> list:
+        """All-or-nothing: nothing is stored unless every write's precondition holds."""
+        staged: Dict[str, Optional["_Document"]] = {}
+        results = []
+        for w in writes:
+            name = _write_name(w)
+            current = staged[name] if name in staged else self._lookup(name)
+            _check_precondition(w, name, current)
+            operation = w.WhichOneof("operation")
+            if operation == "delete":
+                staged[name] = None
+                results.append(write.WriteResult())
+                continue
+            new = _Document(name=name)
+            if operation == "update" and not w.HasField("update_mask"):
+                new.fields.MergeFrom(w.update.fields)
+            else:
+                if current is not None:
+                    new.fields.MergeFrom(current.fields)
+                if operation == "update":
+                    for path in w.update_mask.field_paths:
+                        parts = _parts(path)
+                        value = _get_field(w.update.fields, parts)
+                        if value is None:
+                            _delete_field(new.fields, parts)
+                        else:
+                            _set_field(new.fields, parts, value)
+            transforms = list(w.update_transforms) if operation == "update" else list(w.transform.field_transforms)
+            transform_results = [_apply_transform(new.fields, t, commit_time) for t in transforms]
+            if current is not None and current.fields == new.fields:
+                # Firestore keeps the old update_time when nothing changed
+                new.create_time.CopyFrom(current.create_time)
+                new.update_time.CopyFrom(current.update_time)
+            else:
+                new.create_time.CopyFrom(current.create_time if current is not None else commit_time)
+                new.update_time.CopyFrom(commit_time)
+            staged[name] = new
+            results.append(write.WriteResult(update_time=new.update_time, transform_results=transform_results))
+        for name, doc in staged.items():
+            self._store(name, doc)
+        return results
+
+
+def _version(doc) -> Optional[tuple]:
+    return None if doc is None else (doc.update_time.seconds, doc.update_time.nanos)
+
+
+def _write_name(w) -> str:
+    operation = w.WhichOneof("operation")
+    if operation == "delete":
+        return w.delete
+    if operation == "update":
+        return w.update.name
+    return w.transform.document
+
+
+def _check_precondition(w, name: str, current) -> None:
+    if not w.HasField("current_document"):
+        return
+    condition = w.current_document
+    if condition.WhichOneof("condition_type") == "exists":
+        if condition.exists and current is None:
+            raise NotFound(f"No document to update: {name}")
+        if not condition.exists and current is not None:
+            raise AlreadyExists(f"Document already exists: {name}")
+    elif current is None or current.update_time != condition.update_time:
+        raise FailedPrecondition(f"The document {name} was modified since its last read time.")
+
+
+# ── Queries ──────────────────────────────────────────────────────────────────
+
+def _compare(keys, cursor, directions) -> int:
+    for key, position, direction in zip(keys, cursor, directions):
+        if key != position:
+            result = -1 if key < position else 1
+            return -result if direction == _Direction.DESCENDING else result
+    return 0
+
+
+def _inequality_fields(where) -> Set[str]:
+    kind = where.WhichOneof("filter_type")
+    if kind == "field_filter":
+        return {where.field_filter.field.field_path} if where.field_filter.op in _INEQUALITY_OPS else set()
+    if kind == "composite_filter":
+        return set().union(*(_inequality_fields(f) for f in where.composite_filter.filters))
+    return set()
+
+
+def _field_value(doc, field_path: str):
+    if field_path == "__name__":
+        return _Value(reference_value=doc.name)
+    return _get_field(doc.fields, _parts(field_path))
+
+
+def _matches(doc, where) -> bool:
+    kind = where.WhichOneof("filter_type")
+    if kind == "composite_filter":
+        results = (_matches(doc, f) for f in where.composite_filter.filters)
+        return any(results) if where.composite_filter.op == _CompositeOp.OR else all(results)
+    if kind == "unary_filter":
+        value = _field_value(doc, where.unary_filter.field.field_path)
+        op = where.unary_filter.op
+        if value is None:
+            return False
+        is_null = value.WhichOneof("value_type") == "null_value"
+        is_nan = value.WhichOneof("value_type") == "double_value" and math.isnan(value.double_value)
+        if op == _UnaryOp.IS_NULL:
+            return is_null
+        if op == _UnaryOp.IS_NAN:
+            return is_nan
+        if op == _UnaryOp.IS_NOT_NULL:
+            return not is_null
+        return not is_nan and not is_null
+
+    f = where.field_filter
+    value = _field_value(doc, f.field.field_path)
+    if value is None:
+        return False  # every field filter, != included, needs the field to exist
+    key, target = _key(value), _key(f.value)
+    op = f.op
+    if op == _FieldOp.EQUAL:
+        return key == target
+    if op == _FieldOp.NOT_EQUAL:
+        return key != target and key != (0,)
+    if op in _RANGE_OPS:
+        # Range filters only match values of the same type
+        if key[0] != target[0] or key == (2, 0) or target == (2, 0):
+            return False
+        if op == _FieldOp.LESS_THAN:
+            return key < target
+        if op == _FieldOp.LESS_THAN_OR_EQUAL:
+            return key <= target
+        if op == _FieldOp.GREATER_THAN:
+            return key > target
+        return key >= target
+    elements = {_key(v) for v in f.value.array_value.values}
+    if op == _FieldOp.IN:
+        return key in elements
+    if op == _FieldOp.NOT_IN:
+        return key not in elements and key != (0,)
+    if value.WhichOneof("value_type") != "array_value":
+        return False
+    values = {_key(v) for v in value.array_value.values}
+    if op == _FieldOp.ARRAY_CONTAINS:
+        return target in values
+    return bool(values & elements)  # ARRAY_CONTAINS_ANY
+
+
+# ── GAPIC stand-ins ──────────────────────────────────────────────────────────
+
+class _SyncApi:
+    """What firestore.Client calls as _firestore_api: blocking, returns iterators."""
+
+    def __init__(self, backend: MemoryFirestore):
+        self._backend = backend
+
+    def _wait(self) -> None:
+        if self._backend.latency:
+            time.sleep(self._backend.latency)
+
+    def commit(self, request, **kwargs):
+        self._wait()
+        return self._backend.commit(request)
+
+    def batch_write(self, request, **kwargs):
+        self._wait()
+        return self._backend.batch_write(request)
+
+    def begin_transaction(self, request, **kwargs):
+        self._wait()
+        return self._backend.begin_transaction(request)
+
+    def rollback(self, request, **kwargs):
+        self._wait()
+        self._backend.rollback(request)
+
+    def batch_get_documents(self, request, **kwargs) -> Iterator:
+        self._wait()
+        return iter(self._backend.batch_get_documents(request))
+
+    def run_query(self, request, **kwargs) -> Iterator:
+        self._wait()
+        return iter(self._backend.run_query(request))
+
+    def list_collection_ids(self, request, **kwargs) -> Iterator[str]:
+        self._wait()
+        return iter(self._backend.list_collection_ids(request))
+
+    def list_documents(self, request, **kwargs) -> Iterator:
+        self._wait()
+        return iter(self._backend.list_documents(request))
+
+
+class _AsyncApi:
+    """
+    What firestore.AsyncClient calls as _firestore_api. Waiting for another
+    transaction's lock is done by polling with asyncio.sleep, so a blocked
+    transaction never blocks the event loop the lock holder runs on.
+    """
+
+    def __init__(self, backend: MemoryFirestore):
+        self._backend = backend
+
+    async def _wait(self) -> None:
+        if self._backend.latency:
+            await asyncio.sleep(self._backend.latency)
+
+    async def _until_unlocked(self, call, request):
+        deadline = time.monotonic() + self._backend.lock_timeout
+        delay = 0.001
+        while True:
+            try:
+                return call(request, blocking=False)
+            except _LockBusy as e:
+                if time.monotonic() >= deadline:
+                    self._backend.rollback({"transaction": request["transaction"]})
+                    raise Aborted(f"Transaction lock timeout on {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.05)
+
+    async def commit(self, request, **kwargs):
+        await self._wait()
+        return await self._until_unlocked(self._backend.commit, request)
+
+    async def batch_write(self, request, **kwargs):
+        await self._wait()
+        return self._backend.batch_write(request)
+
+    async def begin_transaction(self, request, **kwargs):
+        await self._wait()
+        return self._backend.begin_transaction(request)
+
+    async def rollback(self, request, **kwargs):
+        await self._wait()
+        self._backend.rollback(request)
+
+    async def batch_get_documents(self, request, **kwargs):
+        await self._wait()
+        return _aiter(await self._until_unlocked(self._backend.batch_get_documents, request))
+
+    async def run_query(self, request, **kwargs):
+        await self._wait()
+        return _aiter(await self._until_unlocked(self._backend.run_query, request))
+
+    async def list_collection_ids(self, request, **kwargs):
+        await self._wait()
+        return _aiter(self._backend.list_collection_ids(request))
+
+    async def list_documents(self, request, **kwargs):
+        await self._wait()
+        return _aiter(self._backend.list_documents(request))
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+# One backend per process, shared by the sync and async clients
+backend = MemoryFirestore(latency=RPC_LATENCY_SECONDS)
+
+
+def client(memory: Optional[MemoryFirestore] = None) -> firestore.Client:
+    """A firestore.Client whose RPCs are served by memory (the shared backend by default)."""
+    db = firestore.Client(project=PROJECT_ID, credentials=AnonymousCredentials())
+    db._firestore_api_internal = _SyncApi(memory or backend)
+    return db
+
+
+def async_client(memory: Optional[MemoryFirestore] = None) -> firestore.AsyncClient:
+    """client() for firestore.AsyncClient."""
+    db = firestore.AsyncClient(project=PROJECT_ID, credentials=AnonymousCredentials())
+    db._firestore_api_internal = _AsyncApi(memory or backend)
+    return db
@@ -0,0 +1,98 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, List, NamedTuple, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Response
+
+# List endpoints keep returning a plain JSON array; the cursor for the next
+# page travels in this header (exposed to the browser via CORS in main.py).
+NEXT_PAGE_HEADER = "X-Next-Page-Token"
+
+
+class Page(NamedTuple):
+    items: List[dict]
+    next_page_token: Optional[str]
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"ts": value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict) and set(value) == {"ts"}:
+        return datetime.fromisoformat(value["ts"])
+    return value
+
+
+def encode_page_token(values: Sequence[Any]) -> str:
+    payload = json.dumps([_encode_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_page_token(token: str) -> List[Any]:
+    """Inverse of encode_page_token; raises ValueError for anything it did not produce."""
+    try:
+        payload = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(payload)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError("Invalid page token") from e
+    if not isinstance(values, list):
+        raise ValueError("Invalid page token")
+    return [_decode_value(v) for v in values]
+
+
+def page_cursor(page_token: Optional[str], size: int) -> Optional[List[Any]]:
+    """The cursor values in page_token (None for the first page); a malformed token is a 400."""
+    if not page_token:
+        return None
+    try:
+        values = decode_page_token(page_token)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid page token")
+    if len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid page token")
+    return values
+
+
+def page_response(page: Page, response: Response) -> List[dict]:
+    """The page's items, setting NEXT_PAGE_HEADER when another page follows."""
+    if page.next_page_token:
+        response.headers[NEXT_PAGE_HEADER] = page.next_page_token
+    return page.items
+
+
+async def paginate(
+    query,
+    order_by: Sequence[Tuple[str, str]],
+    limit: int,
+    page_token: Optional[str],
+) -> Tuple[list, Optional[str]]:
+    """
+    Returns one page of document snapshots from an AsyncClient query,
+    ordered by order_by (field, direction) pairs with the document id as
+    the final tie-breaker so the order is total, plus the token for the next
+    page (None on the last one). Pages resume with start_after from the
+    previous page's last document instead of an offset, so every page costs
+    the same number of reads.
+    """
+    id_direction = order_by[-1][1] if order_by else "ASCENDING"
+    for field, direction in order_by:
+        query = query.order_by(field, direction=direction)
+    query = query.order_by("__name__", direction=id_direction)
+    fields = [field for field, _ in order_by] + ["__name__"]
+
+    values = page_cursor(page_token, len(fields))
+    if values is not None:
+        query = query.start_after(dict(zip(fields, values)))
+
+    # One extra document tells us whether there is a next page
+    docs = [doc async for doc in query.limit(limit + 1).stream()]
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    data = docs[-1].to_dict()
+    return docs, encode_page_token([data.get(field) for field, _ in order_by] + [docs[-1].id])
@@ -0,0 +1,69 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from agents.cache import ResponseCache
+
+# Per-user recipe suggestions, keyed by what the prompt is built from. A user
+# navigating back to the recipes page gets the same suggestions without an
+# LLM call or a free-tier quota hit until their pantry or request changes.
+suggestion_cache = ResponseCache(
+    max_entries=int(os.getenv("RECIPE_CACHE_MAX_ENTRIES", "2048")),
+    default_ttl=float(os.getenv("RECIPE_CACHE_TTL_SECONDS", "21600")),
+)
+
+
+class CachedSuggestions(NamedTuple):
+    recipes: List[dict]
+    # Generated in the background (recipe_precompute) and not served yet
+    precomputed: bool
+
+
+_versions: Dict[str, int] = {}
+_versions_lock = threading.Lock()
+
+
+def _normalise(text: Any) -> str:
+    return " ".join(str(text or "").split()).lower()
+
+
+def _quantity(value: Any) -> str:
+    try:
+        return repr(float(value))
+    except (TypeError, ValueError):
+        return _normalise(value)
+
+
+def pantry_fingerprint(pantry_items: List[dict], preferences: str, time_of_day: str) -> str:
+    """
+    Stable hash of (pantry items, preferences, time_of_day): item order,
+    whitespace and letter case do not change it; "2" and 2.0 are the same.
+    """
+    items = sorted(
+        (_normalise(item.get("name")), _quantity(item.get("quantity")), _normalise(item.get("unit")))
+        for item in pantry_items
+    )
+    payload = json.dumps([items, _normalise(preferences), _normalise(time_of_day)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def pantry_version(uid: str) -> int:
+    with _versions_lock:
+        return _versions.get(uid, 0)
+
+
+def bump_pantry_version(uid: str) -> None:
+    """Called on every pantry mutation; the user's cached suggestions stop matching."""
+    with _versions_lock:
+        _versions[uid] = _versions.get(uid, 0) + 1
+
+
+def get_suggestions(uid: str, fingerprint: str) -> Optional[CachedSuggestions]:
+    return suggestion_cache.get((uid, pantry_version(uid), fingerprint))
+
+
+def store_suggestions(uid: str, fingerprint: str, recipes: List[dict], precomputed: bool = False) -> None:
+    if recipes:
+        suggestion_cache.put((uid, pantry_version(uid), fingerprint), CachedSuggestions(recipes, precomputed))
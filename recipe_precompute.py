@@ -0,0 +1,207 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Set, Tuple
+
+import recipe_cache
+import schemas
+from agents import recipe_agent
+from agents.deadline import deadline_scope
+from agents.utils import chain_healthy
+from storage import background_storage
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: every pantry edit by a user who has asked for suggestions before
+# spends a Gemini call in the background, whether or not they come back.
+PRECOMPUTE_ENABLED = os.getenv("RECIPE_PRECOMPUTE_ENABLED", "false").lower() == "true"
+# Quiet period after the last pantry change before generating, so a burst of
+# edits (or the items of one vision import) costs a single call
+DEBOUNCE_SECONDS = float(os.getenv("RECIPE_PRECOMPUTE_DEBOUNCE_SECONDS", "5"))
+MAX_PENDING = int(os.getenv("RECIPE_PRECOMPUTE_MAX_PENDING", "256"))
+# Background generations in flight at once, across all users
+CONCURRENCY = int(os.getenv("RECIPE_PRECOMPUTE_CONCURRENCY", "2"))
+BUDGET_SECONDS = float(os.getenv("RECIPE_PRECOMPUTE_BUDGET_SECONDS", "90"))
+
+_MAX_REMEMBERED = 4096
+_last_requests: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+_last_requests_lock = threading.Lock()
+
+
+def remember_request(uid: str, preferences: str, time_of_day: str) -> None:
+    """Records what the user last asked for; precomputes repeat that request."""
+    with _last_requests_lock:
+        _last_requests[uid] = (preferences, time_of_day)
+        _last_requests.move_to_end(uid)
+        while len(_last_requests) > _MAX_REMEMBERED:
+            _last_requests.popitem(last=False)
+
+
+def last_request(uid: str) -> Optional[Tuple[str, str]]:
+    with _last_requests_lock:
+        return _last_requests.get(uid)
+
+
+def precompute_suggestions(uid: str) -> bool:
+    """
+    Generates and caches suggestions for the user's current pantry. Returns
+    False without calling the model when there is nothing worth generating.
+    Runs on a worker thread, so it reads with the storage's blocking methods.
+    """
+    request = last_request(uid)
+    if request is None:
+        return False  # never asked for suggestions, so nothing to predict
+    if not chain_healthy("text"):
+        return False
+    preferences, time_of_day = request
+    items_list = background_storage().pantry.prompt_items_blocking(uid)
+    if not items_list:
+        return False
+    fingerprint = recipe_cache.pantry_fingerprint(items_list, preferences, time_of_day)
+    if recipe_cache.get_suggestions(uid, fingerprint) is not None:
+        return False
+    with deadline_scope(BUDGET_SECONDS):
+        recipes = recipe_agent.suggest_recipes(items_list, preferences, time_of_day)
+    recipes = [schemas.RecipeResponse.model_validate(r).model_dump() for r in recipes]
+    recipe_cache.store_suggestions(uid, fingerprint, recipes, precomputed=True)
+    return bool(recipes)
+
+
+class RecipePrecomputer:
+    """
+    Debounced background queue of per-user precompute jobs. Scheduling a
+    user who is already pending restarts their quiet period instead of
+    queueing a second job; the queue is bounded and new users are dropped
+    when it is full. At most concurrency jobs run at once, and never two
+    for the same user.
+    """
+
+    def __init__(
+        self,
+        job: Callable[[str], bool],
+        enabled: bool = True,
+        debounce_seconds: float = 5.0,
+        max_pending: int = 256,
+        concurrency: int = 2,
+    ):
+        self.enabled = enabled
+        self.debounce_seconds = debounce_seconds
+        self.max_pending = max_pending
+        self.concurrency = concurrency
+        self._job = job
+        self._cond = threading.Condition()
+        self._pending: Dict[str, float] = {}  # uid -> due time
+        self._running: Set[str] = set()
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._dispatcher: Optional[threading.Thread] = None
+        self.scheduled = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.computed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.served = 0
+
+    def schedule(self, uid: str) -> bool:
+        """Queues a precompute for uid after the debounce; False if disabled or full."""
+        if not self.enabled:
+            return False
+        with self._cond:
+            if uid in self._pending:
+                self.coalesced += 1
+            elif len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            else:
+                self.scheduled += 1
+            self._pending[uid] = time.monotonic() + self.debounce_seconds
+            self._start()
+            self._cond.notify_all()
+        return True
+
+    def record_served(self) -> None:
+        """A precomputed result answered a suggestion request."""
+        with self._cond:
+            self.served += 1
+
+    def _start(self) -> None:
+        if self._dispatcher is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="recipe-precompute")
+            self._dispatcher = threading.Thread(target=self._dispatch, name="recipe-precompute-dispatch", daemon=True)
+            self._dispatcher.start()
+
+    def _next_due(self) -> str:
+        # Called with the condition held; users with a job running stay pending
+        while True:
+            ready = [(due, uid) for uid, due in self._pending.items() if uid not in self._running]
+            if not ready:
+                self._cond.wait()
+                continue
+            due, uid = min(ready)
+            wait = due - time.monotonic()
+            if wait > 0:
+                self._cond.wait(wait)
+                continue
+            del self._pending[uid]
+            self._running.add(uid)
+            return uid
+
+    def _dispatch(self) -> None:
+        while True:
+            self._slots.acquire()
+            with self._cond:
+                uid = self._next_due()
+            self._executor.submit(self._run, uid)
+
+    def _run(self, uid: str) -> None:
+        outcome = "failed"
+        try:
+            outcome = "computed" if self._job(uid) else "skipped"
+        except Exception:
+            logger.exception("Recipe precompute failed for user %s", uid)
+        finally:
+            with self._cond:
+                setattr(self, outcome, getattr(self, outcome) + 1)
+                self._running.discard(uid)
+                self._cond.notify_all()
+            self._slots.release()
+
+    def wait_idle(self, timeout: float) -> bool:
+        """Blocks until nothing is pending or running (tests and shutdown)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._running:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._cond.wait(left)
+        return True
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "enabled": self.enabled,
+                "pending": len(self._pending),
+                "running": len(self._running),
+                "scheduled": self.scheduled,
+                "coalesced": self.coalesced,
+                "dropped": self.dropped,
+                "computed": self.computed,
+                "skipped": self.skipped,
+                "failed": self.failed,
+                "served": self.served,
+                "hit_rate": self.served / self.computed if self.computed else 0.0,
+            }
+
+
+precomputer = RecipePrecomputer(
+    precompute_suggestions,
+    enabled=PRECOMPUTE_ENABLED,
+    debounce_seconds=DEBOUNCE_SECONDS,
+    max_pending=MAX_PENDING,
+    concurrency=CONCURRENCY,
+)
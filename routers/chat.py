@@ -1,21 +1,66 @@
-from fastapi import APIRouter, Depends, HTTPException
+import logging
+import os
+
+from fastapi import APIRouter, Depends, HTTPException, Request
 
 from dependencies import get_current_user
 import schemas
 from agents import orchestrator_agent
+from agents.deadline import ClientDisconnected, DeadlineExceeded, run_with_deadline
+from routers.nutrition import meal_log_from_analysis
+from storage import get_storage
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["chat"])
 
+# End-to-end time budget for the model work behind /agents/chat
+CHAT_BUDGET_SECONDS = float(os.getenv("CHAT_BUDGET_SECONDS", "30"))
+
+
+async def _log_meal_from_chat(result: dict, store, uid: str):
+    """
+    Combined mode: writes the meal the orchestrator estimated. Nothing is
+    written without a usable payload from the model: a reply it did not
+    estimate a meal for was not confidently about one.
+    """
+    nutrition_data = orchestrator_agent.extract_nutrition(result)
+    if nutrition_data is None:
+        logger.info("Chat reply for user %s had no meal estimate; nothing logged", uid)
+        return None
+    data = meal_log_from_analysis(nutrition_data)
+    return await store.nutrition.add(uid, data)
+
 
 @router.post("/agents/chat", response_model=schemas.ChatResponse)
-def chat_with_orchestrator(request: schemas.ChatRequest, user=Depends(get_current_user)):
-    try:
+async def chat_with_orchestrator(
+    request: schemas.ChatRequest,
+    http_request: Request,
+    store=Depends(get_storage),
+    user=Depends(get_current_user),
+):
+    async def chat() -> schemas.ChatResponse:
         history = [{"role": m.role, "content": m.content} for m in request.history]
-        result = orchestrator_agent.process_chat(request.message, history)
+        result = await orchestrator_agent.process_chat_async(
+            request.message, history, include_nutrition=request.log_meals,
+        )
+        intent = result.get("intent", "general_chat")
+        nutrition_log = None
+        if request.log_meals and intent == "log_nutrition":
+            nutrition_log = await _log_meal_from_chat(result, store, user["uid"])
         return schemas.ChatResponse(
-            intent=result.get("intent", "general_chat"),
+            intent=intent,
             response=result.get("response", "I received your message."),
             extracted_data=result.get("extracted_data", ""),
+            nutrition_log=nutrition_log,
         )
+
+    try:
+        return await run_with_deadline(chat, CHAT_BUDGET_SECONDS, http_request.is_disconnected)
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="The AI took too long to respond. Please try again.")
+    except ClientDisconnected:
+        logger.info("Client disconnected from chat for user %s", user["uid"])
+        raise HTTPException(status_code=499, detail="Client closed request")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Orchestrator error: {str(e)}")
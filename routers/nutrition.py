@@ -1,95 +1,138 @@
 import logging
-from datetime import date
-from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
-from typing import List
+import os
+from datetime import date, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from typing import List, Optional
 
-from firestore_db import get_firestore
 from dependencies import get_current_user
 import schemas
 from agents import nutrition_agent
+from agents.deadline import ClientDisconnected, DeadlineExceeded, run_with_deadline
 from limiter import limiter
+from pagination import page_response
+from storage import get_storage
+from storage.base import DAILY_FIELDS
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["nutrition"])
 
+# End-to-end time budget for the model work behind /agents/nutrition/analyze
+ANALYZE_BUDGET_SECONDS = float(os.getenv("NUTRITION_ANALYZE_BUDGET_SECONDS", "30"))
 
-def _doc_to_log(doc) -> dict:
-    d = doc.to_dict()
-    d["id"] = doc.id
-    return d
+# Longest range /nutrition/daily serves in one call (one rollup read per day)
+MAX_DAILY_RANGE_DAYS = 366
+
+
+def meal_log_from_analysis(nutrition_data: dict) -> dict:
+    """Builds a today-dated nutrition log document from an agent's macro estimate."""
+    return {
+        "meal_name": nutrition_data.get("meal_name", "Unknown Meal"),
+        "calories": nutrition_data.get("calories", 0),
+        "protein": nutrition_data.get("protein", 0),
+        "carbs": nutrition_data.get("carbs", 0),
+        "fat": nutrition_data.get("fat", 0),
+        "date": str(date.today()),
+    }
 
 
 @router.get("/nutrition", response_model=List[schemas.NutritionLog])
-def get_nutrition_logs(
-    db=Depends(get_firestore),
+async def get_nutrition_logs(
+    response: Response,
+    store=Depends(get_storage),
     user=Depends(get_current_user),
     limit: int = Query(200, ge=1, le=200),
-    offset: int = Query(0, ge=0),
+    page_token: Optional[str] = None,
+    from_: Optional[date] = Query(None, alias="from"),
+    to: Optional[date] = None,
 ):
-    uid = user["uid"]
-    docs = (
-        db.collection("users").document(uid).collection("nutrition_logs")
-        .limit(limit).offset(offset).stream()
+    """Newest first; pass the X-Next-Page-Token response header back as page_token for more."""
+    page = await store.nutrition.list(
+        user["uid"], limit, page_token,
+        from_=str(from_) if from_ is not None else None,
+        to=str(to) if to is not None else None,
     )
-    return [_doc_to_log(doc) for doc in docs]
+    return page_response(page, response)
 
 
 @router.post("/nutrition", response_model=schemas.NutritionLog, status_code=status.HTTP_201_CREATED)
-def create_nutrition_log(log: schemas.NutritionLogCreate, db=Depends(get_firestore), user=Depends(get_current_user)):
+async def create_nutrition_log(log: schemas.NutritionLogCreate, store=Depends(get_storage), user=Depends(get_current_user)):
     uid = user["uid"]
     data = log.model_dump()
     if data.get("date") is None:
         data["date"] = str(date.today())
     else:
         data["date"] = str(data["date"])
-    _, doc_ref = db.collection("users").document(uid).collection("nutrition_logs").add(data)
-    return {**data, "id": doc_ref.id}
+    return await store.nutrition.add(uid, data)
+
+
+@router.get("/nutrition/daily", response_model=List[schemas.DailyNutrition])
+async def get_daily_nutrition(
+    from_: date = Query(..., alias="from"),
+    to: date = Query(...),
+    store=Depends(get_storage),
+    user=Depends(get_current_user),
+):
+    """Per-day totals for from..to inclusive. Days without logs are returned as zeros."""
+    if to < from_:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'.")
+    days = (to - from_).days + 1
+    if days > MAX_DAILY_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range is limited to {MAX_DAILY_RANGE_DAYS} days.")
+    rollups = await store.nutrition.daily_totals(user["uid"], str(from_), str(to))
+    result = []
+    for offset in range(days):
+        day = str(from_ + timedelta(days=offset))
+        rollup = rollups.get(day, {})
+        result.append({
+            "date": day,
+            # Increment arithmetic on floats can leave residue like 1e-14 behind
+            **{k: max(0, round(rollup.get(k) or 0, 2)) for k in DAILY_FIELDS},
+            "meals": max(int(rollup.get("meals") or 0), 0),
+        })
+    return result
 
 
 @router.get("/nutrition/{log_id}", response_model=schemas.NutritionLog)
-def get_nutrition_log(log_id: str, db=Depends(get_firestore), user=Depends(get_current_user)):
-    uid = user["uid"]
-    doc = db.collection("users").document(uid).collection("nutrition_logs").document(log_id).get()
-    if not doc.exists:
+async def get_nutrition_log(log_id: str, store=Depends(get_storage), user=Depends(get_current_user)):
+    log = await store.nutrition.get(user["uid"], log_id)
+    if log is None:
         raise HTTPException(status_code=404, detail="Log not found")
-    return _doc_to_log(doc)
+    return log
 
 
 @router.delete("/nutrition/{log_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_nutrition_log(log_id: str, db=Depends(get_firestore), user=Depends(get_current_user)):
-    uid = user["uid"]
-    ref = db.collection("users").document(uid).collection("nutrition_logs").document(log_id)
-    if not ref.get().exists:
+async def delete_nutrition_log(log_id: str, store=Depends(get_storage), user=Depends(get_current_user)):
+    if not await store.nutrition.delete(user["uid"], log_id):
         raise HTTPException(status_code=404, detail="Log not found")
-    ref.delete()
     return None
 
 
 @router.post("/agents/nutrition/analyze", response_model=schemas.NutritionLog)
 @limiter.limit("20/minute")
-def analyze_and_log_meal(
-    request: Request,  # noqa: ARG001 — required by slowapi for rate limiting
+async def analyze_and_log_meal(
+    request: Request,
     body: schemas.NutritionAnalysisRequest,
-    db=Depends(get_firestore),
+    store=Depends(get_storage),
     user=Depends(get_current_user),
 ):
     """Analyze natural language meal description and log nutrition."""
     uid = user["uid"]
     try:
-        nutrition_data = nutrition_agent.analyze_meal(body.meal_description)
-        data = {
-            "meal_name": nutrition_data.get("meal_name", "Unknown Meal"),
-            "calories": nutrition_data.get("calories", 0),
-            "protein": nutrition_data.get("protein", 0),
-            "carbs": nutrition_data.get("carbs", 0),
-            "fat": nutrition_data.get("fat", 0),
-            "date": str(date.today()),
-        }
-        _, doc_ref = db.collection("users").document(uid).collection("nutrition_logs").add(data)
-        return {**data, "id": doc_ref.id}
+        nutrition_data = await run_with_deadline(
+            lambda: nutrition_agent.analyze_meal_async(body.meal_description),
+            ANALYZE_BUDGET_SECONDS,
+            request.is_disconnected,
+        )
+        data = meal_log_from_analysis(nutrition_data)
+        return await store.nutrition.add(uid, data)
     except ValueError as e:
         raise HTTPException(status_code=500, detail=str(e))
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="The AI took too long to respond. Please try again.")
+    except ClientDisconnected:
+        logger.info("Client disconnected from meal analysis for user %s", uid)
+        raise HTTPException(status_code=499, detail="Client closed request")
     except Exception:
         logger.exception("Nutrition analysis failed for user %s", uid)
         raise HTTPException(status_code=500, detail="An unexpected error occurred. Please try again.")
@@ -1,15 +1,22 @@
 import io
 import logging
+import os
 from datetime import datetime, timezone
-from fastapi import APIRouter, Depends, HTTPException, Query, Request, status, UploadFile, File
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from typing import List, Optional, Union
 from PIL import Image
 
-from firestore_db import get_firestore
 from dependencies import get_current_user, require_pro
+import recipe_cache
+import recipe_precompute
 import schemas
 from agents import vision_agent
+from agents.deadline import ClientDisconnected, DeadlineExceeded, run_with_deadline
 from limiter import limiter
+from pagination import page_response
+from storage import get_storage
 
 logger = logging.getLogger(__name__)
 
@@ -17,71 +24,133 @@ router = APIRouter(tags=["pantry"])
 
 MAX_IMAGE_BYTES = 10 * 1024 * 1024  # 10 MB
 
+# Most items one POST /pantry/bulk accepts
+MAX_BULK_ITEMS = 1000
 
-def _doc_to_pantry(doc) -> dict:
-    d = doc.to_dict()
-    d["id"] = doc.id
-    return d
+# End-to-end time budget for the model work behind /agents/vision/scan
+SCAN_BUDGET_SECONDS = float(os.getenv("VISION_SCAN_BUDGET_SECONDS", "60"))
+
+
+def _pantry_changed(uid: str) -> None:
+    """Invalidates the user's cached suggestions and (if enabled) queues fresh ones."""
+    recipe_cache.bump_pantry_version(uid)
+    recipe_precompute.precomputer.schedule(uid)
 
 
 @router.get("/pantry", response_model=List[schemas.PantryItem])
-def get_pantry(
-    db=Depends(get_firestore),
+async def get_pantry(
+    response: Response,
+    store=Depends(get_storage),
     user=Depends(get_current_user),
     limit: int = Query(200, ge=1, le=200),
-    offset: int = Query(0, ge=0),
+    page_token: Optional[str] = None,
 ):
-    uid = user["uid"]
-    docs = db.collection("users").document(uid).collection("pantry").limit(limit).offset(offset).stream()
-    return [_doc_to_pantry(doc) for doc in docs]
+    """Ordered by item id; pass the X-Next-Page-Token response header back as page_token for more."""
+    return page_response(await store.pantry.list(user["uid"], limit, page_token), response)
 
 
 @router.post("/pantry", response_model=schemas.PantryItem, status_code=status.HTTP_201_CREATED)
-def create_pantry_item(item: schemas.PantryItemCreate, db=Depends(get_firestore), user=Depends(get_current_user)):
+async def create_pantry_item(item: schemas.PantryItemCreate, store=Depends(get_storage), user=Depends(get_current_user)):
     uid = user["uid"]
+    created = await store.pantry.create(uid, _item_data(item))
+    _pantry_changed(uid)
+    return created
+
+
+def _item_data(item: schemas.PantryItemCreate) -> dict:
     data = item.model_dump()
     data["date_added"] = datetime.now(timezone.utc)
     if data.get("expiry_date") is not None:
         data["expiry_date"] = str(data["expiry_date"])
-    _, doc_ref = db.collection("users").document(uid).collection("pantry").add(data)
-    return {**data, "id": doc_ref.id}
+    return data
+
+
+async def _import_items(store, uid: str, items: List[schemas.PantryItemCreate]) -> List[dict]:
+    results = await store.pantry.import_items(uid, [_item_data(item) for item in items])
+    if any(r["status"] != "failed" for r in results):
+        _pantry_changed(uid)  # once for the whole import
+    return results
+
+
+@router.post("/pantry/bulk", response_model=List[schemas.PantryImportResult])
+async def bulk_import_pantry(
+    items: List[schemas.PantryItemCreate],
+    store=Depends(get_storage),
+    user=Depends(get_current_user),
+):
+    """
+    Adds many items in one request (e.g. a scanned receipt). Items matching
+    one already in the pantry by name and unit, ignoring case and spacing,
+    add to its quantity instead of creating a duplicate. Returns one result
+    per item, in order.
+    """
+    if len(items) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_ITEMS} items per import.")
+    return await _import_items(store, user["uid"], items)
 
 
 @router.put("/pantry/{item_id}", response_model=schemas.PantryItem)
-def update_pantry_item(item_id: str, item_update: schemas.PantryItemUpdate, db=Depends(get_firestore), user=Depends(get_current_user)):
+async def update_pantry_item(item_id: str, item_update: schemas.PantryItemUpdate, store=Depends(get_storage), user=Depends(get_current_user)):
     uid = user["uid"]
-    ref = db.collection("users").document(uid).collection("pantry").document(item_id)
-    doc = ref.get()
-    if not doc.exists:
-        raise HTTPException(status_code=404, detail="Item not found")
     update_data = item_update.model_dump(exclude_unset=True)
     if "expiry_date" in update_data and update_data["expiry_date"] is not None:
         update_data["expiry_date"] = str(update_data["expiry_date"])
-    ref.update(update_data)
-    updated = doc.to_dict()
-    updated.update(update_data)
-    updated["id"] = item_id
+    updated = await store.pantry.update(uid, item_id, update_data)
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    if update_data:
+        _pantry_changed(uid)
     return updated
 
 
 @router.delete("/pantry/{item_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_pantry_item(item_id: str, db=Depends(get_firestore), user=Depends(get_current_user)):
+async def delete_pantry_item(item_id: str, store=Depends(get_storage), user=Depends(get_current_user)):
     uid = user["uid"]
-    ref = db.collection("users").document(uid).collection("pantry").document(item_id)
-    if not ref.get().exists:
+    if not await store.pantry.delete(uid, item_id):
         raise HTTPException(status_code=404, detail="Item not found")
-    ref.delete()
+    _pantry_changed(uid)
     return None
 
 
-@router.post("/agents/vision/scan", response_model=List[schemas.PantryItemBase])
+def _compress_image(image_bytes: bytes) -> bytes:
+    """Downscale to 1024px JPEG to reduce API latency; returns original bytes if PIL fails."""
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        img.thumbnail((1024, 1024))
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=85)
+        return buf.getvalue()
+    except Exception:
+        return image_bytes  # use original bytes if PIL fails
+
+
+def _scanned_items(raw_items: list) -> List[schemas.PantryItemCreate]:
+    items = []
+    for raw in raw_items:
+        try:
+            items.append(schemas.PantryItemCreate.model_validate(raw))
+        except ValidationError as e:
+            logger.warning("Skipping unusable scanned item %r: %s", raw, e)
+    return items
+
+
+@router.post(
+    "/agents/vision/scan",
+    response_model=Union[List[schemas.PantryImportResult], List[schemas.PantryItemBase]],
+)
 @limiter.limit("5/minute")
 async def scan_receipt_or_fridge(
-    request: Request,  # noqa: ARG001 — required by slowapi for rate limiting
+    request: Request,
     file: UploadFile = File(...),
+    commit: bool = False,
+    store=Depends(get_storage),
     user=Depends(require_pro),
 ):
-    """Pro-only: scan fridge/receipt image and return identified items."""
+    """
+    Pro-only: scan fridge/receipt image and return identified items. With
+    commit=true they are also imported as by POST /pantry/bulk, in the same
+    request, and the import results are returned instead.
+    """
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File provided is not an image.")
 
@@ -89,21 +158,27 @@ async def scan_receipt_or_fridge(
     if len(image_bytes) > MAX_IMAGE_BYTES:
         raise HTTPException(status_code=413, detail="Image must be smaller than 10 MB.")
 
-    # Compress large images to reduce API latency
-    try:
-        img = Image.open(io.BytesIO(image_bytes))
-        img.thumbnail((1024, 1024))
-        buf = io.BytesIO()
-        img.save(buf, format="JPEG", quality=85)
-        image_bytes = buf.getvalue()
-    except Exception:
-        pass  # use original bytes if PIL fails
+    # Compress large images to reduce API latency (CPU-bound, so off the event loop)
+    image_bytes = await run_in_threadpool(_compress_image, image_bytes)
 
     try:
-        items = vision_agent.parse_fridge_image(image_bytes, "image/jpeg")
+        items = await run_with_deadline(
+            lambda: vision_agent.parse_fridge_image_async(image_bytes, "image/jpeg"),
+            SCAN_BUDGET_SECONDS,
+            request.is_disconnected,
+        )
+        items = _scanned_items(items)
+        if commit:
+            results = await _import_items(store, user["uid"], items)
+            return [schemas.PantryImportResult.model_validate(r) for r in results]
         return items
     except ValueError as e:
         raise HTTPException(status_code=500, detail=str(e))
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="The AI took too long to respond. Please try again.")
+    except ClientDisconnected:
+        logger.info("Client disconnected from vision scan for user %s", user["uid"])
+        raise HTTPException(status_code=499, detail="Client closed request")
     except Exception:
         logger.exception("Vision scan failed for user %s", user["uid"])
         raise HTTPException(status_code=500, detail="An unexpected error occurred. Please try again.")
@@ -1,12 +1,11 @@
 import os
 import logging
 import stripe
-from datetime import datetime, timezone
 from fastapi import APIRouter, Depends, HTTPException, Header, Request
 
-from firestore_db import get_firestore
-from dependencies import get_current_user
+from dependencies import get_current_user, get_user_tier, invalidate_user_tier
 import schemas
+from storage import get_storage
 
 logger = logging.getLogger(__name__)
 
@@ -19,23 +18,16 @@ FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173")
 
 
 @router.get("/payments/subscription", response_model=schemas.UserSubscriptionResponse)
-def get_subscription(user=Depends(get_current_user), db=Depends(get_firestore)):
+async def get_subscription(user=Depends(get_current_user), store=Depends(get_storage)):
     uid = user["uid"]
-    doc = db.collection("users").document(uid).collection("subscription").document("data").get()
-    tier = doc.to_dict().get("tier", "free") if doc.exists else "free"
-    return schemas.UserSubscriptionResponse(user_id=uid, tier=tier)
+    return schemas.UserSubscriptionResponse(user_id=uid, tier=await get_user_tier(uid, store))
 
 
 @router.post("/payments/waitlist", status_code=200)
-def join_waitlist(user=Depends(get_current_user), db=Depends(get_firestore)):
+async def join_waitlist(user=Depends(get_current_user), store=Depends(get_storage)):
     """Save user to Pro waitlist (used during coming-soon phase)."""
     uid = user["uid"]
-    email = user.get("email", "")
-    db.collection("waitlist").document(uid).set({
-        "email": email,
-        "uid": uid,
-        "joined_at": datetime.now(timezone.utc),
-    }, merge=True)
+    await store.subscriptions.join_waitlist(uid, user.get("email", ""))
     logger.info("User %s joined Pro waitlist", uid)
     return {"status": "ok"}
 
@@ -65,7 +57,7 @@ def create_checkout(user=Depends(get_current_user)):
 async def stripe_webhook(
     request: Request,
     stripe_signature: str = Header(alias="stripe-signature"),
-    db=Depends(get_firestore),
+    store=Depends(get_storage),
 ):
     payload = await request.body()
     try:
@@ -75,43 +67,26 @@ async def stripe_webhook(
 
     event_id = event.get("id", "")
 
-    # Idempotency: skip if this event was already processed
-    if event_id:
-        event_ref = db.collection("processed_webhook_events").document(event_id)
-        if event_ref.get().exists:
-            logger.info("Duplicate webhook event %s — skipping", event_id)
-            return {"status": "ok"}
-        event_ref.set({"processed_at": datetime.now(timezone.utc), "type": event["type"]})
+    # Idempotency: each event is claimed once
+    if event_id and not await store.subscriptions.claim_webhook_event(event_id, event["type"]):
+        logger.info("Duplicate webhook event %s — skipping", event_id)
+        return {"status": "ok"}
 
     if event["type"] == "checkout.session.completed":
         session_obj = event["data"]["object"]
         uid = session_obj["metadata"].get("user_id")
         sid = session_obj.get("subscription")
         if uid:
-            # Update user subscription
-            db.collection("users").document(uid).collection("subscription").document("data").set({
-                "tier": "pro",
-                "stripe_customer_id": session_obj.get("customer"),
-                "stripe_subscription_id": sid,
-                "updated_at": datetime.now(timezone.utc),
-            }, merge=True)
-            # Write reverse-lookup so cancellation is O(1)
-            if sid:
-                db.collection("stripe_subscriptions").document(sid).set({"uid": uid})
+            await store.subscriptions.activate(uid, session_obj.get("customer"), sid)
+            invalidate_user_tier(uid)
             logger.info("User %s upgraded to Pro (subscription %s)", uid, sid)
 
     elif event["type"] in ("customer.subscription.deleted", "customer.subscription.paused"):
         sid = event["data"]["object"]["id"]
-        # O(1) lookup instead of scanning all users
-        lookup = db.collection("stripe_subscriptions").document(sid).get()
-        if lookup.exists:
-            uid = lookup.to_dict().get("uid")
-            if uid:
-                db.collection("users").document(uid).collection("subscription").document("data").update(
-                    {"tier": "free"}
-                )
-                db.collection("stripe_subscriptions").document(sid).delete()
-                logger.info("User %s downgraded to free (subscription %s cancelled)", uid, sid)
+        uid = await store.subscriptions.cancel(sid)
+        if uid:
+            invalidate_user_tier(uid)
+            logger.info("User %s downgraded to free (subscription %s cancelled)", uid, sid)
         else:
             logger.warning("Cancellation webhook for unknown subscription %s", sid)
 
@@ -1,14 +1,22 @@
+import asyncio
+import json
 import logging
+import os
 from datetime import date, datetime, timezone
-from fastapi import APIRouter, Depends, HTTPException, Request
-from google.cloud.firestore_v1 import transactional, Transaction
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from typing import List, Optional
 
-from firestore_db import get_firestore
 from dependencies import get_current_user, get_user_tier
+import recipe_cache
+import recipe_precompute
 import schemas
 from agents import recipe_agent
+from agents.deadline import ClientDisconnected, DeadlineExceeded, deadline_scope, run_with_deadline
 from limiter import limiter
+from pagination import page_response
+from storage import get_storage
 
 logger = logging.getLogger(__name__)
 
@@ -16,82 +24,181 @@ router = APIRouter(tags=["recipes"])
 
 FREE_DAILY_LIMIT = 3
 
+# End-to-end time budgets for the model work behind each endpoint (seconds)
+SUGGEST_BUDGET_SECONDS = float(os.getenv("RECIPE_SUGGEST_BUDGET_SECONDS", "45"))
+STREAM_BUDGET_SECONDS = float(os.getenv("RECIPE_STREAM_BUDGET_SECONDS", "90"))
 
-@transactional
-def _check_and_increment(transaction: Transaction, usage_ref) -> int:
-    """Atomically read + increment the usage counter. Returns new count."""
-    snapshot = usage_ref.get(transaction=transaction)
-    current = (snapshot.to_dict() or {}).get("recipe_suggest", 0) if snapshot.exists else 0
-    transaction.set(usage_ref, {"recipe_suggest": current + 1}, merge=True)
-    return current + 1
 
-
-@router.post("/agents/recipe/suggest", response_model=List[schemas.RecipeResponse])
-@limiter.limit("10/minute")
-def suggest_recipes_endpoint(
-    request: Request,  # noqa: ARG001 — required by slowapi for rate limiting
-    body: schemas.RecipeRequest,
-    db=Depends(get_firestore),
-    user=Depends(get_current_user),
-):
-    uid = user["uid"]
-
-    if get_user_tier(uid, db) == "free":
+async def _enforce_quota(store, uid: str, tier: str) -> None:
+    """Free-tier quota check, only reached when the suggestions are not cached."""
+    if tier == "free":
         today_str = str(date.today())
-        usage_ref = db.collection("users").document(uid).collection("usage").document(today_str)
-        new_count = _check_and_increment(db.transaction(), usage_ref)
+        new_count = await store.usage.increment(uid, today_str, "recipe_suggest")
         if new_count > FREE_DAILY_LIMIT:
             # Already incremented — decrement back to keep count accurate
-            from google.cloud.firestore_v1 import Increment as FSIncrement
-            usage_ref.update({"recipe_suggest": FSIncrement(-1)})
+            await store.usage.decrement(uid, today_str, "recipe_suggest")
             raise HTTPException(
                 403,
                 f"Free tier: {FREE_DAILY_LIMIT} recipe suggestions per day. Upgrade to Pro for unlimited.",
             )
 
-    docs = db.collection("users").document(uid).collection("pantry").stream()
-    items_list = [
-        {"name": d.get("name"), "quantity": d.get("quantity"), "unit": d.get("unit")}
-        for doc in docs
-        for d in [doc.to_dict()]
-    ]
+
+async def _claim_cached(store, uid: str, tier: str, fingerprint: str, cached: recipe_cache.CachedSuggestions) -> List[dict]:
+    """
+    Recipes for a cache hit. A precomputed entry has not been paid for yet,
+    so its first use counts against the free-tier quota like a fresh
+    generation would; after that it is an ordinary (free) cache entry.
+    """
+    if cached.precomputed:
+        await _enforce_quota(store, uid, tier)
+        recipe_cache.store_suggestions(uid, fingerprint, cached.recipes)
+        recipe_precompute.precomputer.record_served()
+    return cached.recipes
+
+
+async def _load_pantry_and_tier(store, uid: str):
+    """The pantry (for the prompt and fingerprint) and the user's tier, read concurrently."""
+    return await asyncio.gather(
+        store.pantry.prompt_items(uid),
+        get_user_tier(uid, store),
+    )
+
+
+@router.post("/agents/recipe/suggest", response_model=List[schemas.RecipeResponse])
+@limiter.limit("10/minute")
+async def suggest_recipes_endpoint(
+    request: Request,
+    body: schemas.RecipeRequest,
+    store=Depends(get_storage),
+    user=Depends(get_current_user),
+):
+    uid = user["uid"]
+    recipe_precompute.remember_request(uid, body.preferences, body.time_of_day)
+    items_list, tier = await _load_pantry_and_tier(store, uid)
+    fingerprint = recipe_cache.pantry_fingerprint(items_list, body.preferences, body.time_of_day)
+    cached = recipe_cache.get_suggestions(uid, fingerprint)
+    if cached is not None:
+        # Same pantry and request as last time (or precomputed for it): no LLM call
+        return await _claim_cached(store, uid, tier, fingerprint, cached)
+    await _enforce_quota(store, uid, tier)
 
     try:
-        recipes = recipe_agent.suggest_recipes(items_list, body.preferences, body.time_of_day)
+        recipes = await run_with_deadline(
+            lambda: recipe_agent.suggest_recipes_async(items_list, body.preferences, body.time_of_day),
+            SUGGEST_BUDGET_SECONDS,
+            request.is_disconnected,
+        )
+        recipes = [schemas.RecipeResponse.model_validate(r).model_dump() for r in recipes]
+        recipe_cache.store_suggestions(uid, fingerprint, recipes)
         return recipes
     except ValueError as e:
         raise HTTPException(status_code=500, detail=str(e))
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="The AI took too long to respond. Please try again.")
+    except ClientDisconnected:
+        logger.info("Client disconnected from recipe suggestion for user %s", uid)
+        raise HTTPException(status_code=499, detail="Client closed request")
     except Exception as e:
         logger.exception("Recipe suggestion failed for user %s", uid)
         raise HTTPException(status_code=500, detail="An unexpected error occurred. Please try again.")
 
 
-@router.post("/recipes/saved", response_model=schemas.SavedRecipe, status_code=201)
-def save_recipe(body: schemas.RecipeResponse, db=Depends(get_firestore), user=Depends(get_current_user)):
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/agents/recipe/suggest/stream")
+@limiter.limit("10/minute")
+async def suggest_recipes_stream_endpoint(
+    request: Request,
+    body: schemas.RecipeRequest,
+    store=Depends(get_storage),
+    user=Depends(get_current_user),
+):
+    """
+    Server-Sent Events version of /agents/recipe/suggest. Emits one "recipe"
+    event per recipe (validated as RecipeResponse) as soon as the model has
+    finished writing it, then a final "done" event, or "error" on failure.
+    """
     uid = user["uid"]
+    # Quota and pantry errors surface as normal HTTP errors before the stream opens
+    recipe_precompute.remember_request(uid, body.preferences, body.time_of_day)
+    items_list, tier = await _load_pantry_and_tier(store, uid)
+    fingerprint = recipe_cache.pantry_fingerprint(items_list, body.preferences, body.time_of_day)
+    cached = recipe_cache.get_suggestions(uid, fingerprint)
+    if cached is None:
+        await _enforce_quota(store, uid, tier)
+    else:
+        cached_recipes = await _claim_cached(store, uid, tier, fingerprint, cached)
+
+    async def replay_cached():
+        for recipe in cached_recipes:
+            yield _sse("recipe", recipe)
+        yield _sse("done", {"count": len(cached_recipes)})
+
+    async def event_stream():
+        count = 0
+        recipes = []
+        try:
+            with deadline_scope(STREAM_BUDGET_SECONDS):
+                async for raw in recipe_agent.stream_recipes_async(
+                    items_list, body.preferences, body.time_of_day,
+                ):
+                    if await request.is_disconnected():
+                        logger.info("Client disconnected from recipe stream for user %s", uid)
+                        return
+                    try:
+                        recipe = schemas.RecipeResponse.model_validate(raw)
+                    except ValidationError as e:
+                        logger.warning("Skipping invalid streamed recipe for user %s: %s", uid, e)
+                        continue
+                    count += 1
+                    recipes.append(recipe.model_dump())
+                    yield _sse("recipe", recipes[-1])
+        except ValueError as e:
+            yield _sse("error", {"detail": str(e)})
+            return
+        except DeadlineExceeded:
+            yield _sse("error", {"detail": "The AI took too long to respond. Please try again."})
+            return
+        except Exception:
+            logger.exception("Recipe stream failed for user %s", uid)
+            yield _sse("error", {"detail": "An unexpected error occurred. Please try again."})
+            return
+        if count == 0:
+            yield _sse("error", {"detail": "The AI could not generate a valid recipe response. Please try again in a moment."})
+            return
+        recipe_cache.store_suggestions(uid, fingerprint, recipes)
+        yield _sse("done", {"count": count})
+
+    return StreamingResponse(
+        replay_cached() if cached is not None else event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/recipes/saved", response_model=schemas.SavedRecipe, status_code=201)
+async def save_recipe(body: schemas.RecipeResponse, store=Depends(get_storage), user=Depends(get_current_user)):
     data = body.model_dump()
     data["saved_at"] = datetime.now(timezone.utc)
-    _, doc_ref = db.collection("users").document(uid).collection("saved_recipes").add(data)
-    return {**data, "id": doc_ref.id}
+    return await store.saved_recipes.save(user["uid"], data)
 
 
 @router.get("/recipes/saved", response_model=List[schemas.SavedRecipe])
-def get_saved_recipes(db=Depends(get_firestore), user=Depends(get_current_user)):
-    uid = user["uid"]
-    docs = db.collection("users").document(uid).collection("saved_recipes").order_by("saved_at", direction="DESCENDING").stream()
-    result = []
-    for doc in docs:
-        d = doc.to_dict()
-        d["id"] = doc.id
-        result.append(d)
-    return result
+async def get_saved_recipes(
+    response: Response,
+    store=Depends(get_storage),
+    user=Depends(get_current_user),
+    limit: int = Query(200, ge=1, le=200),
+    page_token: Optional[str] = None,
+):
+    """Most recently saved first; pass the X-Next-Page-Token response header back as page_token for more."""
+    return page_response(await store.saved_recipes.list(user["uid"], limit, page_token), response)
 
 
 @router.delete("/recipes/saved/{recipe_id}", status_code=204)
-def unsave_recipe(recipe_id: str, db=Depends(get_firestore), user=Depends(get_current_user)):
-    uid = user["uid"]
-    ref = db.collection("users").document(uid).collection("saved_recipes").document(recipe_id)
-    if not ref.get().exists:
+async def unsave_recipe(recipe_id: str, store=Depends(get_storage), user=Depends(get_current_user)):
+    if not await store.saved_recipes.delete(user["uid"], recipe_id):
         raise HTTPException(404, "Saved recipe not found")
-    ref.delete()
     return None
@@ -2,11 +2,18 @@ import logging
 import os
 import secrets
 from fastapi import APIRouter, Depends, Header, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from firebase_admin import auth as firebase_auth
 from pydantic import BaseModel
 
-from firestore_db import get_firestore
-from dependencies import get_current_user
+from dependencies import get_current_user, invalidate_user_tier
+import account_deletion
+import firestore_db
+import recipe_cache
+import recipe_precompute
+import schemas
+from agents.utils import llm_stats
+from storage import get_storage
 
 logger = logging.getLogger(__name__)
 
@@ -24,65 +31,72 @@ class AdminGrantRequest(BaseModel):
 router = APIRouter(tags=["users"])
 
 
-def _delete_collection(col_ref, batch_size: int = 100):
-    """Iteratively delete all documents in a Firestore collection in batches."""
-    while True:
-        docs = list(col_ref.limit(batch_size).stream())
-        if not docs:
-            break
-        for doc in docs:
-            doc.reference.delete()
-
-
-@router.delete("/users/me", status_code=status.HTTP_204_NO_CONTENT)
-def delete_account(db=Depends(get_firestore), user=Depends(get_current_user)):
+@router.delete("/users/me", response_model=schemas.AccountDeletionStatus, status_code=status.HTTP_202_ACCEPTED)
+async def delete_account(store=Depends(get_storage), user=Depends(get_current_user)):
     """
     Permanently delete the authenticated user's account and all associated data.
-    Complies with GDPR/CCPA right-to-erasure requirements.
+    Complies with GDPR/CCPA right-to-erasure requirements. The deletion runs
+    in the background; poll GET /users/me/deletion for its progress.
     """
     uid = user["uid"]
-
-    # Delete Firebase Auth account FIRST — if this fails, Firestore data is still intact
-    # and the user can retry. Orphaned Firestore data is recoverable; orphaned Auth is not.
-    firebase_auth.delete_user(uid)
-
-    # Now delete Firestore data
-    user_ref = db.collection("users").document(uid)
-    for subcol in ("pantry", "nutrition_logs", "subscription", "usage"):
-        _delete_collection(user_ref.collection(subcol))
-    user_ref.delete()
-
-    logger.info("Account deleted for user %s", uid)
-    return None
+    job = await store.deletion_jobs.get(uid)
+    if job is None:
+        job = account_deletion.new_job(uid)
+        await store.deletion_jobs.save(job)
+    elif job["status"] == "done":
+        return job
+    # A new job, or a retry of a failed or stalled one from where it stopped
+    account_deletion.deleter.start(store, job)
+    invalidate_user_tier(uid)
+    logger.info("Account deletion started for user %s", uid)
+    return job
+
+
+@router.get("/users/me/deletion", response_model=schemas.AccountDeletionStatus)
+async def get_account_deletion(store=Depends(get_storage), user=Depends(get_current_user)):
+    job = await store.deletion_jobs.get(user["uid"])
+    if job is None:
+        raise HTTPException(status_code=404, detail="No account deletion requested")
+    return job
 
 
 @router.post("/admin/grant-pro", status_code=status.HTTP_200_OK, dependencies=[Depends(_verify_admin)])
-def admin_grant_pro(body: AdminGrantRequest, db=Depends(get_firestore)):
+async def admin_grant_pro(body: AdminGrantRequest, store=Depends(get_storage)):
     """Manually grant Pro tier to a user by email (admin only)."""
     try:
-        firebase_user = firebase_auth.get_user_by_email(body.email)
+        firebase_user = await run_in_threadpool(firebase_auth.get_user_by_email, body.email)
     except firebase_auth.UserNotFoundError:
         raise HTTPException(status_code=404, detail=f"No Firebase user found for {body.email}")
 
     uid = firebase_user.uid
-    db.collection("users").document(uid).collection("subscription").document("data").set(
-        {"tier": "pro", "granted_manually": True}, merge=True
-    )
+    await store.subscriptions.set_tier(uid, "pro", granted_manually=True)
+    invalidate_user_tier(uid)
     logger.info("Admin manually granted Pro to %s (uid=%s)", body.email, uid)
     return {"message": f"Pro granted to {body.email}", "uid": uid}
 
 
 @router.post("/admin/revoke-pro", status_code=status.HTTP_200_OK, dependencies=[Depends(_verify_admin)])
-def admin_revoke_pro(body: AdminGrantRequest, db=Depends(get_firestore)):
+async def admin_revoke_pro(body: AdminGrantRequest, store=Depends(get_storage)):
     """Revoke Pro tier from a user by email (admin only)."""
     try:
-        firebase_user = firebase_auth.get_user_by_email(body.email)
+        firebase_user = await run_in_threadpool(firebase_auth.get_user_by_email, body.email)
     except firebase_auth.UserNotFoundError:
         raise HTTPException(status_code=404, detail=f"No Firebase user found for {body.email}")
 
     uid = firebase_user.uid
-    db.collection("users").document(uid).collection("subscription").document("data").set(
-        {"tier": "free", "granted_manually": False}, merge=True
-    )
+    await store.subscriptions.set_tier(uid, "free", granted_manually=False)
+    invalidate_user_tier(uid)
     logger.info("Admin revoked Pro from %s (uid=%s)", body.email, uid)
     return {"message": f"Pro revoked from {body.email}", "uid": uid}
+
+
+@router.get("/admin/ai-stats", dependencies=[Depends(_verify_admin)])
+def admin_ai_stats():
+    """Response caches, coalescing, hedging, recipe precompute, account deletions, per-model circuit state and Firestore round trips per route (admin only)."""
+    return {
+        **llm_stats(),
+        "account_deletion": account_deletion.deleter.stats(),
+        "firestore": firestore_db.rpc_stats(),
+        "recipe_suggestions": recipe_cache.suggestion_cache.stats(),
+        "recipe_precompute": recipe_precompute.precomputer.stats(),
+    }
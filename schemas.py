@@ -1,7 +1,7 @@
 import re
 from pydantic import BaseModel, Field, field_validator
 from datetime import date as Date_, datetime
-from typing import Optional, List
+from typing import Dict, Optional, List
 
 
 class PantryItemBase(BaseModel):
@@ -27,6 +27,13 @@ class PantryItem(PantryItemBase):
     date_added: datetime
 
 
+class PantryImportResult(PantryItemBase):
+    """One item of a bulk import: "created", "merged" into an existing item, or "failed"."""
+    status: str
+    id: Optional[str] = None
+    detail: Optional[str] = None
+
+
 class NutritionLogBase(BaseModel):
     meal_name: str
     calories: float
@@ -50,6 +57,15 @@ class NutritionLog(NutritionLogBase):
     date: Date_  # Override to require a date type on read
 
 
+class DailyNutrition(BaseModel):
+    date: Date_
+    calories: float
+    protein: float
+    carbs: float
+    fat: float
+    meals: int
+
+
 class RecipeRequest(BaseModel):
     preferences: str = Field("", max_length=500)
     time_of_day: str = Field("", max_length=100)
@@ -132,12 +148,15 @@ class ChatHistoryMessage(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     history: List[ChatHistoryMessage] = []
+    # Combined mode: estimate macros in the same generation and log the meal server-side
+    log_meals: bool = False
 
 
 class ChatResponse(BaseModel):
     intent: str
     response: str
     extracted_data: str = ""
+    nutrition_log: Optional[NutritionLog] = None
 
 
 class SavedRecipe(RecipeResponse):
@@ -152,3 +171,14 @@ class UserSubscriptionResponse(BaseModel):
 
 class StripeCheckoutResponse(BaseModel):
     checkout_url: str
+
+
+class AccountDeletionStatus(BaseModel):
+    """Progress of the background job behind DELETE /users/me."""
+    uid: str
+    status: str  # pending, running, done or failed
+    auth_deleted: bool
+    collections: Dict[str, int]  # records deleted per finished collection
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
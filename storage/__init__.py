@@ -0,0 +1,58 @@
+"""
+Storage backends behind one repository interface (storage.base). Routers
+take the request's Storage from get_storage:
+
+    STORAGE_BACKEND=firestore  (default) Firestore, on the shared AsyncClient
+    STORAGE_BACKEND=sqlite     a local SQLite file (SQLITE_PATH), for
+                               self-hosted and single-node deployments
+
+Sign-in still goes through Firebase Auth with either backend.
+"""
+import os
+import threading
+
+from fastapi import Depends
+
+from firestore_db import get_async_firestore
+from storage.base import Storage
+from storage.firestore_store import FirestoreStorage
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "grocery.db")
+
+_sqlite = None
+_sqlite_lock = threading.Lock()
+
+
+def sqlite_storage() -> Storage:
+    global _sqlite
+    with _sqlite_lock:
+        if _sqlite is None:
+            from storage.sqlite_store import SQLiteStorage
+            _sqlite = SQLiteStorage(SQLITE_PATH)
+    return _sqlite
+
+
+if STORAGE_BACKEND == "sqlite":
+    def get_storage() -> Storage:
+        return sqlite_storage()
+else:
+    def get_storage(db=Depends(get_async_firestore)) -> Storage:
+        return FirestoreStorage(db)
+
+
+def app_storage() -> Storage:
+    """get_storage outside a request, for work on the event loop (startup, background tasks)."""
+    if STORAGE_BACKEND == "sqlite":
+        return sqlite_storage()
+    return FirestoreStorage(get_async_firestore())
+
+
+def background_storage() -> Storage:
+    """
+    Storage for work outside a request (recipe_precompute's threads). There
+    is no event loop there, so only the *_blocking methods may be called.
+    """
+    if STORAGE_BACKEND == "sqlite":
+        return sqlite_storage()
+    return FirestoreStorage(None)
@@ -0,0 +1,217 @@
+"""
+The repository interface the routers use instead of talking to Firestore
+directly. Every backend stores the same records:
+
+- pantry items: name, quantity, unit, expiry_date (YYYY-MM-DD), date_added
+- nutrition logs: meal_name, calories, protein, carbs, fat, date (YYYY-MM-DD)
+- saved recipes: a RecipeResponse plus saved_at
+- usage counters: per user, per day, per action
+- subscriptions: tier plus the Stripe ids, and processed webhook events
+- account deletion jobs (account_deletion)
+
+Ids are strings whatever the backend generates. List methods return a
+pagination.Page whose next_page_token the routers hand back unchanged.
+"""
+from abc import ABC, abstractmethod
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from pagination import Page
+
+# Fields the recipe prompt (and so the suggestion fingerprint) is built from
+PROMPT_FIELDS = ("name", "quantity", "unit")
+# Per-day totals kept for /nutrition/daily
+DAILY_FIELDS = ("calories", "protein", "carbs", "fat")
+
+
+def pantry_key(name, unit) -> Tuple[str, str]:
+    """What makes two pantry items the same item: name and unit, ignoring case and spacing."""
+    return (" ".join(str(name or "").split()).lower(), " ".join(str(unit or "").split()).lower())
+
+
+class ImportGroup(NamedTuple):
+    key: Tuple[str, str]
+    # The first item's fields with every quantity added up and the earliest expiry
+    data: dict
+    # Positions in the imported list
+    indexes: List[int]
+
+
+def group_import(items: List[dict]) -> List[ImportGroup]:
+    """Collapses the items of one import that share a pantry_key, keeping first-seen order."""
+    groups: Dict[Tuple[str, str], ImportGroup] = {}
+    for i, item in enumerate(items):
+        key = pantry_key(item.get("name"), item.get("unit"))
+        group = groups.get(key)
+        if group is None:
+            groups[key] = ImportGroup(key, dict(item), [i])
+            continue
+        group.data["quantity"] = float(group.data.get("quantity") or 0) + float(item.get("quantity") or 0)
+        expiry = item.get("expiry_date")
+        if expiry is not None and (group.data.get("expiry_date") is None or expiry < group.data["expiry_date"]):
+            group.data["expiry_date"] = expiry
+        group.indexes.append(i)
+    return list(groups.values())
+
+
+def import_results(items: List[dict], groups: List[ImportGroup], outcomes: List[dict]) -> List[dict]:
+    """
+    One result per imported item from one outcome per group ({"id", "status"}
+    and, on failure, "detail"). Later items of a newly created group are
+    reported as merged into the first.
+    """
+    results: List[Optional[dict]] = [None] * len(items)
+    for group, outcome in zip(groups, outcomes):
+        for n, i in enumerate(group.indexes):
+            status = "merged" if n and outcome["status"] == "created" else outcome["status"]
+            results[i] = {**items[i], **outcome, "status": status}
+    return results
+
+
+class PantryRepository(ABC):
+    @abstractmethod
+    async def list(self, uid: str, limit: int, page_token: Optional[str]) -> Page:
+        """Ordered by item id."""
+
+    @abstractmethod
+    async def prompt_items(self, uid: str) -> List[dict]:
+        """Every item, reduced to PROMPT_FIELDS."""
+
+    @abstractmethod
+    def prompt_items_blocking(self, uid: str) -> List[dict]:
+        """prompt_items for background threads (recipe_precompute)."""
+
+    @abstractmethod
+    async def create(self, uid: str, data: dict) -> dict:
+        """Stores data as a new item and returns it with its id."""
+
+    @abstractmethod
+    async def import_items(self, uid: str, items: List[dict]) -> List[dict]:
+        """
+        Adds many items at once. An item with the same pantry_key as one
+        already in the pantry (or earlier in items) is merged into it by
+        adding its quantity. Returns import_results: each item with its id
+        and a status of "created", "merged" or "failed".
+        """
+
+    @abstractmethod
+    async def update(self, uid: str, item_id: str, changes: dict) -> Optional[dict]:
+        """Applies changes and returns the whole item, or None if there is no such item."""
+
+    @abstractmethod
+    async def delete(self, uid: str, item_id: str) -> bool:
+        """False if there was no such item."""
+
+
+class NutritionRepository(ABC):
+    @abstractmethod
+    async def list(
+        self, uid: str, limit: int, page_token: Optional[str],
+        from_: Optional[str] = None, to: Optional[str] = None,
+    ) -> Page:
+        """Newest first, optionally limited to dates from_..to inclusive."""
+
+    @abstractmethod
+    async def get(self, uid: str, log_id: str) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    async def add(self, uid: str, data: dict) -> dict:
+        """Stores a log and returns it with its id; its day's totals include it from then on."""
+
+    @abstractmethod
+    async def delete(self, uid: str, log_id: str) -> bool:
+        """False if there was no such log (or a racing delete removed it first)."""
+
+    @abstractmethod
+    async def daily_totals(self, uid: str, from_: str, to: str) -> Dict[str, dict]:
+        """DAILY_FIELDS plus "meals" for each date from_..to that has logs, keyed by date."""
+
+
+class SavedRecipeRepository(ABC):
+    @abstractmethod
+    async def list(self, uid: str, limit: int, page_token: Optional[str]) -> Page:
+        """Most recently saved first."""
+
+    @abstractmethod
+    async def save(self, uid: str, data: dict) -> dict:
+        pass
+
+    @abstractmethod
+    async def delete(self, uid: str, recipe_id: str) -> bool:
+        pass
+
+
+class UsageRepository(ABC):
+    @abstractmethod
+    async def increment(self, uid: str, day: str, action: str) -> int:
+        """Atomically adds one to the counter and returns the new count."""
+
+    @abstractmethod
+    async def decrement(self, uid: str, day: str, action: str) -> None:
+        pass
+
+
+class SubscriptionRepository(ABC):
+    @abstractmethod
+    async def get_tier(self, uid: str) -> str:
+        """"free" for users without a subscription record."""
+
+    @abstractmethod
+    async def set_tier(self, uid: str, tier: str, granted_manually: bool) -> None:
+        """Admin grant or revoke; Stripe ids are left as they are."""
+
+    @abstractmethod
+    async def claim_webhook_event(self, event_id: str, event_type: str) -> bool:
+        """Records a Stripe event as processed; False if it already was."""
+
+    @abstractmethod
+    async def activate(self, uid: str, customer_id: Optional[str], subscription_id: Optional[str]) -> None:
+        """Upgrades uid to pro and remembers which Stripe subscription pays for it."""
+
+    @abstractmethod
+    async def cancel(self, subscription_id: str) -> Optional[str]:
+        """Downgrades the subscription's user to free; returns their uid, or None if unknown."""
+
+    @abstractmethod
+    async def join_waitlist(self, uid: str, email: str) -> None:
+        pass
+
+
+class DeletionJobRepository(ABC):
+    """Account deletion jobs, one per uid, stored as the dicts account_deletion builds."""
+
+    @abstractmethod
+    async def get(self, uid: str) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    async def save(self, job: dict) -> None:
+        """Replaces the job stored for job["uid"]."""
+
+    @abstractmethod
+    async def unfinished(self) -> List[dict]:
+        """Jobs still "pending" or "running", e.g. after a crash."""
+
+
+class Storage(ABC):
+    pantry: PantryRepository
+    nutrition: NutritionRepository
+    saved_recipes: SavedRecipeRepository
+    usage: UsageRepository
+    subscriptions: SubscriptionRepository
+    deletion_jobs: DeletionJobRepository
+
+    @abstractmethod
+    async def user_collections(self, uid: str) -> List[str]:
+        """Every collection (or table) that can hold records of uid's."""
+
+    @abstractmethod
+    async def delete_user_collection(self, uid: str, name: str) -> int:
+        """
+        Deletes uid's records in one of user_collections and returns how
+        many there were. Safe to repeat after an interruption.
+        """
+
+    @abstractmethod
+    async def delete_user_record(self, uid: str) -> None:
+        """Removes what is left once the collections are empty (the user's own record)."""
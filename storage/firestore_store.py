@@ -0,0 +1,457 @@
+"""
+Firestore implementation of the storage repositories, on the AsyncClient the
+request handlers share (firestore_db.get_async_firestore). Everything lives
+under users/{uid}:
+
+    pantry/{id}, nutrition_logs/{id}, nutrition_daily/{date},
+    saved_recipes/{id}, usage/{date}, subscription/data
+
+plus the top-level processed_webhook_events, stripe_subscriptions,
+waitlist and account_deletions collections.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
+
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from google.cloud.firestore_v1 import Increment
+from google.cloud.firestore_v1.async_transaction import AsyncTransaction, async_transactional
+
+from firestore_db import doc_to_dict, get_firestore, stream_dicts, stream_dicts_async
+from pagination import Page, paginate
+from storage.base import (
+    DAILY_FIELDS,
+    PROMPT_FIELDS,
+    NutritionRepository,
+    PantryRepository,
+    SavedRecipeRepository,
+    DeletionJobRepository,
+    Storage,
+    SubscriptionRepository,
+    UsageRepository,
+    group_import,
+    import_results,
+    pantry_key,
+)
+
+logger = logging.getLogger(__name__)
+
+# Most writes Firestore accepts in one batch commit
+WRITE_BATCH_LIMIT = 500
+# Delete batches of one collection committed at once while the next page is read
+DELETE_COMMITS_IN_FLIGHT = 4
+# Set on each nutrition log once its day's rollup counts it
+ROLLED_UP_FIELD = "rolled_up"
+# Set on users/{uid} once every log from before the rollups has been counted
+ROLLUPS_BACKFILLED_FIELD = "nutrition_rollups_backfilled"
+
+def _user(db, uid: str):
+    return db.collection("users").document(uid)
+
+
+async def _delete_if_exists(db, ref) -> bool:
+    """One conditional commit instead of a read followed by a delete."""
+    try:
+        await ref.delete(option=db.write_option(exists=True))
+    except NotFound:
+        return False
+    return True
+
+
+async def _page(query, order_by, limit: int, page_token: Optional[str]) -> Page:
+    docs, next_token = await paginate(query, order_by, limit, page_token)
+    return Page([doc_to_dict(doc) for doc in docs], next_token)
+
+
+class FirestorePantry(PantryRepository):
+    def __init__(self, db, sync_client: Callable):
+        self.db = db
+        self.sync_client = sync_client
+
+    def _items(self, uid: str):
+        return _user(self.db, uid).collection("pantry")
+
+    async def list(self, uid, limit, page_token):
+        # Ordered by document id alone: every item has one, unlike date_added
+        return await _page(self._items(uid), [], limit, page_token)
+
+    async def prompt_items(self, uid):
+        # Projected server-side: dates and anything else stay in Firestore
+        items = await stream_dicts_async(self._items(uid), fields=PROMPT_FIELDS)
+        return [{k: item.get(k) for k in PROMPT_FIELDS} for item in items]
+
+    def prompt_items_blocking(self, uid):
+        query = _user(self.sync_client(), uid).collection("pantry")
+        items = stream_dicts(query, fields=PROMPT_FIELDS)
+        return [{k: item.get(k) for k in PROMPT_FIELDS} for item in items]
+
+    async def create(self, uid, data):
+        _, doc_ref = await self._items(uid).add(data)
+        return {**data, "id": doc_ref.id}
+
+    async def import_items(self, uid, items):
+        """
+        Reads only the names and units of the existing pantry, then commits
+        one write per distinct item in WriteBatches of up to
+        WRITE_BATCH_LIMIT, concurrently. Merges are Increment transforms, so
+        a quantity changed since the read is added to rather than
+        overwritten. A batch that fails marks only its own items failed.
+        """
+        col = self._items(uid)
+        groups = group_import(items)
+        existing = {}
+        for item in await stream_dicts_async(col, fields=["name", "unit"], include_id=True):
+            existing.setdefault(pantry_key(item.get("name"), item.get("unit")), item["id"])
+
+        writes = []
+        for group in groups:
+            item_id = existing.get(group.key)
+            if item_id is None:
+                writes.append((col.document(), "created", group.data))
+            else:
+                writes.append((col.document(item_id), "merged", {"quantity": Increment(float(group.data["quantity"]))}))
+
+        async def commit(chunk):
+            batch = self.db.batch()
+            for ref, status, data in chunk:
+                if status == "created":
+                    batch.set(ref, data)
+                else:
+                    batch.update(ref, data)
+            await batch.commit()
+
+        chunks = [writes[i:i + WRITE_BATCH_LIMIT] for i in range(0, len(writes), WRITE_BATCH_LIMIT)]
+        errors = await asyncio.gather(*(commit(chunk) for chunk in chunks), return_exceptions=True)
+        outcomes = []
+        for chunk, error in zip(chunks, errors):
+            if error is not None:
+                logger.warning("Pantry import batch of %d writes failed for user %s: %s", len(chunk), uid, error)
+            for ref, status, _ in chunk:
+                if error is None:
+                    outcomes.append({"id": ref.id, "status": status})
+                else:
+                    outcomes.append({"id": None, "status": "failed", "detail": type(error).__name__})
+        return import_results(items, groups, outcomes)
+
+    async def update(self, uid, item_id, changes):
+        ref = self._items(uid).document(item_id)
+        if changes:
+            try:
+                await ref.update(changes)  # update() requires the document to exist
+            except NotFound:
+                return None
+        # The caller wants fields the update did not send (date_added, ...),
+        # so one read remains; it reflects the committed update.
+        doc = await ref.get()
+        return doc_to_dict(doc) if doc.exists else None
+
+    async def delete(self, uid, item_id):
+        return await _delete_if_exists(self.db, self._items(uid).document(item_id))
+
+
+def _rollup_delta(data: dict, sign: int) -> dict:
+    """Merge-set payload adding (sign=1) or removing (sign=-1) one log from its day's rollup."""
+    delta = {k: Increment(sign * float(data.get(k) or 0)) for k in DAILY_FIELDS}
+    delta["meals"] = Increment(sign)
+    delta["date"] = str(data["date"])
+    return delta
+
+
+def _rollup_totals(logs: List[dict]) -> dict:
+    """Merge-set payloads adding logs to their days' rollups, keyed by date."""
+    totals = {}
+    for data in logs:
+        day = str(data["date"])
+        total = totals.setdefault(day, {**dict.fromkeys(DAILY_FIELDS, 0.0), "meals": 0})
+        for k in DAILY_FIELDS:
+            total[k] += float(data.get(k) or 0)
+        total["meals"] += 1
+    return {day: {**{k: Increment(v) for k, v in total.items()}, "date": day} for day, total in totals.items()}
+
+
+class FirestoreNutrition(NutritionRepository):
+    """
+    Keeps a per-day rollup (nutrition_daily/{date}) next to the logs. Logs
+    written before the rollups existed carry no ROLLED_UP_FIELD; the first
+    daily_totals for a user counts them in (_backfill), and until then
+    deleting one leaves the rollups alone.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    async def list(self, uid, limit, page_token, from_=None, to=None):
+        query = _user(self.db, uid).collection("nutrition_logs")
+        if from_ is not None:
+            query = query.where("date", ">=", from_)
+        if to is not None:
+            query = query.where("date", "<=", to)
+        return await _page(query, [("date", "DESCENDING")], limit, page_token)
+
+    async def get(self, uid, log_id):
+        doc = await _user(self.db, uid).collection("nutrition_logs").document(log_id).get()
+        return doc_to_dict(doc) if doc.exists else None
+
+    async def add(self, uid, data):
+        # The log and its day's rollup are committed in one batch, so the
+        # totals never disagree with the logs
+        user_ref = _user(self.db, uid)
+        doc_ref = user_ref.collection("nutrition_logs").document()
+        batch = self.db.batch()
+        batch.set(doc_ref, {**data, ROLLED_UP_FIELD: True})
+        batch.set(user_ref.collection("nutrition_daily").document(str(data["date"])), _rollup_delta(data, 1), merge=True)
+        await batch.commit()
+        return {**data, "id": doc_ref.id}
+
+    async def delete(self, uid, log_id):
+        """
+        Deletes the log and subtracts it from its day's rollup in one batch.
+        The delete is conditional on the log being unchanged since it was
+        read, so two racing deletes cannot both subtract it: two round trips
+        instead of a transaction's three. A log changed in between (e.g.
+        marked by _backfill) is re-read and the delete retried once; only a
+        log that is gone by then is reported missing.
+        """
+        user_ref = _user(self.db, uid)
+        log_ref = user_ref.collection("nutrition_logs").document(log_id)
+        for attempt in range(2):
+            snapshot = await log_ref.get(field_paths=["date", *DAILY_FIELDS, ROLLED_UP_FIELD])
+            if not snapshot.exists:
+                return False
+            data = snapshot.to_dict()
+            batch = self.db.batch()
+            batch.delete(log_ref, option=self.db.write_option(last_update_time=snapshot.update_time))
+            if data.get(ROLLED_UP_FIELD):
+                batch.set(user_ref.collection("nutrition_daily").document(str(data["date"])),
+                          _rollup_delta(data, -1), merge=True)
+            try:
+                await batch.commit()
+                return True
+            except NotFound:
+                return False
+            except FailedPrecondition:
+                if attempt:
+                    raise
+                logger.info("Nutrition log %s changed while being deleted; retrying", log_id)
+
+    async def daily_totals(self, uid, from_, to):
+        user_ref = _user(self.db, uid)
+        query = user_ref.collection("nutrition_daily").where("date", ">=", from_).where("date", "<=", to)
+        user, rollups = await asyncio.gather(
+            user_ref.get(field_paths=[ROLLUPS_BACKFILLED_FIELD]), stream_dicts_async(query),
+        )
+        if not (user.exists and user.to_dict().get(ROLLUPS_BACKFILLED_FIELD)) and await self._backfill(uid):
+            rollups = await stream_dicts_async(query)
+        return {d.get("date"): d for d in rollups}
+
+    async def _backfill(self, uid) -> bool:
+        """
+        Counts the user's unmarked logs into their days' rollups and marks
+        them, one batch per chunk. A log is only marked if unchanged since it
+        was read, so one deleted meanwhile fails its chunk rather than being
+        counted; the next call picks up what is left. True if anything was
+        counted.
+        """
+        user_ref = _user(self.db, uid)
+        query = user_ref.collection("nutrition_logs").select(["date", *DAILY_FIELDS, ROLLED_UP_FIELD])
+        unmarked = [doc async for doc in query.stream() if not doc.to_dict().get(ROLLED_UP_FIELD)]
+        # Each log's mark plus at most one rollup per log
+        chunk = WRITE_BATCH_LIMIT // 2
+        for start in range(0, len(unmarked), chunk):
+            docs = unmarked[start:start + chunk]
+            batch = self.db.batch()
+            for doc in docs:
+                batch.update(doc.reference, {ROLLED_UP_FIELD: True},
+                             option=self.db.write_option(last_update_time=doc.update_time))
+            for day, totals in _rollup_totals([doc.to_dict() for doc in docs]).items():
+                batch.set(user_ref.collection("nutrition_daily").document(day), totals, merge=True)
+            try:
+                await batch.commit()
+            except (FailedPrecondition, NotFound):
+                logger.info("Nutrition rollup backfill for user %s raced a write; will resume", uid)
+                return start > 0
+        await user_ref.set({ROLLUPS_BACKFILLED_FIELD: True}, merge=True)
+        if unmarked:
+            logger.info("Counted %d older nutrition logs into rollups for user %s", len(unmarked), uid)
+        return bool(unmarked)
+
+
+class FirestoreSavedRecipes(SavedRecipeRepository):
+    def __init__(self, db):
+        self.db = db
+
+    def _recipes(self, uid: str):
+        return _user(self.db, uid).collection("saved_recipes")
+
+    async def list(self, uid, limit, page_token):
+        return await _page(self._recipes(uid), [("saved_at", "DESCENDING")], limit, page_token)
+
+    async def save(self, uid, data):
+        _, doc_ref = await self._recipes(uid).add(data)
+        return {**data, "id": doc_ref.id}
+
+    async def delete(self, uid, recipe_id):
+        return await _delete_if_exists(self.db, self._recipes(uid).document(recipe_id))
+
+
+@async_transactional
+async def _increment(transaction: AsyncTransaction, usage_ref, action: str) -> int:
+    """Atomically read + increment the usage counter. Returns new count."""
+    snapshot = await usage_ref.get(transaction=transaction)
+    current = (snapshot.to_dict() or {}).get(action, 0) if snapshot.exists else 0
+    transaction.set(usage_ref, {action: current + 1}, merge=True)
+    return current + 1
+
+
+class FirestoreUsage(UsageRepository):
+    def __init__(self, db):
+        self.db = db
+
+    def _day(self, uid: str, day: str):
+        return _user(self.db, uid).collection("usage").document(day)
+
+    async def increment(self, uid, day, action):
+        return await _increment(self.db.transaction(), self._day(uid, day), action)
+
+    async def decrement(self, uid, day, action):
+        await self._day(uid, day).update({action: Increment(-1)})
+
+
+class FirestoreSubscriptions(SubscriptionRepository):
+    def __init__(self, db):
+        self.db = db
+
+    def _subscription(self, uid: str):
+        return _user(self.db, uid).collection("subscription").document("data")
+
+    async def get_tier(self, uid):
+        doc = await self._subscription(uid).get(field_paths=["tier"])
+        return doc.to_dict().get("tier", "free") if doc.exists else "free"
+
+    async def set_tier(self, uid, tier, granted_manually):
+        await self._subscription(uid).set({"tier": tier, "granted_manually": granted_manually}, merge=True)
+
+    async def claim_webhook_event(self, event_id, event_type):
+        # create() fails if this event was already processed: one round trip either way
+        try:
+            await self.db.collection("processed_webhook_events").document(event_id).create(
+                {"processed_at": datetime.now(timezone.utc), "type": event_type}
+            )
+        except AlreadyExists:
+            return False
+        return True
+
+    async def activate(self, uid, customer_id, subscription_id):
+        batch = self.db.batch()
+        batch.set(self._subscription(uid), {
+            "tier": "pro",
+            "stripe_customer_id": customer_id,
+            "stripe_subscription_id": subscription_id,
+            "updated_at": datetime.now(timezone.utc),
+        }, merge=True)
+        # Write reverse-lookup so cancellation is O(1)
+        if subscription_id:
+            batch.set(self.db.collection("stripe_subscriptions").document(subscription_id), {"uid": uid})
+        await batch.commit()
+
+    async def cancel(self, subscription_id):
+        lookup_ref = self.db.collection("stripe_subscriptions").document(subscription_id)
+        lookup = await lookup_ref.get(field_paths=["uid"])
+        uid = lookup.to_dict().get("uid") if lookup.exists else None
+        if not uid:
+            return None
+        batch = self.db.batch()
+        batch.update(self._subscription(uid), {"tier": "free"})
+        batch.delete(lookup_ref)
+        await batch.commit()
+        return uid
+
+    async def join_waitlist(self, uid, email):
+        await self.db.collection("waitlist").document(uid).set({
+            "email": email,
+            "uid": uid,
+            "joined_at": datetime.now(timezone.utc),
+        }, merge=True)
+
+
+class FirestoreDeletionJobs(DeletionJobRepository):
+    def __init__(self, db):
+        self.db = db
+
+    async def get(self, uid):
+        doc = await self.db.collection("account_deletions").document(uid).get()
+        return doc.to_dict() if doc.exists else None
+
+    async def save(self, job):
+        await self.db.collection("account_deletions").document(job["uid"]).set(job)
+
+    async def unfinished(self):
+        query = self.db.collection("account_deletions").where("status", "in", ["pending", "running"])
+        return await stream_dicts_async(query)
+
+
+async def _delete_collection(db, col_ref) -> int:
+    """
+    Deletes every document in col_ref, WRITE_BATCH_LIMIT per batch. Pages
+    are read by cursor rather than re-querying from the start, so the next
+    page is fetched while up to DELETE_COMMITS_IN_FLIGHT batches commit.
+    """
+    query = col_ref.select([]).order_by("__name__").limit(WRITE_BATCH_LIMIT)
+    deleted = 0
+    in_flight = set()
+    last = None
+    while True:
+        # Only the references are needed, so fetch no fields
+        page = query.start_after(last) if last is not None else query
+        docs = [doc async for doc in page.stream()]
+        if not docs:
+            break
+        batch = db.batch()
+        for doc in docs:
+            batch.delete(doc.reference)
+        in_flight.add(asyncio.ensure_future(batch.commit()))
+        if len(in_flight) >= DELETE_COMMITS_IN_FLIGHT:
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for commit in done:
+                commit.result()  # re-raise a failed batch
+        deleted += len(docs)
+        if len(docs) < WRITE_BATCH_LIMIT:
+            break
+        last = docs[-1]
+    await asyncio.gather(*in_flight)
+    return deleted
+
+
+class FirestoreStorage(Storage):
+    """
+    db is the AsyncClient; sync_client returns the sync client used by
+    prompt_items_blocking.
+    """
+
+    def __init__(self, db, sync_client: Callable = get_firestore):
+        self.db = db
+        self.pantry = FirestorePantry(db, sync_client)
+        self.nutrition = FirestoreNutrition(db)
+        self.saved_recipes = FirestoreSavedRecipes(db)
+        self.usage = FirestoreUsage(db)
+        self.subscriptions = FirestoreSubscriptions(db)
+        self.deletion_jobs = FirestoreDeletionJobs(db)
+
+    async def user_collections(self, uid: str) -> List[str]:
+        # Listed rather than hard-coded, so a subcollection added later is not missed
+        return [col.id async for col in _user(self.db, uid).collections()]
+
+    async def delete_user_collection(self, uid: str, name: str) -> int:
+        return await _delete_collection(self.db, _user(self.db, uid).collection(name))
+
+    async def delete_user_record(self, uid: str) -> None:
+        # Reverse lookups of every Stripe subscription the user ever had,
+        # not just the one subscription/data last named
+        lookups = self.db.collection("stripe_subscriptions").where("uid", "==", uid).select([])
+        batch = self.db.batch()
+        async for doc in lookups.stream():
+            batch.delete(doc.reference)
+        batch.delete(_user(self.db, uid))
+        batch.delete(self.db.collection("waitlist").document(uid))
+        await batch.commit()
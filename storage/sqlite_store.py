@@ -0,0 +1,529 @@
+"""
+SQLite implementation of the storage repositories for self-hosted and
+single-node deployments, reusing grocery.db's pantry, nutrition_log,
+usage_tracking and user_subscriptions tables (created if missing) plus
+saved_recipes, processed_webhook_events, waitlist and account_deletions.
+
+Each thread keeps its own connection in WAL mode, so readers never wait for
+the writer and nothing is shared between threads. Statements use ?
+placeholders and are compiled once per connection (cached_statements).
+Reads are local and take tens of microseconds, so they run on the event
+loop; writes can wait on another process's lock (busy_timeout) and run in
+the threadpool.
+"""
+import json
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from typing import Any, Iterator, List, Optional
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from pagination import Page, encode_page_token, page_cursor
+from storage.base import (
+    DAILY_FIELDS,
+    PROMPT_FIELDS,
+    NutritionRepository,
+    PantryRepository,
+    SavedRecipeRepository,
+    DeletionJobRepository,
+    Storage,
+    SubscriptionRepository,
+    UsageRepository,
+    group_import,
+    import_results,
+    pantry_key,
+)
+
+logger = logging.getLogger(__name__)
+
+# grocery.db's tables as shipped, then what the Firestore data model added
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pantry (
+    id INTEGER NOT NULL,
+    user_id VARCHAR,
+    name VARCHAR,
+    quantity FLOAT,
+    unit VARCHAR,
+    expiry_date DATE,
+    date_added DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id)
+);
+CREATE INDEX IF NOT EXISTS ix_pantry_user_id ON pantry (user_id);
+
+CREATE TABLE IF NOT EXISTS nutrition_log (
+    id INTEGER NOT NULL,
+    user_id VARCHAR,
+    date DATE DEFAULT CURRENT_DATE,
+    meal_name VARCHAR,
+    calories FLOAT,
+    protein FLOAT,
+    carbs FLOAT,
+    fat FLOAT,
+    PRIMARY KEY (id)
+);
+CREATE INDEX IF NOT EXISTS ix_nutrition_log_user_date ON nutrition_log (user_id, date);
+
+CREATE TABLE IF NOT EXISTS user_subscriptions (
+    id INTEGER NOT NULL,
+    user_id VARCHAR NOT NULL,
+    tier VARCHAR NOT NULL,
+    stripe_customer_id VARCHAR,
+    stripe_subscription_id VARCHAR,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_user_subscriptions_user_id ON user_subscriptions (user_id);
+CREATE INDEX IF NOT EXISTS ix_user_subscriptions_stripe_id ON user_subscriptions (stripe_subscription_id);
+
+CREATE TABLE IF NOT EXISTS usage_tracking (
+    id INTEGER NOT NULL,
+    user_id VARCHAR NOT NULL,
+    action VARCHAR NOT NULL,
+    date DATE NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (id)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_usage_tracking_user_date_action ON usage_tracking (user_id, date, action);
+
+CREATE TABLE IF NOT EXISTS saved_recipes (
+    id INTEGER NOT NULL,
+    user_id VARCHAR NOT NULL,
+    recipe TEXT NOT NULL,
+    saved_at DATETIME NOT NULL,
+    PRIMARY KEY (id)
+);
+CREATE INDEX IF NOT EXISTS ix_saved_recipes_user_saved_at ON saved_recipes (user_id, saved_at);
+
+CREATE TABLE IF NOT EXISTS processed_webhook_events (
+    event_id VARCHAR NOT NULL PRIMARY KEY,
+    type VARCHAR,
+    processed_at DATETIME NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS waitlist (
+    user_id VARCHAR NOT NULL PRIMARY KEY,
+    email VARCHAR,
+    joined_at DATETIME NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS account_deletions (
+    user_id VARCHAR NOT NULL PRIMARY KEY,
+    status VARCHAR NOT NULL,
+    job TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_account_deletions_status ON account_deletions (status);
+"""
+
+_PANTRY_COLUMNS = "id, name, quantity, unit, expiry_date, date_added"
+_LOG_COLUMNS = "id, date, meal_name, calories, protein, carbs, fat"
+# Pantry fields a client may change (PantryItemUpdate)
+_PANTRY_UPDATABLE = ("name", "quantity", "unit", "expiry_date")
+# Tables with a user_id column, emptied when an account is deleted
+_USER_TABLES = ("pantry", "nutrition_log", "saved_recipes", "usage_tracking", "user_subscriptions", "waitlist")
+# Rows deleted per statement, so other writers get the lock in between
+_DELETE_CHUNK = 1000
+
+
+def _text(value: Any) -> Any:
+    """Dates and datetimes as ISO strings, which sort and compare correctly as TEXT."""
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _row_id(value: str) -> Optional[int]:
+    """The integer key behind an id from a URL, or None if it cannot be one."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _cursor(page_token: Optional[str], size: int) -> Optional[List[Any]]:
+    """page_cursor with the trailing id turned back into the integer key."""
+    values = page_cursor(page_token, size)
+    if values is None:
+        return None
+    row_id = _row_id(values[-1])
+    if row_id is None:
+        raise HTTPException(status_code=400, detail="Invalid page token")
+    return values[:-1] + [row_id]
+
+
+def _page(rows: List[sqlite3.Row], limit: int, to_dict, order_by: tuple = ()) -> Page:
+    """Rows fetched with LIMIT limit + 1: the extra one only says another page follows."""
+    if len(rows) <= limit:
+        return Page([to_dict(row) for row in rows], None)
+    rows = rows[:limit]
+    last = rows[-1]
+    return Page([to_dict(row) for row in rows], encode_page_token([last[f] for f in order_by] + [str(last["id"])]))
+
+
+def _with_id(row: sqlite3.Row) -> dict:
+    data = dict(row)
+    data["id"] = str(data["id"])
+    return data
+
+
+class SQLitePantry(PantryRepository):
+    def __init__(self, store: "SQLiteStorage"):
+        self.store = store
+
+    async def list(self, uid, limit, page_token):
+        cursor = _cursor(page_token, 1)
+        rows = self.store.query(
+            f"SELECT {_PANTRY_COLUMNS} FROM pantry WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (uid, cursor[0] if cursor else -1, limit + 1),
+        )
+        return _page(rows, limit, _with_id)
+
+    async def prompt_items(self, uid):
+        return self.prompt_items_blocking(uid)
+
+    def prompt_items_blocking(self, uid):
+        rows = self.store.query(f"SELECT {', '.join(PROMPT_FIELDS)} FROM pantry WHERE user_id = ? ORDER BY id", (uid,))
+        return [dict(row) for row in rows]
+
+    async def create(self, uid, data):
+        def insert():
+            row = self.store.connection().execute(
+                "INSERT INTO pantry (user_id, name, quantity, unit, expiry_date, date_added)"
+                f" VALUES (?, ?, ?, ?, ?, ?) RETURNING {_PANTRY_COLUMNS}",
+                (uid, data["name"], data["quantity"], data["unit"], _text(data.get("expiry_date")),
+                 _text(data.get("date_added")) or _now()),
+            ).fetchone()
+            return _with_id(row)
+        return await run_in_threadpool(insert)
+
+    async def import_items(self, uid, items):
+        groups = group_import(items)
+
+        # One transaction: the import lands whole or not at all
+        def write():
+            with self.store.transaction() as conn:
+                existing = {}
+                for row in conn.execute("SELECT id, name, unit FROM pantry WHERE user_id = ? ORDER BY id", (uid,)):
+                    existing.setdefault(pantry_key(row["name"], row["unit"]), row["id"])
+                outcomes = []
+                for group in groups:
+                    row_id = existing.get(group.key)
+                    if row_id is not None:
+                        conn.execute("UPDATE pantry SET quantity = quantity + ? WHERE id = ?", (group.data["quantity"], row_id))
+                        outcomes.append({"id": str(row_id), "status": "merged"})
+                        continue
+                    data = group.data
+                    row = conn.execute(
+                        "INSERT INTO pantry (user_id, name, quantity, unit, expiry_date, date_added)"
+                        " VALUES (?, ?, ?, ?, ?, ?) RETURNING id",
+                        (uid, data["name"], data["quantity"], data["unit"], _text(data.get("expiry_date")),
+                         _text(data.get("date_added")) or _now()),
+                    ).fetchone()
+                    outcomes.append({"id": str(row["id"]), "status": "created"})
+                return outcomes
+        return import_results(items, groups, await run_in_threadpool(write))
+
+    async def update(self, uid, item_id, changes):
+        row_id = _row_id(item_id)
+        if row_id is None:
+            return None
+        columns = [c for c in _PANTRY_UPDATABLE if c in changes]
+        if not columns:
+            rows = self.store.query(f"SELECT {_PANTRY_COLUMNS} FROM pantry WHERE id = ? AND user_id = ?", (row_id, uid))
+            return _with_id(rows[0]) if rows else None
+
+        def update():
+            row = self.store.connection().execute(
+                f"UPDATE pantry SET {', '.join(f'{c} = ?' for c in columns)}"
+                f" WHERE id = ? AND user_id = ? RETURNING {_PANTRY_COLUMNS}",
+                (*(_text(changes[c]) for c in columns), row_id, uid),
+            ).fetchone()
+            return _with_id(row) if row is not None else None
+        return await run_in_threadpool(update)
+
+    async def delete(self, uid, item_id):
+        return await self.store.delete_row("pantry", uid, item_id)
+
+
+class SQLiteNutrition(NutritionRepository):
+    """Daily totals are summed from nutrition_log on the (user_id, date) index; there is no rollup table."""
+
+    def __init__(self, store: "SQLiteStorage"):
+        self.store = store
+
+    async def list(self, uid, limit, page_token, from_=None, to=None):
+        sql = f"SELECT {_LOG_COLUMNS} FROM nutrition_log WHERE user_id = ?"
+        params: list = [uid]
+        if from_ is not None:
+            sql += " AND date >= ?"
+            params.append(from_)
+        if to is not None:
+            sql += " AND date <= ?"
+            params.append(to)
+        cursor = _cursor(page_token, 2)
+        if cursor is not None:
+            sql += " AND (date, id) < (?, ?)"
+            params.extend(cursor)
+        sql += " ORDER BY date DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+        return _page(self.store.query(sql, params), limit, _with_id, ("date",))
+
+    async def get(self, uid, log_id):
+        rows = self.store.query(
+            f"SELECT {_LOG_COLUMNS} FROM nutrition_log WHERE id = ? AND user_id = ?", (_row_id(log_id), uid),
+        )
+        return _with_id(rows[0]) if rows else None
+
+    async def add(self, uid, data):
+        def insert():
+            row = self.store.connection().execute(
+                "INSERT INTO nutrition_log (user_id, date, meal_name, calories, protein, carbs, fat)"
+                f" VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING {_LOG_COLUMNS}",
+                (uid, _text(data["date"]), data["meal_name"], *(data.get(k) for k in DAILY_FIELDS)),
+            ).fetchone()
+            return _with_id(row)
+        return await run_in_threadpool(insert)
+
+    async def delete(self, uid, log_id):
+        return await self.store.delete_row("nutrition_log", uid, log_id)
+
+    async def daily_totals(self, uid, from_, to):
+        rows = self.store.query(
+            "SELECT date, SUM(calories) AS calories, SUM(protein) AS protein, SUM(carbs) AS carbs,"
+            " SUM(fat) AS fat, COUNT(*) AS meals FROM nutrition_log"
+            " WHERE user_id = ? AND date >= ? AND date <= ? GROUP BY date",
+            (uid, from_, to),
+        )
+        return {row["date"]: dict(row) for row in rows}
+
+
+def _recipe_dict(row: sqlite3.Row) -> dict:
+    return {**json.loads(row["recipe"]), "saved_at": row["saved_at"], "id": str(row["id"])}
+
+
+class SQLiteSavedRecipes(SavedRecipeRepository):
+    def __init__(self, store: "SQLiteStorage"):
+        self.store = store
+
+    async def list(self, uid, limit, page_token):
+        sql = "SELECT id, recipe, saved_at FROM saved_recipes WHERE user_id = ?"
+        params: list = [uid]
+        cursor = _cursor(page_token, 2)
+        if cursor is not None:
+            sql += " AND (saved_at, id) < (?, ?)"
+            params.extend([_text(cursor[0]), cursor[1]])
+        sql += " ORDER BY saved_at DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+        return _page(self.store.query(sql, params), limit, _recipe_dict, ("saved_at",))
+
+    async def save(self, uid, data):
+        recipe = {k: v for k, v in data.items() if k != "saved_at"}
+        saved_at = _text(data.get("saved_at")) or _now()
+
+        def insert():
+            row = self.store.connection().execute(
+                "INSERT INTO saved_recipes (user_id, recipe, saved_at) VALUES (?, ?, ?) RETURNING id",
+                (uid, json.dumps(recipe), saved_at),
+            ).fetchone()
+            return {**data, "id": str(row["id"])}
+        return await run_in_threadpool(insert)
+
+    async def delete(self, uid, recipe_id):
+        return await self.store.delete_row("saved_recipes", uid, recipe_id)
+
+
+class SQLiteUsage(UsageRepository):
+    def __init__(self, store: "SQLiteStorage"):
+        self.store = store
+
+    async def increment(self, uid, day, action):
+        # One upsert: atomic without a read-modify-write transaction
+        def upsert():
+            row = self.store.connection().execute(
+                "INSERT INTO usage_tracking (user_id, action, date, count) VALUES (?, ?, ?, 1)"
+                " ON CONFLICT (user_id, date, action) DO UPDATE SET count = count + 1 RETURNING count",
+                (uid, action, day),
+            ).fetchone()
+            return row["count"]
+        return await run_in_threadpool(upsert)
+
+    async def decrement(self, uid, day, action):
+        await self.store.write(
+            "UPDATE usage_tracking SET count = count - 1 WHERE user_id = ? AND date = ? AND action = ?",
+            (uid, day, action),
+        )
+
+
+class SQLiteSubscriptions(SubscriptionRepository):
+    def __init__(self, store: "SQLiteStorage"):
+        self.store = store
+
+    async def get_tier(self, uid):
+        rows = self.store.query("SELECT tier FROM user_subscriptions WHERE user_id = ?", (uid,))
+        return rows[0]["tier"] if rows else "free"
+
+    async def set_tier(self, uid, tier, granted_manually):
+        await self.store.write(
+            "INSERT INTO user_subscriptions (user_id, tier, granted_manually, updated_at) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (user_id) DO UPDATE SET tier = excluded.tier,"
+            " granted_manually = excluded.granted_manually, updated_at = excluded.updated_at",
+            (uid, tier, granted_manually, _now()),
+        )
+
+    async def claim_webhook_event(self, event_id, event_type):
+        cursor = await self.store.write(
+            "INSERT OR IGNORE INTO processed_webhook_events (event_id, type, processed_at) VALUES (?, ?, ?)",
+            (event_id, event_type, _now()),
+        )
+        return cursor.rowcount == 1
+
+    async def activate(self, uid, customer_id, subscription_id):
+        await self.store.write(
+            "INSERT INTO user_subscriptions (user_id, tier, stripe_customer_id, stripe_subscription_id, updated_at)"
+            " VALUES (?, 'pro', ?, ?, ?) ON CONFLICT (user_id) DO UPDATE SET tier = excluded.tier,"
+            " stripe_customer_id = excluded.stripe_customer_id,"
+            " stripe_subscription_id = excluded.stripe_subscription_id, updated_at = excluded.updated_at",
+            (uid, customer_id, subscription_id, _now()),
+        )
+
+    async def cancel(self, subscription_id):
+        def downgrade():
+            row = self.store.connection().execute(
+                "UPDATE user_subscriptions SET tier = 'free', stripe_subscription_id = NULL, updated_at = ?"
+                " WHERE stripe_subscription_id = ? RETURNING user_id",
+                (_now(), subscription_id),
+            ).fetchone()
+            return row["user_id"] if row is not None else None
+        return await run_in_threadpool(downgrade)
+
+    async def join_waitlist(self, uid, email):
+        await self.store.write(
+            "INSERT INTO waitlist (user_id, email, joined_at) VALUES (?, ?, ?)"
+            " ON CONFLICT (user_id) DO UPDATE SET email = excluded.email, joined_at = excluded.joined_at",
+            (uid, email, _now()),
+        )
+
+
+class SQLiteDeletionJobs(DeletionJobRepository):
+    def __init__(self, store: "SQLiteStorage"):
+        self.store = store
+
+    async def get(self, uid):
+        rows = self.store.query("SELECT job FROM account_deletions WHERE user_id = ?", (uid,))
+        return json.loads(rows[0]["job"]) if rows else None
+
+    async def save(self, job):
+        await self.store.write(
+            "INSERT INTO account_deletions (user_id, status, job) VALUES (?, ?, ?)"
+            " ON CONFLICT (user_id) DO UPDATE SET status = excluded.status, job = excluded.job",
+            (job["uid"], job["status"], json.dumps(job, default=_text)),
+        )
+
+    async def unfinished(self):
+        rows = self.store.query("SELECT job FROM account_deletions WHERE status IN ('pending', 'running')")
+        return [json.loads(row["job"]) for row in rows]
+
+
+class SQLiteStorage(Storage):
+    """
+    All repositories over one database file. Connections are opened per
+    thread on first use; the schema is created (or brought up to date) by
+    the first one.
+    """
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self.pantry = SQLitePantry(self)
+        self.nutrition = SQLiteNutrition(self)
+        self.saved_recipes = SQLiteSavedRecipes(self)
+        self.usage = SQLiteUsage(self)
+        self.subscriptions = SQLiteSubscriptions(self)
+        self.deletion_jobs = SQLiteDeletionJobs(self)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit: each statement is its own transaction unless
+            # transaction() opens one
+            conn = sqlite3.connect(self.path, isolation_level=None, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL makes NORMAL safe against corruption; only the last commits can be lost on power failure
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            self._ensure_schema(conn)
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self, conn: sqlite3.Connection) -> None:
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            conn.executescript(_SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(user_subscriptions)")}
+            if "granted_manually" not in columns:
+                conn.execute("ALTER TABLE user_subscriptions ADD COLUMN granted_manually BOOLEAN")
+            self._schema_ready = True
+            logger.info("SQLite storage ready at %s", self.path)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        The calling thread's connection inside BEGIN IMMEDIATE, so the write
+        lock is taken up front rather than on the first write after a read.
+        """
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def query(self, sql: str, params=()) -> List[sqlite3.Row]:
+        return self.connection().execute(sql, params).fetchall()
+
+    async def write(self, sql: str, params=()) -> sqlite3.Cursor:
+        return await run_in_threadpool(lambda: self.connection().execute(sql, params))
+
+    async def delete_row(self, table: str, uid: str, row_id: str) -> bool:
+        """Deletes one of uid's rows by id; False if there was none."""
+        key = _row_id(row_id)
+        if key is None:
+            return False
+        cursor = await self.write(f"DELETE FROM {table} WHERE id = ? AND user_id = ?", (key, uid))
+        return cursor.rowcount == 1
+
+    async def user_collections(self, uid: str) -> List[str]:
+        return list(_USER_TABLES)
+
+    async def delete_user_collection(self, uid: str, name: str) -> int:
+        if name not in _USER_TABLES:
+            raise ValueError(f"Not a user table: {name}")
+        sql = f"DELETE FROM {name} WHERE rowid IN (SELECT rowid FROM {name} WHERE user_id = ? LIMIT {_DELETE_CHUNK})"
+        deleted = 0
+        while True:
+            cursor = await self.write(sql, (uid,))
+            deleted += cursor.rowcount
+            if cursor.rowcount < _DELETE_CHUNK:
+                return deleted
+
+    async def delete_user_record(self, uid: str) -> None:
+        pass  # no row per user beyond the user tables
+
+    def close(self) -> None:
+        """Closes the calling thread's connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
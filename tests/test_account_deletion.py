@@ -0,0 +1,163 @@
+"""
+Tests for account_deletion: batched deletes of every user collection on the
+in-memory Firestore backend, resuming a job that failed part way, and the
+DELETE /users/me and GET /users/me/deletion endpoints.
+"""
+import asyncio
+
+import pytest
+from unittest.mock import MagicMock, patch
+from fastapi.testclient import TestClient
+
+import account_deletion
+import memory_firestore
+from storage.firestore_store import FirestoreStorage
+
+MOCK_USER = {"uid": "test-uid-123", "email": "test@example.com"}
+AUTH_HEADER = {"Authorization": "Bearer fake-token"}
+
+
+@pytest.fixture
+def memory():
+    return memory_firestore.MemoryFirestore()
+
+
+@pytest.fixture
+def seed(memory):
+    def seed(uid, pantry=0, recipes=0):
+        db = memory_firestore.client(memory)
+        user = db.collection("users").document(uid)
+        user.set({"tier": "pro"})
+        for i in range(pantry):
+            user.collection("pantry").document(f"p{i:04}").set({"name": f"Item {i}", "quantity": 1, "unit": "kg"})
+        for i in range(recipes):
+            user.collection("saved_recipes").document(f"r{i}").set({"name": f"Recipe {i}"})
+        db.collection("waitlist").document(uid).set({"email": "a@example.com"})
+        return db
+    return seed
+
+
+@pytest.fixture
+def auth_deletes(monkeypatch):
+    deleted = []
+    monkeypatch.setattr(account_deletion.firebase_auth, "delete_user", deleted.append)
+    return deleted
+
+
+def _store(memory):
+    return FirestoreStorage(memory_firestore.async_client(memory))
+
+
+def _documents(parent):
+    """Every document under parent (a client or a document), including missing ones with subcollections."""
+    for col in parent.collections():
+        for ref in col.list_documents():
+            yield ref
+            yield from _documents(ref)
+
+
+def test_deletes_every_collection_in_batches(memory, seed, auth_deletes):
+    db = seed("u1", pantry=1234, recipes=3)
+    seed("u2", pantry=2)
+    store = _store(memory)
+    asyncio.run(store.subscriptions.activate("u1", "cus_1", "sub_old"))
+    asyncio.run(store.subscriptions.activate("u1", "cus_1", "sub_new"))
+    asyncio.run(store.subscriptions.activate("u2", "cus_2", "sub_u2"))
+    job = account_deletion.new_job("u1")
+    asyncio.run(account_deletion.delete_account(store, job))
+
+    assert auth_deletes == ["u1"]
+    assert job["status"] == "done" and job["auth_deleted"]
+    assert job["collections"] == {"pantry": 1234, "saved_recipes": 3, "subscription": 1}
+    # Only the erasure record the client polls still names the user
+    survivors = [
+        ref.path for ref in _documents(db)
+        if "u1" in ref.path or "u1" in str((ref.get().to_dict() or {}).values())
+    ]
+    assert survivors == ["account_deletions/u1"]
+    assert db.collection("stripe_subscriptions").document("sub_u2").get().exists
+    user = db.collection("users").document("u1")
+    assert not user.get().exists and not db.collection("waitlist").document("u1").get().exists
+    assert list(user.collections()) == []
+    assert len(list(db.collection("users").document("u2").collection("pantry").stream())) == 2
+    assert asyncio.run(store.deletion_jobs.get("u1"))["status"] == "done"
+
+
+def test_failed_job_resumes_where_it_stopped(memory, seed, auth_deletes, monkeypatch):
+    seed("u1", pantry=10, recipes=2)
+    store = _store(memory)
+    delete_collection = store.delete_user_collection
+
+    async def pantry_fails(uid, name):
+        if name == "pantry":
+            raise RuntimeError("deadline exceeded")
+        return await delete_collection(uid, name)
+
+    monkeypatch.setattr(store, "delete_user_collection", pantry_fails)
+    deleter = account_deletion.AccountDeleter(concurrency=2)
+    job = account_deletion.new_job("u1")
+
+    async def run_job():
+        assert deleter.start(store, job)
+        await asyncio.gather(*deleter._tasks.values())
+
+    asyncio.run(run_job())
+    saved = asyncio.run(store.deletion_jobs.get("u1"))
+    assert saved["status"] == "failed" and saved["error"] == "RuntimeError"
+    assert saved["collections"] == {"saved_recipes": 2}
+    assert deleter.stats()["failed"] == 1
+
+    monkeypatch.setattr(store, "delete_user_collection", delete_collection)
+    saved["status"] = "running"  # as if the process died mid-job
+    asyncio.run(store.deletion_jobs.save(saved))
+
+    async def resume():
+        assert await deleter.resume_unfinished(store) == 1
+        await asyncio.gather(*deleter._tasks.values())
+
+    asyncio.run(resume())
+    saved = asyncio.run(store.deletion_jobs.get("u1"))
+    assert saved["status"] == "done"
+    assert saved["collections"] == {"saved_recipes": 2, "pantry": 10}
+    assert auth_deletes == ["u1"]
+
+
+# ── The endpoints ─────────────────────────────────────────────────────────────
+
+@pytest.fixture(scope="module")
+def app():
+    with patch("firebase_admin_setup.init_firebase"), \
+         patch("firebase_admin.auth.verify_id_token", return_value=MOCK_USER):
+        import sys
+        for mod in list(sys.modules.keys()):
+            if mod.startswith(("routers", "main", "dependencies", "firestore_db", "limiter", "storage")):
+                sys.modules.pop(mod, None)
+        from main import app as _app
+        return _app
+
+
+@pytest.fixture
+def client(app, memory):
+    from firestore_db import get_async_firestore
+    from dependencies import get_current_user
+    app.dependency_overrides[get_async_firestore] = lambda: memory_firestore.async_client(memory)
+    app.dependency_overrides[get_current_user] = lambda: MOCK_USER
+    with TestClient(app, raise_server_exceptions=False) as c:
+        yield c
+    app.dependency_overrides.clear()
+
+
+def test_delete_returns_at_once_and_reports_progress(client, seed, auth_deletes):
+    seed(MOCK_USER["uid"], pantry=30, recipes=1)
+    assert client.get("/users/me/deletion", headers=AUTH_HEADER).status_code == 404
+    resp = client.delete("/users/me", headers=AUTH_HEADER)
+    assert resp.status_code == 202
+    assert resp.json()["status"] == "pending"
+
+    for _ in range(100):
+        job = client.get("/users/me/deletion", headers=AUTH_HEADER).json()
+        if job["status"] == "done":
+            break
+    assert job["status"] == "done", job
+    assert job["collections"] == {"pantry": 30, "saved_recipes": 1}
+    assert auth_deletes == [MOCK_USER["uid"]]
@@ -0,0 +1,88 @@
+"""
+Integration tests for the /agents/chat endpoint, including combined
+(log_meals) mode. The orchestrator and Firestore are mocked.
+"""
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from fastapi.testclient import TestClient
+
+
+MOCK_USER = {"uid": "test-uid-123", "email": "test@example.com"}
+AUTH_HEADER = {"Authorization": "Bearer fake-token"}
+
+
+@pytest.fixture(scope="module")
+def app():
+    with patch("firebase_admin_setup.init_firebase"), \
+         patch("firebase_admin.auth.verify_id_token", return_value=MOCK_USER):
+        import sys
+        for mod in list(sys.modules.keys()):
+            if mod.startswith(("routers", "main", "dependencies", "firestore_db", "limiter", "storage")):
+                sys.modules.pop(mod, None)
+        from main import app as _app
+        return _app
+
+
+@pytest.fixture
+def db():
+    db = MagicMock()
+    db.batch.return_value.commit = AsyncMock()
+    return db
+
+
+@pytest.fixture
+def client(app, db):
+    from firestore_db import get_async_firestore
+    from dependencies import get_current_user
+    app.dependency_overrides[get_async_firestore] = lambda: db
+    app.dependency_overrides[get_current_user] = lambda: MOCK_USER
+    with TestClient(app, raise_server_exceptions=False) as c:
+        yield c
+    app.dependency_overrides.clear()
+
+
+def _orchestrator_result(result):
+    async def fake(message, history, include_nutrition=False):
+        return result
+    return fake
+
+
+MEAL_RESULT = {
+    "intent": "log_nutrition",
+    "extracted_data": "2 eggs and toast",
+    "response": "Logged!",
+    "nutrition": {"meal_name": "Eggs on toast", "calories": 350, "protein": 20, "carbs": 30, "fat": 15},
+}
+
+
+class TestChatCombinedMode:
+    def test_logs_meal_from_single_generation(self, client, db, monkeypatch):
+        from routers import chat
+        monkeypatch.setattr(chat.orchestrator_agent, "process_chat_async", _orchestrator_result(MEAL_RESULT))
+        doc_ref = MagicMock()
+        doc_ref.id = "log-1"
+        db.collection().document().collection().document.return_value = doc_ref
+
+        resp = client.post("/agents/chat", json={"message": "I had 2 eggs and toast", "log_meals": True}, headers=AUTH_HEADER)
+        assert resp.status_code == 200
+        log = resp.json()["nutrition_log"]
+        assert log["id"] == "log-1"
+        assert log["meal_name"] == "Eggs on toast"
+        assert log["calories"] == 350
+
+    def test_no_log_without_a_meal_estimate(self, client, db, monkeypatch):
+        from routers import chat
+        result = {"intent": "log_nutrition", "extracted_data": "I had a bad day", "response": "Got it!"}
+        monkeypatch.setattr(chat.orchestrator_agent, "process_chat_async", _orchestrator_result(result))
+        resp = client.post("/agents/chat", json={"message": "I had a bad day", "log_meals": True}, headers=AUTH_HEADER)
+        assert resp.status_code == 200
+        assert resp.json()["nutrition_log"] is None
+        db.batch().commit.assert_not_called()
+
+    def test_default_mode_does_not_log(self, client, db, monkeypatch):
+        from routers import chat
+        monkeypatch.setattr(chat.orchestrator_agent, "process_chat_async", _orchestrator_result(MEAL_RESULT))
+        resp = client.post("/agents/chat", json={"message": "I had 2 eggs and toast"}, headers=AUTH_HEADER)
+        assert resp.status_code == 200
+        assert resp.json()["nutrition_log"] is None
+        db.batch().commit.assert_not_called()
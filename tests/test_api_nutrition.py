@@ -0,0 +1,174 @@
+"""
+Integration tests for nutrition logging and the per-day rollups.
+Uses FastAPI dependency_overrides to mock Firestore and auth.
+"""
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from fastapi.testclient import TestClient
+
+
+MOCK_USER = {"uid": "test-uid-123", "email": "test@example.com"}
+AUTH_HEADER = {"Authorization": "Bearer fake-token"}
+
+
+@pytest.fixture(scope="module")
+def app():
+    with patch("firebase_admin_setup.init_firebase"), \
+         patch("firebase_admin.auth.verify_id_token", return_value=MOCK_USER):
+        import sys
+        for mod in list(sys.modules.keys()):
+            if mod.startswith(("routers", "main", "dependencies", "firestore_db", "limiter", "storage")):
+                sys.modules.pop(mod, None)
+        from main import app as _app
+        return _app
+
+
+@pytest.fixture
+def db():
+    db = MagicMock()
+    db.batch.return_value.commit = AsyncMock()
+    return db
+
+
+@pytest.fixture
+def client(app, db):
+    from firestore_db import get_async_firestore
+    from dependencies import get_current_user
+    app.dependency_overrides[get_async_firestore] = lambda: db
+    app.dependency_overrides[get_current_user] = lambda: MOCK_USER
+    with TestClient(app, raise_server_exceptions=False) as c:
+        yield c
+    app.dependency_overrides.clear()
+
+
+def _make_doc(data):
+    doc = MagicMock()
+    doc.to_dict.return_value = data
+    return doc
+
+
+MEAL = {"meal_name": "Oats", "calories": 300, "protein": 10, "carbs": 50, "fat": 6, "date": "2026-03-02"}
+
+
+class TestCreateNutritionLog:
+    def test_log_and_rollup_written_in_one_batch(self, client, db):
+        doc_ref = MagicMock()
+        doc_ref.id = "log-1"
+        db.collection().document().collection().document.return_value = doc_ref
+        resp = client.post("/nutrition", json=MEAL, headers=AUTH_HEADER)
+        assert resp.status_code == 201
+        assert resp.json()["id"] == "log-1"
+        batch = db.batch()
+        assert batch.set.call_count == 2
+        batch.commit.assert_awaited_once()
+        rollup = batch.set.call_args_list[1]
+        assert rollup.kwargs == {"merge": True}
+        assert rollup.args[1]["date"] == "2026-03-02"
+        assert set(rollup.args[1]) == {"date", "calories", "protein", "carbs", "fat", "meals"}
+
+
+class TestDeleteNutritionLog:
+    def test_deletes_and_decrements(self, client, monkeypatch):
+        from storage.firestore_store import FirestoreNutrition
+        delete = AsyncMock(return_value=True)
+        monkeypatch.setattr(FirestoreNutrition, "delete", delete)
+        assert client.delete("/nutrition/log-1", headers=AUTH_HEADER).status_code == 204
+        delete.assert_awaited_once()
+
+    def test_404_for_missing(self, client, monkeypatch):
+        from storage.firestore_store import FirestoreNutrition
+        monkeypatch.setattr(FirestoreNutrition, "delete", AsyncMock(return_value=False))
+        assert client.delete("/nutrition/missing", headers=AUTH_HEADER).status_code == 404
+
+
+class TestDailyNutrition:
+    def test_reads_rollups_and_fills_empty_days(self, client, db):
+        user = MagicMock(exists=True)
+        user.to_dict.return_value = {"nutrition_rollups_backfilled": True}
+        db.collection().document().get = AsyncMock(return_value=user)
+        query = db.collection().document().collection().where().where()
+        query.stream.return_value.__aiter__.return_value = [
+            _make_doc({"date": "2026-03-02", "calories": 300.0000000001, "protein": 10, "carbs": 50, "fat": 6, "meals": 1}),
+        ]
+        resp = client.get("/nutrition/daily?from=2026-03-01&to=2026-03-03", headers=AUTH_HEADER)
+        assert resp.status_code == 200
+        days = resp.json()
+        assert [d["date"] for d in days] == ["2026-03-01", "2026-03-02", "2026-03-03"]
+        assert days[0] == {"date": "2026-03-01", "calories": 0, "protein": 0, "carbs": 0, "fat": 0, "meals": 0}
+        assert days[1]["calories"] == 300 and days[1]["meals"] == 1
+
+    def test_rejects_bad_ranges(self, client):
+        assert client.get("/nutrition/daily?from=2026-03-05&to=2026-03-01", headers=AUTH_HEADER).status_code == 400
+        assert client.get("/nutrition/daily?from=2024-01-01&to=2026-03-01", headers=AUTH_HEADER).status_code == 400
+
+
+class TestNutritionLogPages:
+    def test_date_filters_and_order(self, client, db):
+        logs = db.collection().document().collection()
+        page = logs.where().where().order_by().order_by().limit()
+        page.stream.return_value.__aiter__.return_value = []
+        resp = client.get("/nutrition?from=2026-03-01&to=2026-03-31", headers=AUTH_HEADER)
+        assert resp.status_code == 200
+        logs.where.assert_any_call("date", ">=", "2026-03-01")
+        logs.where().where.assert_any_call("date", "<=", "2026-03-31")
+        logs.where().where().order_by.assert_any_call("date", direction="DESCENDING")
+
+    def test_page_token_round_trips_datetimes(self):
+        from datetime import datetime, timezone
+        from pagination import decode_page_token, encode_page_token
+        values = [datetime(2026, 3, 2, 8, 30, tzinfo=timezone.utc), "2026-03-02", "doc-1"]
+        assert decode_page_token(encode_page_token(values)) == values
+
+
+class TestLogsFromBeforeRollups:
+    """On the in-memory Firestore backend, with logs written before nutrition_daily existed."""
+
+    @pytest.fixture
+    def memory(self, app):
+        import memory_firestore
+        from firestore_db import get_async_firestore
+        memory = memory_firestore.MemoryFirestore()
+        app.dependency_overrides[get_async_firestore] = lambda: memory_firestore.async_client(memory)
+        logs = memory_firestore.client(memory).collection("users").document(MOCK_USER["uid"]).collection("nutrition_logs")
+        logs.document("old-1").set({**MEAL, "calories": 500})
+        logs.document("old-2").set({**MEAL, "date": "2026-03-01"})
+        return memory
+
+    def _daily(self, client):
+        resp = client.get("/nutrition/daily?from=2026-03-01&to=2026-03-02", headers=AUTH_HEADER)
+        assert resp.status_code == 200
+        return {d["date"]: (d["calories"], d["meals"]) for d in resp.json()}
+
+    def test_deleting_an_older_log_leaves_the_rollup_alone(self, client, memory):
+        assert client.delete("/nutrition/old-1", headers=AUTH_HEADER).status_code == 204
+        assert client.post("/nutrition", json=MEAL, headers=AUTH_HEADER).status_code == 201
+        assert self._daily(client) == {"2026-03-01": (300, 1), "2026-03-02": (300, 1)}
+
+    def test_first_read_counts_older_logs_once(self, client, memory):
+        assert client.post("/nutrition", json=MEAL, headers=AUTH_HEADER).status_code == 201
+        assert self._daily(client) == {"2026-03-01": (300, 1), "2026-03-02": (800, 2)}
+        assert self._daily(client) == {"2026-03-01": (300, 1), "2026-03-02": (800, 2)}
+        assert client.delete("/nutrition/old-1", headers=AUTH_HEADER).status_code == 204
+        assert self._daily(client) == {"2026-03-01": (300, 1), "2026-03-02": (300, 1)}
+
+    def test_delete_racing_the_backfill_is_retried(self, client, memory, monkeypatch):
+        import memory_firestore
+        from google.cloud.firestore_v1.async_document import AsyncDocumentReference
+        from storage.firestore_store import FirestoreNutrition
+        get = AsyncDocumentReference.get
+        raced = []
+
+        async def get_then_backfill(self, *args, **kwargs):
+            snapshot = await get(self, *args, **kwargs)
+            if self.id == "old-1" and not raced:
+                # The first daily read counts and marks the log between the
+                # delete's read and its commit
+                raced.append(True)
+                await FirestoreNutrition(memory_firestore.async_client(memory))._backfill(MOCK_USER["uid"])
+            return snapshot
+
+        monkeypatch.setattr(AsyncDocumentReference, "get", get_then_backfill)
+        assert client.delete("/nutrition/old-1", headers=AUTH_HEADER).status_code == 204
+        assert raced
+        assert client.get("/nutrition/old-1", headers=AUTH_HEADER).status_code == 404
+        assert self._daily(client) == {"2026-03-01": (300, 1), "2026-03-02": (0, 0)}
@@ -3,7 +3,7 @@ Integration tests for the pantry endpoints.
 Uses FastAPI dependency_overrides to mock Firestore and auth.
 """
 import pytest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from datetime import datetime, timezone
 from fastapi.testclient import TestClient
 
@@ -18,7 +18,7 @@ def app():
          patch("firebase_admin.auth.verify_id_token", return_value=MOCK_USER):
         import sys
         for mod in list(sys.modules.keys()):
-            if mod.startswith(("routers.", "main", "dependencies", "firestore_db", "limiter")):
+            if mod.startswith(("routers", "main", "dependencies", "firestore_db", "limiter", "storage")):
                 sys.modules.pop(mod, None)
         from main import app as _app
         return _app
@@ -31,9 +31,9 @@ def db():
 
 @pytest.fixture
 def client(app, db):
-    from firestore_db import get_firestore
+    from firestore_db import get_async_firestore
     from dependencies import get_current_user
-    app.dependency_overrides[get_firestore] = lambda: db
+    app.dependency_overrides[get_async_firestore] = lambda: db
     app.dependency_overrides[get_current_user] = lambda: MOCK_USER
     with TestClient(app, raise_server_exceptions=False) as c:
         yield c
@@ -50,7 +50,7 @@ def _make_doc(id_, data):
 
 class TestGetPantry:
     def test_returns_empty_list(self, client, db):
-        db.collection().document().collection().limit().offset().stream.return_value = iter([])
+        db.collection().document().collection().order_by().limit().stream.return_value.__aiter__.return_value = []
         resp = client.get("/pantry", headers=AUTH_HEADER)
         assert resp.status_code == 200
         assert resp.json() == []
@@ -61,9 +61,9 @@ class TestGetPantry:
             "expiry_date": "2026-06-01",
             "date_added": datetime.now(timezone.utc).isoformat(),
         }
-        db.collection().document().collection().limit().offset().stream.return_value = iter([
+        db.collection().document().collection().order_by().limit().stream.return_value.__aiter__.return_value = [
             _make_doc("abc123", item_data)
-        ])
+        ]
         resp = client.get("/pantry", headers=AUTH_HEADER)
         assert resp.status_code == 200
         items = resp.json()
@@ -71,9 +71,28 @@ class TestGetPantry:
         assert items[0]["name"] == "Milk"
         assert items[0]["id"] == "abc123"
 
+    def test_cursor_pagination(self, client, db):
+        from pagination import decode_page_token
+        query = db.collection().document().collection().order_by()
+        item = {"name": "Milk", "quantity": 2.0, "unit": "liters", "date_added": datetime.now(timezone.utc).isoformat()}
+        query.limit().stream.return_value.__aiter__.return_value = [_make_doc(id_, dict(item)) for id_ in "abc"]
+        resp = client.get("/pantry?limit=2", headers=AUTH_HEADER)
+        assert [i["id"] for i in resp.json()] == ["a", "b"]
+        token = resp.headers["X-Next-Page-Token"]
+        assert decode_page_token(token) == ["b"]
+
+        query.start_after().limit().stream.return_value.__aiter__.return_value = [_make_doc("c", dict(item))]
+        resp = client.get(f"/pantry?limit=2&page_token={token}", headers=AUTH_HEADER)
+        assert [i["id"] for i in resp.json()] == ["c"]
+        assert "X-Next-Page-Token" not in resp.headers
+        query.start_after.assert_called_with({"__name__": "b"})
+
+    def test_rejects_bad_page_token(self, client):
+        assert client.get("/pantry?page_token=not-a-token", headers=AUTH_HEADER).status_code == 400
+
     def test_requires_auth(self, app):
-        from firestore_db import get_firestore
-        app.dependency_overrides = {get_firestore: lambda: MagicMock()}
+        from firestore_db import get_async_firestore
+        app.dependency_overrides = {get_async_firestore: lambda: MagicMock()}
         with TestClient(app, raise_server_exceptions=False) as c:
             resp = c.get("/pantry")
         app.dependency_overrides.clear()
@@ -84,7 +103,7 @@ class TestCreatePantryItem:
     def test_creates_item(self, client, db):
         doc_ref = MagicMock()
         doc_ref.id = "new-doc-id"
-        db.collection().document().collection().add.return_value = (None, doc_ref)
+        db.collection().document().collection().add = AsyncMock(return_value=(None, doc_ref))
         resp = client.post("/pantry", json={"name": "Eggs", "quantity": 12, "unit": "count"}, headers=AUTH_HEADER)
         assert resp.status_code == 201
         data = resp.json()
@@ -99,14 +118,122 @@ class TestCreatePantryItem:
 class TestDeletePantryItem:
     def test_deletes_existing(self, client, db):
         ref = MagicMock()
-        ref.get.return_value.exists = True
+        ref.delete = AsyncMock()
         db.collection().document().collection().document.return_value = ref
         resp = client.delete("/pantry/abc123", headers=AUTH_HEADER)
         assert resp.status_code == 204
+        db.write_option.assert_called_with(exists=True)
+        ref.delete.assert_called_once_with(option=db.write_option())
+        ref.get.assert_not_called()
 
     def test_404_for_missing(self, client, db):
+        from google.api_core.exceptions import NotFound
         ref = MagicMock()
-        ref.get.return_value.exists = False
+        ref.delete = AsyncMock(side_effect=NotFound("no document"))
         db.collection().document().collection().document.return_value = ref
         resp = client.delete("/pantry/nonexistent", headers=AUTH_HEADER)
         assert resp.status_code == 404
+
+
+class TestBulkImport:
+    @pytest.fixture
+    def pantry(self, db):
+        col = db.collection().document().collection()
+        col.select().stream.return_value.__aiter__.return_value = [
+            _make_doc("milk-1", {"name": "Milk", "unit": "liters"}),
+        ]
+        new_ids = iter(f"new-{i}" for i in range(2000))
+        col.document.side_effect = lambda item_id=None: MagicMock(id=item_id or next(new_ids))
+        batches = []
+
+        def new_batch():
+            batch = MagicMock()
+            batch.commit = AsyncMock()
+            batches.append(batch)
+            return batch
+
+        db.batch.side_effect = new_batch
+        return col, batches
+
+    def test_merges_by_normalised_name_and_unit(self, client, pantry):
+        from google.cloud.firestore_v1 import Increment
+        col, batches = pantry
+        resp = client.post("/pantry/bulk", json=[
+            {"name": "Milk", "quantity": 1, "unit": "liters"},
+            {"name": " milk ", "quantity": 2, "unit": "Liters"},
+            {"name": "Eggs", "quantity": 6, "unit": "count", "expiry_date": "2026-06-03"},
+            {"name": "EGGS", "quantity": 6, "unit": "count", "expiry_date": "2026-06-01"},
+        ], headers=AUTH_HEADER)
+        assert resp.status_code == 200
+        results = resp.json()
+        assert [(r["status"], r["id"]) for r in results] == [
+            ("merged", "milk-1"), ("merged", "milk-1"), ("created", "new-0"), ("merged", "new-0"),
+        ]
+        col.select.assert_called_with(["name", "unit"])
+        # One batch: an increment for the existing item and one new item
+        assert len(batches) == 1
+        update = batches[0].update.call_args.args
+        assert update[0].id == "milk-1" and update[1] == {"quantity": Increment(3.0)}
+        created = batches[0].set.call_args.args[1]
+        assert created["quantity"] == 12 and created["expiry_date"] == "2026-06-01"
+
+    def test_commits_in_chunks_and_reports_failed_chunks(self, client, db, pantry):
+        col, batches = pantry
+        items = [{"name": f"Item {i}", "quantity": 1, "unit": "kg"} for i in range(1000)]
+        resp = client.post("/pantry/bulk", json=items, headers=AUTH_HEADER)
+        assert resp.status_code == 200
+        assert [b.set.call_count for b in batches] == [500, 500]
+        assert all(r["status"] == "created" for r in resp.json())
+
+        new_batch = db.batch.side_effect
+
+        def second_fails():
+            batch = new_batch()
+            if len(batches) == 4:
+                batch.commit.side_effect = Exception("deadline exceeded")
+            return batch
+
+        db.batch.side_effect = second_fails
+        results = client.post("/pantry/bulk", json=items, headers=AUTH_HEADER).json()
+        assert {r["status"] for r in results[:500]} == {"created"}
+        assert {r["status"] for r in results[500:]} == {"failed"}
+        assert results[500]["id"] is None
+
+    def test_rejects_oversized_imports(self, client):
+        items = [{"name": "Rice", "quantity": 1, "unit": "kg"}] * 1001
+        assert client.post("/pantry/bulk", json=items, headers=AUTH_HEADER).status_code == 400
+
+
+class TestVisionScanImport:
+    @pytest.fixture
+    def scan(self, app, client, monkeypatch):
+        from dependencies import require_pro
+        from routers import pantry
+        scanned = [
+            {"name": "Milk", "quantity": 1, "unit": "liters", "expiry_date": None},
+            {"name": "Mystery", "quantity": "some", "unit": "jar"},
+        ]
+        monkeypatch.setattr(pantry.vision_agent, "parse_fridge_image_async", AsyncMock(return_value=scanned))
+        app.dependency_overrides[require_pro] = lambda: MOCK_USER
+
+        def post(query=""):
+            files = {"file": ("fridge.png", b"not really a png", "image/png")}
+            return client.post(f"/agents/vision/scan{query}", files=files, headers=AUTH_HEADER)
+        return post
+
+    def test_returns_items_without_importing(self, scan, db):
+        resp = scan()
+        assert resp.status_code == 200
+        assert resp.json()[0] == {"name": "Milk", "quantity": 1, "unit": "liters", "expiry_date": None}
+        db.batch.assert_not_called()
+
+    def test_commit_imports_in_the_same_request(self, scan, db):
+        col = db.collection().document().collection()
+        col.select().stream.return_value.__aiter__.return_value = [_make_doc("milk-1", {"name": "milk", "unit": "liters"})]
+        col.document.side_effect = lambda item_id=None: MagicMock(id=item_id or "new-0")
+        db.batch().commit = AsyncMock()
+        resp = scan("?commit=true")
+        assert resp.status_code == 200, resp.text
+        # The unusable item is dropped; the rest merge into the pantry
+        assert [(r["name"], r["status"], r["id"]) for r in resp.json()] == [("Milk", "merged", "milk-1")]
+        db.batch().commit.assert_awaited_once()
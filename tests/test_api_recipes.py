@@ -0,0 +1,245 @@
+"""
+Integration tests for the recipe suggestion endpoint's per-user cache.
+The recipe agent, quota check and Firestore are mocked.
+"""
+import pytest
+from collections import OrderedDict
+from unittest.mock import AsyncMock, MagicMock, patch
+from fastapi.testclient import TestClient
+
+
+MOCK_USER = {"uid": "test-uid-123", "email": "test@example.com"}
+AUTH_HEADER = {"Authorization": "Bearer fake-token"}
+
+RECIPE = {
+    "name": "Omelette",
+    "reasoning": "Uses the eggs",
+    "missing_ingredients": [],
+    "instructions": ["Whisk 3 eggs", "Cook for 4 minutes"],
+    "estimated_calories": 300,
+    "estimated_protein": 20,
+    "servings": 1,
+    "cost_per_dish": 2.5,
+}
+
+
+@pytest.fixture(scope="module")
+def app():
+    with patch("firebase_admin_setup.init_firebase"), \
+         patch("firebase_admin.auth.verify_id_token", return_value=MOCK_USER):
+        import sys
+        for mod in list(sys.modules.keys()):
+            if mod.startswith(("routers", "main", "dependencies", "firestore_db", "limiter", "storage")):
+                sys.modules.pop(mod, None)
+        from main import app as _app
+        return _app
+
+
+@pytest.fixture
+def db():
+    return MagicMock()
+
+
+@pytest.fixture
+def client(app, db):
+    from firestore_db import get_async_firestore
+    from dependencies import get_current_user
+    import recipe_cache
+    recipe_cache.suggestion_cache.clear()
+    app.dependency_overrides[get_async_firestore] = lambda: db
+    app.dependency_overrides[get_current_user] = lambda: MOCK_USER
+    with TestClient(app, raise_server_exceptions=False) as c:
+        yield c
+    app.dependency_overrides.clear()
+
+
+def _make_doc(data):
+    doc = MagicMock()
+    doc.to_dict.return_value = data
+    return doc
+
+
+def _pantry_docs():
+    return [
+        _make_doc({"name": "Eggs", "quantity": 6, "unit": "count"}),
+        _make_doc({"name": "Milk", "quantity": 1.0, "unit": "liters"}),
+    ]
+
+
+@pytest.fixture
+def agent(monkeypatch, db):
+    from routers import recipes
+    calls = []
+
+    async def fake_suggest(items, preferences, time_of_day):
+        calls.append(items)
+        return [RECIPE]
+
+    monkeypatch.setattr(recipes.recipe_agent, "suggest_recipes_async", fake_suggest)
+    quota = AsyncMock()
+    monkeypatch.setattr(recipes, "_enforce_quota", quota)
+    monkeypatch.setattr(recipes, "get_user_tier", AsyncMock(return_value="free"))
+    db.collection().document().collection().select().stream.return_value.__aiter__.return_value = _pantry_docs()
+    return calls, quota
+
+
+class TestRecipeSuggestionCache:
+    def test_repeat_request_is_cached_and_free(self, client, agent):
+        calls, quota = agent
+        body = {"preferences": "vegetarian", "time_of_day": "dinner"}
+        first = client.post("/agents/recipe/suggest", json=body, headers=AUTH_HEADER)
+        second = client.post(
+            "/agents/recipe/suggest",
+            json={"preferences": "  Vegetarian ", "time_of_day": "DINNER"},
+            headers=AUTH_HEADER,
+        )
+        assert first.status_code == second.status_code == 200
+        assert second.json() == first.json()
+        assert len(calls) == 1
+        assert quota.call_count == 1
+
+    def test_pantry_read_is_projected(self, client, db, agent):
+        client.post("/agents/recipe/suggest", json={}, headers=AUTH_HEADER)
+        db.collection().document().collection().select.assert_called_with(["name", "quantity", "unit"])
+
+    def test_pantry_mutation_invalidates(self, client, db, agent):
+        calls, quota = agent
+        doc_ref = MagicMock()
+        doc_ref.id = "new-item"
+        db.collection().document().collection().add = AsyncMock(return_value=(None, doc_ref))
+        client.post("/agents/recipe/suggest", json={}, headers=AUTH_HEADER)
+        resp = client.post("/pantry", json={"name": "Rice", "quantity": 1, "unit": "kg"}, headers=AUTH_HEADER)
+        assert resp.status_code == 201
+        client.post("/agents/recipe/suggest", json={}, headers=AUTH_HEADER)
+        assert len(calls) == 2
+        assert quota.call_count == 2
+
+    def test_stream_replays_cached_suggestions(self, client, agent):
+        calls, quota = agent
+        client.post("/agents/recipe/suggest", json={}, headers=AUTH_HEADER)
+        resp = client.post("/agents/recipe/suggest/stream", json={}, headers=AUTH_HEADER)
+        assert resp.status_code == 200
+        assert "event: recipe" in resp.text and "event: done" in resp.text
+        assert len(calls) == 1
+        assert quota.call_count == 1
+
+
+class TestConcurrentReads:
+    def test_pantry_and_tier_are_read_together(self, app, monkeypatch):
+        import asyncio
+        from routers import recipes
+        started = {"pantry": asyncio.Event(), "tier": asyncio.Event()}
+
+        # Each read waits for the other to start, so running them in turn times out
+        async def fake_pantry(uid):
+            started["pantry"].set()
+            await asyncio.wait_for(started["tier"].wait(), 1)
+            return []
+
+        async def fake_tier(uid, store):
+            started["tier"].set()
+            await asyncio.wait_for(started["pantry"].wait(), 1)
+            return "pro"
+
+        store = MagicMock()
+        store.pantry.prompt_items = fake_pantry
+        monkeypatch.setattr(recipes, "get_user_tier", fake_tier)
+        assert asyncio.run(recipes._load_pantry_and_tier(store, "u1")) == [[], "pro"]
+
+
+class TestPantryFingerprint:
+    def test_stable_under_order_whitespace_and_case(self):
+        from recipe_cache import pantry_fingerprint
+        a = [{"name": "Eggs", "quantity": 6, "unit": "count"}, {"name": "Milk", "quantity": 1, "unit": "liters"}]
+        b = [{"name": " milk ", "quantity": 1.0, "unit": "Liters"}, {"name": "EGGS", "quantity": "6", "unit": "count"}]
+        assert pantry_fingerprint(a, "Vegetarian", "") == pantry_fingerprint(b, " vegetarian", None)
+        assert pantry_fingerprint(a, "", "") != pantry_fingerprint(a[:1], "", "")
+        assert pantry_fingerprint(a, "", "") != pantry_fingerprint(a, "vegan", "")
+
+
+@pytest.fixture
+def precomputer(monkeypatch):
+    import recipe_precompute
+    calls = []
+
+    def fake_suggest(items, preferences, time_of_day):
+        calls.append(items)
+        return [RECIPE]
+
+    worker = recipe_precompute.RecipePrecomputer(recipe_precompute.precompute_suggestions, debounce_seconds=0)
+    monkeypatch.setattr(recipe_precompute, "precomputer", worker)
+    monkeypatch.setattr(recipe_precompute, "_last_requests", OrderedDict())
+    monkeypatch.setattr(recipe_precompute.recipe_agent, "suggest_recipes", fake_suggest)
+    monkeypatch.setattr(recipe_precompute, "chain_healthy", lambda chain: True)
+    # The background job reads the pantry with the sync client
+    from storage.firestore_store import FirestoreStorage
+    sync_db = MagicMock()
+    sync_db.collection().document().collection().select().stream.side_effect = lambda: iter(_pantry_docs())
+    monkeypatch.setattr(recipe_precompute, "background_storage", lambda: FirestoreStorage(None, sync_client=lambda: sync_db))
+    return worker, calls
+
+
+class TestRecipePrecompute:
+    def test_pantry_change_precomputes_next_suggestion(self, client, db, agent, precomputer):
+        calls, quota = agent
+        worker, background_calls = precomputer
+        doc_ref = MagicMock()
+        doc_ref.id = "new-item"
+        db.collection().document().collection().add = AsyncMock(return_value=(None, doc_ref))
+        client.post("/agents/recipe/suggest", json={"preferences": "quick"}, headers=AUTH_HEADER)
+        client.post("/pantry", json={"name": "Rice", "quantity": 1, "unit": "kg"}, headers=AUTH_HEADER)
+        assert worker.wait_idle(5)
+        resp = client.post("/agents/recipe/suggest", json={"preferences": "quick"}, headers=AUTH_HEADER)
+        assert resp.status_code == 200
+        assert resp.json()[0]["name"] == "Omelette"
+        assert len(calls) == 1 and len(background_calls) == 1
+        # The first use of a precomputed result is charged; replays are not
+        assert quota.call_count == 2
+        client.post("/agents/recipe/suggest", json={"preferences": "quick"}, headers=AUTH_HEADER)
+        assert quota.call_count == 2
+        stats = worker.stats()
+        assert stats["computed"] == 1 and stats["served"] == 1 and stats["hit_rate"] == 1.0
+
+    def test_skips_users_who_never_asked(self, client, db, agent, precomputer):
+        worker, background_calls = precomputer
+        db.collection().document().collection().document().delete = AsyncMock()
+        client.delete("/pantry/item-1", headers=AUTH_HEADER)
+        assert worker.wait_idle(5)
+        assert background_calls == []
+        assert worker.stats()["skipped"] == 1
+
+
+class TestRecipePrecomputer:
+    def test_coalesces_bounds_and_caps_concurrency(self):
+        import threading
+        from recipe_precompute import RecipePrecomputer
+        release = threading.Event()
+        lock = threading.Lock()
+        running, peak, seen = [0], [0], []
+
+        def job(uid):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+                seen.append(uid)
+            release.wait(5)
+            with lock:
+                running[0] -= 1
+            return True
+
+        worker = RecipePrecomputer(job, debounce_seconds=0.05, max_pending=3, concurrency=2)
+        assert worker.schedule("a") and worker.schedule("a")
+        assert worker.schedule("b") and worker.schedule("c")
+        assert not worker.schedule("d")  # queue full
+        release.set()
+        assert worker.wait_idle(5)
+        stats = worker.stats()
+        assert sorted(seen) == ["a", "b", "c"]
+        assert peak[0] <= 2
+        assert (stats["scheduled"], stats["coalesced"], stats["dropped"], stats["computed"]) == (3, 1, 1, 3)
+
+    def test_disabled_does_nothing(self):
+        from recipe_precompute import RecipePrecomputer
+        worker = RecipePrecomputer(lambda uid: True, enabled=False)
+        assert not worker.schedule("a")
+        assert worker.stats()["scheduled"] == 0
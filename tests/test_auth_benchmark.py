@@ -0,0 +1,60 @@
+"""
+Benchmarks for per-request auth overhead in dependencies.get_current_user:
+RS256 ID-token verification on every call versus the verified-token cache.
+The Firebase verifier is replaced by google.auth's JWT decode against a
+locally generated key, which is the same signature check without the
+network key fetch.
+
+    pytest tests/test_auth_benchmark.py --benchmark-only
+"""
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from google.auth import crypt, jwt
+
+import dependencies
+
+_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+_PRIVATE_PEM = _KEY.private_bytes(
+    serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption(),
+)
+_PUBLIC_PEM = _KEY.public_key().public_bytes(
+    serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo,
+)
+_TOKEN = jwt.encode(
+    crypt.RSASigner.from_string(_PRIVATE_PEM, key_id="k1"),
+    {"uid": "bench-user", "sub": "bench-user", "aud": "nutrai", "iat": int(time.time()), "exp": int(time.time()) + 3600},
+).decode("ascii")
+
+
+def _verify_id_token(token, check_revoked=False):
+    return jwt.decode(token, certs={"k1": _PUBLIC_PEM}, audience="nutrai")
+
+
+@pytest.fixture
+def creds(monkeypatch):
+    monkeypatch.setattr(dependencies.firebase_auth, "verify_id_token", _verify_id_token)
+    dependencies.token_cache.clear()
+    c = MagicMock()
+    c.credentials = _TOKEN
+    yield c
+    dependencies.token_cache.clear()
+
+
+def test_auth_uncached(benchmark, creds):
+    def run():
+        dependencies.token_cache.clear()
+        return dependencies.get_current_user(creds)
+
+    assert benchmark(run)["uid"] == "bench-user"
+
+
+def test_auth_cached(benchmark, creds):
+    dependencies.get_current_user(creds)
+    assert benchmark(dependencies.get_current_user, creds)["uid"] == "bench-user"
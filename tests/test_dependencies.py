@@ -0,0 +1,119 @@
+"""
+Unit tests for the cached subscription tier lookup in dependencies.py.
+"""
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+
+@pytest.fixture
+def tiers():
+    import dependencies
+    dependencies.tier_cache.clear()
+    yield dependencies
+    dependencies.tier_cache.clear()
+
+
+def _db_with_tier(tier):
+    from storage.firestore_store import FirestoreStorage
+    db = MagicMock()
+    doc = MagicMock()
+    doc.exists = True
+    doc.to_dict.return_value = {"tier": tier}
+    db.collection().document().collection().document().get = AsyncMock(return_value=doc)
+    return FirestoreStorage(db), doc
+
+
+def _tier(tiers, store):
+    return asyncio.run(tiers.get_user_tier("u1", store))
+
+
+class TestUserTierCache:
+    def test_reads_firestore_once(self, tiers):
+        store, _ = _db_with_tier("pro")
+        reads = store.db.collection().document().collection().document().get
+        assert _tier(tiers, store) == "pro"
+        assert _tier(tiers, store) == "pro"
+        assert reads.await_count == 1
+
+    def test_invalidation_rereads(self, tiers):
+        store, doc = _db_with_tier("free")
+        assert _tier(tiers, store) == "free"
+        doc.to_dict.return_value = {"tier": "pro"}
+        assert _tier(tiers, store) == "free"
+        tiers.invalidate_user_tier("u1")
+        assert _tier(tiers, store) == "pro"
+
+    def test_snapshot_listener_evicts_changed_users(self, tiers):
+        store, doc = _db_with_tier("free")
+        _tier(tiers, store)
+        change = MagicMock()
+        change.document.reference.parent.parent.id = "u1"
+        tiers._on_subscription_change([], [change], None)
+        doc.to_dict.return_value = {"tier": "pro"}
+        assert _tier(tiers, store) == "pro"
+
+
+@pytest.fixture
+def auth(monkeypatch):
+    import dependencies
+    dependencies.token_cache.clear()
+    verify = MagicMock()
+    monkeypatch.setattr(dependencies.firebase_auth, "verify_id_token", verify)
+    yield dependencies, verify
+    dependencies.token_cache.clear()
+
+
+def _creds(token):
+    creds = MagicMock()
+    creds.credentials = token
+    return creds
+
+
+class TestIdTokenCache:
+    def test_verifies_each_token_once_until_exp(self, auth):
+        import time
+        dependencies, verify = auth
+        verify.return_value = {"uid": "u1", "exp": time.time() + 600}
+        assert dependencies.get_current_user(_creds("tok"))["uid"] == "u1"
+        assert dependencies.get_current_user(_creds("tok"))["uid"] == "u1"
+        assert verify.call_count == 1
+        dependencies.get_current_user(_creds("other"))
+        assert verify.call_count == 2
+
+    def test_expired_claims_are_not_cached(self, auth):
+        import time
+        dependencies, verify = auth
+        verify.return_value = {"uid": "u1", "exp": time.time() - 1}
+        dependencies.get_current_user(_creds("tok"))
+        dependencies.get_current_user(_creds("tok"))
+        assert verify.call_count == 2
+
+    def test_email_verification_applies_to_cached_claims(self, auth):
+        import time
+        from fastapi import HTTPException
+        dependencies, verify = auth
+        verify.return_value = {
+            "uid": "u1", "exp": time.time() + 600, "email_verified": False,
+            "firebase": {"identities": {"password": ["a@b.c"]}},
+        }
+        for _ in range(2):
+            with pytest.raises(HTTPException) as exc:
+                dependencies.get_current_user(_creds("tok"))
+            assert exc.value.status_code == 403
+        assert verify.call_count == 1
+
+    def test_revoked_token_is_rejected_on_the_next_request(self, auth, monkeypatch):
+        import time
+        from fastapi import HTTPException
+        dependencies, verify = auth
+        monkeypatch.setattr(dependencies, "CHECK_REVOKED", True)
+        verify.return_value = {"uid": "u1", "exp": time.time() + 600}
+        assert dependencies.get_current_user(_creds("tok"))["uid"] == "u1"
+        verify.side_effect = dependencies.firebase_auth.RevokedIdTokenError("Token revoked")
+        with pytest.raises(HTTPException) as exc:
+            dependencies.get_current_user(_creds("tok"))
+        assert exc.value.status_code == 401
+        assert verify.call_count == 2
+        assert verify.call_args.kwargs == {"check_revoked": True}
@@ -0,0 +1,94 @@
+"""
+Benchmarks for projected pantry reads (FirestorePantry.prompt_items_blocking,
+select name/quantity/unit) against streaming whole documents, on a
+500-item pantry. A real Firestore client talks to a local stand-in for
+the GAPIC layer that applies the query's field mask and round-trips every
+response through protobuf serialisation, so both wire size and
+deserialisation cost are measured.
+
+    pytest tests/test_firestore_benchmark.py --benchmark-only
+"""
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import firestore
+from google.cloud.firestore_v1 import _helpers
+from google.cloud.firestore_v1.types import Document, RunQueryResponse
+
+from storage.firestore_store import FirestoreStorage
+
+PANTRY_SIZE = 500
+
+
+def _pantry_item(i):
+    return {
+        "name": f"Ingredient number {i}",
+        "quantity": float(i % 7 + 1),
+        "unit": "grams",
+        "expiry_date": "2026-06-01",
+        "date_added": datetime(2026, 1, 1, tzinfo=timezone.utc),
+    }
+
+
+class _StandInFirestore:
+    """run_query over one in-memory collection, honouring select() masks."""
+
+    def __init__(self, parent, items):
+        self.items = [(f"{parent}/pantry/item-{i}", item) for i, item in enumerate(items)]
+        self.bytes_sent = 0
+
+    def run_query(self, request, **kwargs):
+        fields = [f.field_path for f in request["structured_query"].select.fields]
+        for name, item in self.items:
+            data = {k: v for k, v in item.items() if k in fields} if fields else item
+            wire = RunQueryResponse.serialize(RunQueryResponse(
+                document=Document(name=name, fields=_helpers.encode_dict(data)),
+            ))
+            self.bytes_sent += len(wire)
+            yield RunQueryResponse.deserialize(wire)
+
+
+@pytest.fixture
+def stand_in():
+    db = firestore.Client(project="bench", credentials=AnonymousCredentials())
+    parent = "projects/bench/databases/(default)/documents/users/u1"
+    server = _StandInFirestore(parent, [_pantry_item(i) for i in range(PANTRY_SIZE)])
+    api = MagicMock()
+    api.run_query = server.run_query
+    db._firestore_api_internal = api
+    return db, server
+
+
+def _load_full_documents(db, uid):
+    """The pre-projection read: every field of every document."""
+    docs = db.collection("users").document(uid).collection("pantry").stream()
+    return [
+        {"name": d.get("name"), "quantity": d.get("quantity"), "unit": d.get("unit")}
+        for doc in docs
+        for d in [doc.to_dict()]
+    ]
+
+
+def test_projection_sends_fewer_bytes(stand_in):
+    db, server = stand_in
+    full = _load_full_documents(db, "u1")
+    full_bytes, server.bytes_sent = server.bytes_sent, 0
+    projected = FirestoreStorage(None, sync_client=lambda: db).pantry.prompt_items_blocking("u1")
+    assert projected == full
+    assert server.bytes_sent < full_bytes * 0.75
+
+
+def test_pantry_full_documents(benchmark, stand_in):
+    db, _ = stand_in
+    assert len(benchmark(_load_full_documents, db, "u1")) == PANTRY_SIZE
+
+
+def test_pantry_projected(benchmark, stand_in):
+    db, _ = stand_in
+    pantry = FirestoreStorage(None, sync_client=lambda: db).pantry
+    assert len(benchmark(pantry.prompt_items_blocking, "u1")) == PANTRY_SIZE
@@ -0,0 +1,95 @@
+"""
+Round-trip budgets for the write paths: a real Firestore AsyncClient whose
+GAPIC layer is mocked and wrapped by firestore_db.count_rpcs, so the
+X-Firestore-RPCs header reports exactly what would go over the network.
+"""
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from fastapi.testclient import TestClient
+from google.api_core.exceptions import AlreadyExists, NotFound
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import firestore
+
+
+MOCK_USER = {"uid": "test-uid-123", "email": "test@example.com"}
+AUTH_HEADER = {"Authorization": "Bearer fake-token"}
+
+
+@pytest.fixture(scope="module")
+def app():
+    with patch("firebase_admin_setup.init_firebase"), \
+         patch("firebase_admin.auth.verify_id_token", return_value=MOCK_USER):
+        import sys
+        for mod in list(sys.modules.keys()):
+            if mod.startswith(("routers", "main", "dependencies", "firestore_db", "limiter", "storage")):
+                sys.modules.pop(mod, None)
+        from main import app as _app
+        return _app
+
+
+@pytest.fixture
+def api():
+    """The mocked GAPIC methods, kept unwrapped so tests can inspect calls."""
+    api = MagicMock()
+    for name in ("commit", "batch_get_documents", "run_query"):
+        setattr(api, name, AsyncMock())
+    api.commit.return_value.write_results = [MagicMock()]
+    return api
+
+
+@pytest.fixture
+def client(app, api):
+    from firestore_db import count_rpcs, get_async_firestore
+    from dependencies import get_current_user
+    gapic = MagicMock()
+    for name in ("commit", "batch_get_documents", "run_query"):
+        setattr(gapic, name, getattr(api, name))
+    count_rpcs(gapic)
+    db = firestore.AsyncClient(project="test", credentials=AnonymousCredentials())
+    db._firestore_api_internal = gapic
+    app.dependency_overrides[get_async_firestore] = lambda: db
+    app.dependency_overrides[get_current_user] = lambda: MOCK_USER
+    with TestClient(app, raise_server_exceptions=False) as c:
+        yield c
+    app.dependency_overrides.clear()
+
+
+def _rpcs(resp) -> int:
+    return int(resp.headers["X-Firestore-RPCs"])
+
+
+class TestSingleRoundTripDeletes:
+    @pytest.mark.parametrize("path", ["/pantry/item-1", "/recipes/saved/recipe-1"])
+    def test_delete_is_one_conditional_commit(self, client, api, path):
+        resp = client.delete(path, headers=AUTH_HEADER)
+        assert resp.status_code == 204
+        assert _rpcs(resp) == 1
+        write = api.commit.call_args.kwargs["request"]["writes"][0]
+        assert write.current_document.exists is True
+
+    @pytest.mark.parametrize("path", ["/pantry/missing", "/recipes/saved/missing"])
+    def test_missing_document_is_404(self, client, api, path):
+        api.commit.side_effect = NotFound("no document")
+        resp = client.delete(path, headers=AUTH_HEADER)
+        assert resp.status_code == 404
+        assert _rpcs(resp) == 1
+
+
+class TestWebhookIdempotency:
+    def test_duplicate_event_costs_one_round_trip(self, client, api):
+        from routers import payments
+        event = {"id": "evt_1", "type": "checkout.session.completed", "data": {"object": {}}}
+        api.commit.side_effect = AlreadyExists("exists")
+        with patch.object(payments.stripe.Webhook, "construct_event", return_value=event):
+            resp = client.post("/payments/webhook", content=b"{}", headers={"stripe-signature": "sig"})
+        assert resp.status_code == 200
+        assert _rpcs(resp) == 1
+        api.batch_get_documents.assert_not_called()
+
+
+class TestRpcStats:
+    def test_recorded_per_route(self, client):
+        from firestore_db import rpc_stats
+        client.delete("/pantry/item-1", headers=AUTH_HEADER)
+        stats = rpc_stats()["DELETE /pantry/{item_id}"]
+        assert stats["requests"] >= 1 and stats["max_rpcs"] >= 1
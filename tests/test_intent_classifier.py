@@ -0,0 +1,66 @@
+"""
+Unit tests for the local intent classifier and the orchestrator bypass.
+"""
+import pytest
+
+from agents.intent_classifier import classify_for_bypass, get_classifier
+
+
+class TestIntentClassifier:
+    @pytest.mark.parametrize("message,intent", [
+        ("I had 2 eggs and toast", "log_nutrition"),
+        ("what can I cook tonight", "suggest_recipe"),
+        ("scan my receipt", "vision_scan"),
+        ("hello!", "general_chat"),
+    ])
+    def test_obvious_messages(self, message, intent):
+        assert get_classifier().classify(message)[0] == intent
+
+    @pytest.mark.parametrize("message", [
+        # Not in intent_examples.jsonl: near misses of its general_chat examples
+        "I had a rough week",
+        "did I eat enough vitamins yesterday?",
+        "I ate way too fast, I feel sick",
+        "Are scandinavian breads healthy?",
+        "that plan is a recipe for failure",
+    ])
+    def test_lookalikes_go_to_the_llm(self, message):
+        assert classify_for_bypass(message) is None
+
+    @pytest.mark.parametrize("message", ["I had a kebab on the way home", "I ate two slices of pizza", "scanned my receipt"])
+    def test_rules_still_bypass(self, message):
+        assert classify_for_bypass(message) is not None
+
+    def test_general_chat_never_bypasses(self):
+        assert classify_for_bypass("hello!", threshold=0.0) is None
+
+    def test_threshold_above_one_disables_bypass(self):
+        assert classify_for_bypass("I had 2 eggs and toast", threshold=1.01) is None
+
+
+class TestOrchestratorBypass:
+    def test_skips_llm_for_confident_intent(self, monkeypatch):
+        from agents import orchestrator_agent, utils
+        monkeypatch.setattr(orchestrator_agent, "API_KEY", "test-key")
+
+        def fail(*args, **kwargs):
+            raise AssertionError("LLM should not be called")
+        monkeypatch.setattr(utils.genai, "GenerativeModel", fail)
+
+        result = orchestrator_agent.process_chat("I just ate a chicken salad for lunch")
+        assert result["intent"] == "log_nutrition"
+        assert result["extracted_data"] == "I just ate a chicken salad for lunch"
+
+    def test_meal_logging_goes_to_the_combined_call(self, monkeypatch):
+        from agents import orchestrator_agent
+        monkeypatch.setattr(orchestrator_agent, "API_KEY", "test-key")
+        calls = []
+
+        def combined(prompt, **kwargs):
+            calls.append(kwargs["response_schema"])
+            raise RuntimeError("no model in tests")
+        monkeypatch.setattr(orchestrator_agent, "generate_with_fallback", combined)
+
+        result = orchestrator_agent.process_chat("I just ate a chicken salad for lunch", include_nutrition=True)
+        assert calls == [orchestrator_agent._CHAT_WITH_NUTRITION_SCHEMA]
+        assert "nutrition" not in result
@@ -0,0 +1,198 @@
+"""
+Tests for memory_firestore: a real firestore.Client / AsyncClient running on
+the in-memory backend, plus racing free-tier quota increments through the
+recipe suggestion endpoint.
+"""
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+from unittest.mock import patch
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from google.cloud.firestore_v1 import Increment, transactional
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+import memory_firestore
+
+MOCK_USER = {"uid": "test-uid-123", "email": "test@example.com"}
+
+
+@pytest.fixture
+def memory():
+    return memory_firestore.MemoryFirestore()
+
+
+@pytest.fixture
+def db(memory):
+    return memory_firestore.client(memory)
+
+
+class TestWrites:
+    def test_set_merge_update_and_increment(self, db):
+        ref = db.collection("users").document("u1")
+        ref.set({"name": "Ada", "stats": {"meals": 1}})
+        ref.set({"stats": {"calories": 300}}, merge=True)
+        ref.update({"stats.meals": Increment(2), "score": Increment(1.5)})
+        assert ref.get().to_dict() == {"name": "Ada", "stats": {"meals": 3, "calories": 300}, "score": 1.5}
+        ref.set({"name": "Bob"})
+        assert ref.get().to_dict() == {"name": "Bob"}
+
+    def test_preconditions(self, db):
+        ref = db.collection("pantry").document("p1")
+        with pytest.raises(NotFound):
+            ref.update({"quantity": 1})
+        with pytest.raises(NotFound):
+            ref.delete(option=db.write_option(exists=True))
+        ref.create({"quantity": 1})
+        with pytest.raises(AlreadyExists):
+            ref.create({"quantity": 2})
+        stale = ref.get().update_time
+        ref.update({"quantity": 3})
+        with pytest.raises(FailedPrecondition):
+            ref.delete(option=db.write_option(last_update_time=stale))
+        ref.delete(option=db.write_option(last_update_time=ref.get().update_time))
+        assert not ref.get().exists
+
+    def test_batch_is_all_or_nothing(self, db):
+        batch = db.batch()
+        batch.set(db.collection("logs").document("a"), {"n": 1})
+        batch.update(db.collection("logs").document("missing"), {"n": 1})
+        with pytest.raises(NotFound):
+            batch.commit()
+        assert not db.collection("logs").document("a").get().exists
+
+    def test_subcollections(self, db):
+        user = db.collection("users").document("u1")
+        user.collection("pantry").add({"name": "Eggs"})
+        user.collection("usage").document("2026-03-01").set({"recipe_suggest": 1})
+        assert sorted(c.id for c in user.collections()) == ["pantry", "usage"]
+        # The user document itself was never written but still lists, as in Firestore
+        assert [d.id for d in db.collection("users").list_documents()] == ["u1"]
+        assert not user.get().exists
+
+
+class TestQueries:
+    @pytest.fixture
+    def logs(self, db):
+        logs = db.collection("users").document("u1").collection("nutrition_logs")
+        for i, day in enumerate(["2026-03-03", "2026-03-01", "2026-03-02", "2026-03-05", "2026-03-04"]):
+            logs.document(f"log-{i}").set({"date": day, "calories": 100 * i})
+        logs.document("undated").set({"calories": 1})
+        return logs
+
+    def test_order_limit_offset_and_missing_fields(self, logs):
+        dates = [d.get("date") for d in logs.order_by("date", direction="DESCENDING").limit(3).stream()]
+        assert dates == ["2026-03-05", "2026-03-04", "2026-03-03"]
+        # Ordering by a field leaves out documents that do not have it
+        assert len(list(logs.order_by("date").stream())) == 5
+        assert [d.get("date") for d in logs.order_by("date").offset(3).stream()] == ["2026-03-04", "2026-03-05"]
+
+    def test_range_filters_and_cursors(self, logs):
+        query = logs.where(filter=FieldFilter("date", ">=", "2026-03-02")).where(
+            filter=FieldFilter("date", "<=", "2026-03-04"),
+        ).order_by("date")
+        first = list(query.limit(2).stream())
+        assert [d.get("date") for d in first] == ["2026-03-02", "2026-03-03"]
+        rest = list(query.start_after(first[-1]).stream())
+        assert [d.get("date") for d in rest] == ["2026-03-04"]
+        assert [d.id for d in logs.order_by("__name__").start_after({"__name__": "log-3"}).stream()] == ["log-4", "undated"]
+
+    def test_projection_and_collection_group(self, db, logs):
+        assert [d.to_dict() for d in logs.select(["date"]).limit(1).stream()] == [{"date": "2026-03-03"}]
+        assert [d.to_dict() for d in logs.select([]).limit(1).stream()] == [{}]
+        db.collection("users").document("u2").collection("nutrition_logs").add({"date": "2026-03-01"})
+        group = db.collection_group("nutrition_logs").where(filter=FieldFilter("date", "==", "2026-03-01"))
+        assert sorted(d.reference.parent.parent.id for d in group.stream()) == ["u1", "u2"]
+
+
+class TestTransactions:
+    def test_racing_increments_are_serialised(self, db):
+        ref = db.collection("usage").document("today")
+
+        @transactional
+        def bump(transaction, ref):
+            snapshot = ref.get(transaction=transaction)
+            current = snapshot.get("count") if snapshot.exists else 0
+            time.sleep(0.001)  # widen the read-modify-write window
+            transaction.set(ref, {"count": current + 1}, merge=True)
+
+        threads = [threading.Thread(target=bump, args=(db.transaction(), ref)) for _ in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert ref.get().get("count") == 20
+
+    def test_outside_write_aborts_and_retries(self, db):
+        ref = db.collection("usage").document("today")
+        ref.set({"count": 0})
+        attempts = []
+
+        @transactional
+        def bump(transaction, ref):
+            snapshot = ref.get(transaction=transaction)
+            if not attempts:
+                ref.update({"count": Increment(10)})  # lands between the read and the commit
+            attempts.append(snapshot.get("count"))
+            transaction.update(ref, {"count": snapshot.get("count") + 1})
+
+        bump(db.transaction(), ref)
+        assert attempts == [0, 10]
+        assert ref.get().get("count") == 11
+
+
+def test_rpc_latency_is_injected():
+    db = memory_firestore.client(memory_firestore.MemoryFirestore(latency=0.05))
+    start = time.perf_counter()
+    db.collection("users").document("u1").get()
+    assert time.perf_counter() - start >= 0.05
+
+
+# ── Racing the free-tier quota through the endpoint ─────────────────────────
+
+@pytest.fixture(scope="module")
+def app():
+    with patch("firebase_admin_setup.init_firebase"), \
+         patch("firebase_admin.auth.verify_id_token", return_value=MOCK_USER):
+        import sys
+        for mod in list(sys.modules.keys()):
+            if mod.startswith(("routers", "main", "dependencies", "firestore_db", "limiter", "storage")):
+                sys.modules.pop(mod, None)
+        from main import app as _app
+        return _app
+
+
+def test_concurrent_free_tier_requests_respect_the_quota(app, memory, monkeypatch):
+    from firestore_db import get_async_firestore
+    from dependencies import get_current_user, tier_cache
+    from routers import recipes
+    import recipe_cache
+
+    async def fake_suggest(items, preferences, time_of_day):
+        await asyncio.sleep(0.01)
+        return []
+
+    monkeypatch.setattr(recipes.recipe_agent, "suggest_recipes_async", fake_suggest)
+    tier_cache.clear()
+    recipe_cache.suggestion_cache.clear()
+    async_db = memory_firestore.async_client(memory)
+    app.dependency_overrides[get_async_firestore] = lambda: async_db
+    app.dependency_overrides[get_current_user] = lambda: MOCK_USER
+
+    async def race(n):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            # Distinct preferences so no request is answered from the suggestion cache
+            return await asyncio.gather(*(
+                client.post("/agents/recipe/suggest", json={"preferences": f"p{i}"}) for i in range(n)
+            ))
+
+    try:
+        statuses = sorted(r.status_code for r in asyncio.run(race(8)))
+    finally:
+        app.dependency_overrides.clear()
+    assert statuses == [200] * recipes.FREE_DAILY_LIMIT + [403] * (8 - recipes.FREE_DAILY_LIMIT)
+    usage = memory_firestore.client(memory).collection("users").document(MOCK_USER["uid"]).collection("usage")
+    assert [d.get("recipe_suggest") for d in usage.stream()] == [recipes.FREE_DAILY_LIMIT]
@@ -0,0 +1,54 @@
+"""
+Benchmarks for local reads on the SQLite storage backend: a 50-item pantry
+for the recipe prompt, one page of nutrition logs and a month of daily
+totals, each served from a WAL-mode database on disk with no network hop.
+
+    pytest tests/test_sqlite_benchmark.py --benchmark-only
+"""
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from storage.sqlite_store import SQLiteStorage
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    store = SQLiteStorage(str(tmp_path_factory.mktemp("bench") / "grocery.db"))
+    for i in range(50):
+        asyncio.run(store.pantry.create("u1", {"name": f"Ingredient {i}", "quantity": i % 7 + 1, "unit": "grams"}))
+    for i in range(90):
+        day = str(date(2026, 1, 1) + timedelta(days=i // 3))
+        log = {"meal_name": f"Meal {i}", "calories": 500, "protein": 20, "carbs": 60, "fat": 15, "date": day}
+        asyncio.run(store.nutrition.add("u1", log))
+    return store
+
+
+def _result(coro):
+    """Runs a read coroutine that never suspends (SQLite reads do not), without an event loop's overhead."""
+    try:
+        coro.send(None)
+    except StopIteration as done:
+        return done.value
+    raise AssertionError("read suspended")
+
+
+def test_pantry_prompt_items(benchmark, store):
+    assert len(benchmark(store.pantry.prompt_items_blocking, "u1")) == 50
+
+
+def test_nutrition_page(benchmark, store):
+    def page():
+        return _result(store.nutrition.list("u1", 20, None, from_="2026-01-10"))
+
+    assert len(benchmark(page).items) == 20
+
+
+def test_daily_totals_for_a_month(benchmark, store):
+    def month():
+        return _result(store.nutrition.daily_totals("u1", "2026-01-01", "2026-01-31"))
+
+    assert len(benchmark(month)) == 30
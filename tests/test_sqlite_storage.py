@@ -0,0 +1,208 @@
+"""
+Tests for the SQLite storage backend (storage.sqlite_store): repository
+semantics on a temporary database, grocery.db compatibility, racing usage
+increments, and the pantry and quota endpoints running on it.
+"""
+import asyncio
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+from storage.sqlite_store import SQLiteStorage
+
+MOCK_USER = {"uid": "test-uid-123", "email": "test@example.com"}
+AUTH_HEADER = {"Authorization": "Bearer fake-token"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteStorage(str(tmp_path / "grocery.db"))
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestSchema:
+    def test_opens_the_shipped_grocery_db(self, tmp_path):
+        path = tmp_path / "grocery.db"
+        shutil.copy(Path(__file__).parent.parent / "grocery.db", path)
+        store = SQLiteStorage(str(path))
+        assert store.connection().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        columns = {row["name"] for row in store.query("PRAGMA table_info(user_subscriptions)")}
+        assert "granted_manually" in columns
+        indexes = {row["name"] for row in store.query("PRAGMA index_list(nutrition_log)")}
+        assert "ix_nutrition_log_user_date" in indexes
+
+    def test_nutrition_range_reads_use_the_user_date_index(self, store):
+        plan = store.query(
+            "EXPLAIN QUERY PLAN SELECT id FROM nutrition_log WHERE user_id = ? AND date >= ? ORDER BY date DESC",
+            ("u1", "2026-03-01"),
+        )
+        assert any("ix_nutrition_log_user_date" in row["detail"] for row in plan)
+
+
+class TestPantry:
+    def test_crud_is_scoped_to_the_user(self, store):
+        item = run(store.pantry.create("u1", {"name": "Eggs", "quantity": 6, "unit": "count", "expiry_date": None}))
+        assert isinstance(item["id"], str) and item["date_added"]
+        assert run(store.pantry.update("u2", item["id"], {"quantity": 1})) is None
+        updated = run(store.pantry.update("u1", item["id"], {"quantity": 4, "user_id": "u2"}))
+        assert updated["quantity"] == 4 and updated["name"] == "Eggs"
+        assert store.pantry.prompt_items_blocking("u1") == [{"name": "Eggs", "quantity": 4, "unit": "count"}]
+        assert not run(store.pantry.delete("u2", item["id"]))
+        assert run(store.pantry.delete("u1", item["id"]))
+        assert not run(store.pantry.delete("u1", item["id"]))
+        assert not run(store.pantry.delete("u1", "not-a-number"))
+
+    def test_import_merges_into_existing_items(self, store):
+        eggs = run(store.pantry.create("u1", {"name": "Eggs", "quantity": 6, "unit": "count"}))
+        results = run(store.pantry.import_items("u1", [
+            {"name": " eggs", "quantity": 6, "unit": "Count"},
+            {"name": "Rice", "quantity": 1, "unit": "kg"},
+            {"name": "rice", "quantity": 0.5, "unit": "KG"},
+        ]))
+        assert [(r["status"], r["id"]) for r in results] == [
+            ("merged", eggs["id"]), ("created", results[1]["id"]), ("merged", results[1]["id"]),
+        ]
+        assert store.pantry.prompt_items_blocking("u1") == [
+            {"name": "Eggs", "quantity": 12, "unit": "count"},
+            {"name": "Rice", "quantity": 1.5, "unit": "kg"},
+        ]
+
+    def test_pages_follow_the_token(self, store):
+        for i in range(5):
+            run(store.pantry.create("u1", {"name": f"Item {i}", "quantity": 1, "unit": "kg"}))
+        first = run(store.pantry.list("u1", 3, None))
+        rest = run(store.pantry.list("u1", 3, first.next_page_token))
+        assert [i["name"] for i in first.items + rest.items] == [f"Item {i}" for i in range(5)]
+        assert rest.next_page_token is None
+
+
+class TestNutrition:
+    def _log(self, day, calories):
+        return {"meal_name": "Meal", "calories": calories, "protein": 1, "carbs": 2, "fat": 3, "date": day}
+
+    def test_newest_first_with_filters_and_pages(self, store):
+        for day in ["2026-03-01", "2026-03-03", "2026-03-02", "2026-03-03"]:
+            run(store.nutrition.add("u1", self._log(day, 100)))
+        first = run(store.nutrition.list("u1", 2, None, from_="2026-03-02"))
+        assert [log["date"] for log in first.items] == ["2026-03-03", "2026-03-03"]
+        rest = run(store.nutrition.list("u1", 2, first.next_page_token, from_="2026-03-02"))
+        assert [log["date"] for log in rest.items] == ["2026-03-02"]
+        assert rest.next_page_token is None
+
+    def test_daily_totals_follow_adds_and_deletes(self, store):
+        a = run(store.nutrition.add("u1", self._log("2026-03-02", 300)))
+        run(store.nutrition.add("u1", self._log("2026-03-02", 200)))
+        run(store.nutrition.add("u2", self._log("2026-03-02", 999)))
+        totals = run(store.nutrition.daily_totals("u1", "2026-03-01", "2026-03-03"))
+        assert totals["2026-03-02"]["calories"] == 500 and totals["2026-03-02"]["meals"] == 2
+        assert run(store.nutrition.delete("u1", a["id"]))
+        assert run(store.nutrition.get("u1", a["id"])) is None
+        assert run(store.nutrition.daily_totals("u1", "2026-03-02", "2026-03-02"))["2026-03-02"]["meals"] == 1
+
+
+class TestUsageAndSubscriptions:
+    def test_racing_increments_are_all_counted(self, store):
+        def bump():
+            for _ in range(25):
+                run(store.usage.increment("u1", "2026-03-02", "recipe_suggest"))
+
+        threads = [threading.Thread(target=bump) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        run(store.usage.decrement("u1", "2026-03-02", "recipe_suggest"))
+        assert run(store.usage.increment("u1", "2026-03-02", "recipe_suggest")) == 100
+
+    def test_stripe_lifecycle_and_webhook_claims(self, store):
+        assert run(store.subscriptions.get_tier("u1")) == "free"
+        assert run(store.subscriptions.claim_webhook_event("evt_1", "checkout.session.completed"))
+        assert not run(store.subscriptions.claim_webhook_event("evt_1", "checkout.session.completed"))
+        run(store.subscriptions.activate("u1", "cus_1", "sub_1"))
+        assert run(store.subscriptions.get_tier("u1")) == "pro"
+        assert run(store.subscriptions.cancel("sub_1")) == "u1"
+        assert run(store.subscriptions.cancel("sub_1")) is None
+        assert run(store.subscriptions.get_tier("u1")) == "free"
+        run(store.subscriptions.set_tier("u1", "pro", granted_manually=True))
+        assert run(store.subscriptions.get_tier("u1")) == "pro"
+
+    def test_delete_user_data(self, store):
+        run(store.pantry.create("u1", {"name": "Eggs", "quantity": 6, "unit": "count"}))
+        run(store.saved_recipes.save("u1", {"name": "Omelette", "saved_at": "2026-03-02T08:00:00+00:00"}))
+        run(store.pantry.create("u2", {"name": "Rice", "quantity": 1, "unit": "kg"}))
+        assert "pantry" in run(store.user_collections("u1"))
+        assert run(store.delete_user_collection("u1", "pantry")) == 1
+        assert run(store.delete_user_collection("u1", "saved_recipes")) == 1
+        assert run(store.delete_user_collection("u1", "saved_recipes")) == 0
+        assert store.pantry.prompt_items_blocking("u1") == []
+        assert run(store.saved_recipes.list("u1", 10, None)).items == []
+        assert len(store.pantry.prompt_items_blocking("u2")) == 1
+
+    def test_connections_are_per_thread(self, store):
+        conns = []
+        t = threading.Thread(target=lambda: conns.append(store.connection()))
+        t.start()
+        t.join()
+        assert conns[0] is not store.connection()
+        assert isinstance(conns[0], sqlite3.Connection)
+
+
+# ── The endpoints on SQLite ─────────────────────────────────────────────────
+
+@pytest.fixture(scope="module")
+def app():
+    with patch("firebase_admin_setup.init_firebase"), \
+         patch("firebase_admin.auth.verify_id_token", return_value=MOCK_USER):
+        import sys
+        for mod in list(sys.modules.keys()):
+            if mod.startswith(("routers", "main", "dependencies", "firestore_db", "limiter", "storage")):
+                sys.modules.pop(mod, None)
+        from main import app as _app
+        return _app
+
+
+@pytest.fixture
+def client(app, store):
+    from storage import get_storage
+    from dependencies import get_current_user, tier_cache
+    import recipe_cache
+    tier_cache.clear()
+    recipe_cache.suggestion_cache.clear()
+    app.dependency_overrides[get_storage] = lambda: store
+    app.dependency_overrides[get_current_user] = lambda: MOCK_USER
+    with TestClient(app, raise_server_exceptions=False) as c:
+        yield c
+    app.dependency_overrides.clear()
+
+
+def test_pantry_endpoints(client):
+    resp = client.post("/pantry", json={"name": "Rice", "quantity": 1, "unit": "kg", "expiry_date": "2026-06-01"}, headers=AUTH_HEADER)
+    assert resp.status_code == 201
+    item_id = resp.json()["id"]
+    assert client.put(f"/pantry/{item_id}", json={"quantity": 2}, headers=AUTH_HEADER).json()["quantity"] == 2
+    items = client.get("/pantry", headers=AUTH_HEADER).json()
+    assert [(i["name"], i["expiry_date"]) for i in items] == [("Rice", "2026-06-01")]
+    assert client.delete(f"/pantry/{item_id}", headers=AUTH_HEADER).status_code == 204
+    assert client.delete(f"/pantry/{item_id}", headers=AUTH_HEADER).status_code == 404
+
+
+def test_free_tier_quota(client, monkeypatch):
+    from routers import recipes
+
+    async def fake_suggest(items, preferences, time_of_day):
+        return []
+
+    monkeypatch.setattr(recipes.recipe_agent, "suggest_recipes_async", fake_suggest)
+    statuses = [
+        client.post("/agents/recipe/suggest", json={"preferences": f"p{i}"}, headers=AUTH_HEADER).status_code
+        for i in range(recipes.FREE_DAILY_LIMIT + 1)
+    ]
+    assert statuses == [200] * recipes.FREE_DAILY_LIMIT + [403]
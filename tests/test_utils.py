@@ -36,3 +36,716 @@ class TestCleanJsonResponse:
         import pytest
         with pytest.raises(Exception):
             clean_json_response("this is not json at all")
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.parts = [text] if text else []
+
+
+class _FakeModel:
+    calls = []
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def generate_content(self, content, request_options=None, generation_config=None):
+        _FakeModel.calls.append((self.model_name, content))
+        return _FakeResponse('{"ok": true}')
+
+    async def generate_content_async(self, content, request_options=None, generation_config=None):
+        return self.generate_content(content, request_options, generation_config)
+
+
+class _RateLimitedPrimary(_FakeModel):
+    def generate_content(self, content, request_options=None, generation_config=None):
+        if self.model_name == "gemini-2.5-flash":
+            _FakeModel.calls.append((self.model_name, content))
+            raise RuntimeError("429 ResourceExhausted")
+        return super().generate_content(content, request_options, generation_config)
+
+
+class TestResponseCache:
+    def test_lru_eviction(self):
+        from agents.cache import ResponseCache
+        cache = ResponseCache(max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == 1  # "a" is now most recently used
+        cache.put("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.stats()["evictions"] == 1
+
+    def test_ttl_expiry(self):
+        from agents.cache import ResponseCache
+        now = [0.0]
+        cache = ResponseCache(default_ttl=10, clock=lambda: now[0])
+        cache.put("a", 1)
+        cache.put("b", 2, ttl=100)
+        now[0] = 11
+        assert cache.get("a") is None
+        assert cache.get("b") == 2
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+class TestGenerateWithFallbackCache:
+    def setup_method(self):
+        from agents import utils
+        utils.response_cache.clear()
+        utils.model_router.reset()
+        _FakeModel.calls = []
+
+    def test_repeated_prompt_served_from_cache(self, monkeypatch):
+        from agents import utils
+        monkeypatch.setattr(utils.genai, "GenerativeModel", _FakeModel)
+        first = utils.generate_with_fallback("Analyze  this meal")
+        second = utils.generate_with_fallback("Analyze this meal\n")  # whitespace-normalised
+        assert first is second
+        assert len(_FakeModel.calls) == 1
+        assert utils.response_cache.stats()["hits"] == 1
+
+    def test_opt_out_and_invalidate(self, monkeypatch):
+        from agents import utils
+        monkeypatch.setattr(utils.genai, "GenerativeModel", _FakeModel)
+        utils.generate_with_fallback("prompt", use_cache=False)
+        utils.generate_with_fallback("prompt", use_cache=False)
+        assert len(_FakeModel.calls) == 2
+        utils.generate_with_fallback("prompt")
+        utils.invalidate_cached_response("prompt")
+        utils.generate_with_fallback("prompt")
+        assert len(_FakeModel.calls) == 4
+
+    def test_keyed_on_response_schema(self, monkeypatch):
+        from agents import utils
+        monkeypatch.setattr(utils.genai, "GenerativeModel", _FakeModel)
+        schema = {"type": "object", "properties": {"reply": {"type": "string"}}}
+        utils.generate_with_fallback("prompt")
+        utils.generate_with_fallback("prompt", response_schema=schema)
+        utils.generate_with_fallback("prompt", response_schema=dict(schema, required=["reply"]))
+        utils.generate_with_fallback("prompt", response_schema=schema)
+        assert len(_FakeModel.calls) == 3
+        utils.invalidate_cached_response("prompt", response_schema=schema)
+        utils.generate_with_fallback("prompt", response_schema=schema)
+        assert len(_FakeModel.calls) == 4
+        monkeypatch.setattr(utils, "_STRUCTURED_OUTPUT_ENABLED", False)
+        utils.generate_with_fallback("prompt", response_schema=schema)
+        assert len(_FakeModel.calls) == 5
+
+    def test_vision_keyed_on_image_bytes(self, monkeypatch):
+        from agents import utils
+        monkeypatch.setattr(utils.genai, "GenerativeModel", _FakeModel)
+        utils.generate_vision_with_fallback(["scan", {"mime_type": "image/jpeg", "data": b"one"}])
+        utils.generate_vision_with_fallback(["scan", {"mime_type": "image/jpeg", "data": b"one"}])
+        utils.generate_vision_with_fallback(["scan", {"mime_type": "image/jpeg", "data": b"two"}])
+        assert len(_FakeModel.calls) == 2
+
+
+class TestGenerateWithFallbackAsync:
+    def setup_method(self):
+        from agents import utils
+        utils.response_cache.clear()
+        utils.model_router.reset()
+        _FakeModel.calls = []
+
+    def test_falls_back_on_rate_limit(self, monkeypatch):
+        import asyncio
+        from agents import utils
+        monkeypatch.setattr(utils.genai, "GenerativeModel", _RateLimitedPrimary)
+        response = asyncio.run(utils.generate_with_fallback_async("prompt"))
+        assert response.text == '{"ok": true}'
+        assert [m for m, _ in _FakeModel.calls] == ["gemini-2.5-flash", "models/gemma-3-12b-it"]
+
+    def test_shares_cache_with_sync_path(self, monkeypatch):
+        import asyncio
+        from agents import utils
+        monkeypatch.setattr(utils.genai, "GenerativeModel", _FakeModel)
+        sync_response = utils.generate_with_fallback("prompt")
+        async_response = asyncio.run(utils.generate_with_fallback_async("prompt"))
+        assert sync_response is async_response
+        assert len(_FakeModel.calls) == 1
+
+
+class TestJsonArrayStreamParser:
+    RECIPES = [
+        {"name": "Omelette", "instructions": ["Whisk 3 eggs [large]", "Cook 4 min"]},
+        {"name": "Toast \"deluxe\"", "instructions": []},
+    ]
+
+    def _feed_all(self, text, step):
+        from agents.utils import JsonArrayStreamParser
+        parser = JsonArrayStreamParser()
+        out = []
+        for i in range(0, len(text), step):
+            out.extend(parser.feed(text[i:i + step]))
+        return parser, out
+
+    def test_emits_each_object_as_it_closes(self):
+        import json
+        from agents.utils import JsonArrayStreamParser
+        text = json.dumps(self.RECIPES)
+        parser = JsonArrayStreamParser()
+        first_close = text.index("]}") + 2
+        assert parser.feed(text[:first_close]) == [self.RECIPES[0]]
+        assert parser.feed(text[first_close:]) == [self.RECIPES[1]]
+        assert parser.done
+
+    def test_chunk_boundaries_do_not_matter(self):
+        import json
+        text = '<think>pick [some] recipes</think>Sure [2 ideas]:\n```json\n' + json.dumps(self.RECIPES) + '\n```'
+        for step in (1, 3, 17, len(text)):
+            parser, out = self._feed_all(text, step)
+            assert out == self.RECIPES
+            assert parser.done
+
+
+class TestSingleFlight:
+    def test_concurrent_threads_share_one_call(self):
+        import threading
+        from agents.singleflight import SingleFlight
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            release.wait(2)
+            return object()
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flights.do("k", slow))) for _ in range(5)]
+        for t in threads:
+            t.start()
+        import time
+        deadline = time.monotonic() + 2
+        while flights.stats()["coalesced"] < 4 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+        for t in threads:
+            t.join()
+        assert len(calls) == 1
+        assert all(r is results[0] for r in results)
+        assert flights.stats() == {"executions": 1, "coalesced": 4, "in_flight": 0}
+
+    def test_exception_shared_and_key_released(self):
+        import pytest
+        from agents.singleflight import SingleFlight
+        flights = SingleFlight()
+
+        def boom():
+            raise RuntimeError("upstream failed")
+        with pytest.raises(RuntimeError):
+            flights.do("k", boom)
+        assert flights.do("k", lambda: 42) == 42
+
+    def test_follower_retries_after_leaders_own_deadline(self):
+        import threading
+        import time
+        from agents.deadline import DeadlineExceeded
+        from agents.singleflight import SingleFlight
+        flights = SingleFlight(unshared=(DeadlineExceeded,))
+        release = threading.Event()
+
+        def leader():
+            release.wait(2)
+            raise DeadlineExceeded("Request deadline exceeded")
+
+        def run(fn, out):
+            try:
+                out.append(flights.do("k", fn))
+            except Exception as e:
+                out.append(e)
+
+        def wait_for(stat):
+            deadline = time.monotonic() + 2
+            while flights.stats()[stat] == 0 and time.monotonic() < deadline:
+                time.sleep(0.001)
+
+        led, followed = [], []
+        threads = [threading.Thread(target=run, args=(leader, led))]
+        threads[0].start()
+        wait_for("in_flight")
+        threads.append(threading.Thread(target=run, args=(lambda: "own answer", followed)))
+        threads[1].start()
+        wait_for("coalesced")
+        release.set()
+        for t in threads:
+            t.join()
+        assert isinstance(led[0], DeadlineExceeded)
+        assert followed == ["own answer"]
+        assert flights.stats()["executions"] == 2
+
+    def test_long_budget_follower_outlives_short_budget_leader(self, monkeypatch):
+        import asyncio
+        from agents import utils
+        from agents.deadline import DeadlineExceeded, deadline_scope
+        utils.response_cache.clear()
+        utils.model_router.reset()
+        _FakeModel.calls = []
+
+        class BudgetBoundModel(_FakeModel):
+            async def generate_content_async(self, content, request_options=None, generation_config=None):
+                await asyncio.sleep(0.05)
+                if request_options["timeout"] < 10:
+                    raise DeadlineExceeded("Request deadline exceeded")
+                return self.generate_content(content, request_options, generation_config)
+
+        monkeypatch.setattr(utils.genai, "GenerativeModel", BudgetBoundModel)
+
+        async def call(budget):
+            with deadline_scope(budget):
+                return await utils.generate_with_fallback_async("shared prompt")
+
+        async def both():
+            leader = asyncio.ensure_future(call(5))
+            await asyncio.sleep(0.01)
+            return await asyncio.gather(leader, call(60), return_exceptions=True)
+
+        short, long = asyncio.run(both())
+        assert isinstance(short, DeadlineExceeded)
+        assert long.text == '{"ok": true}'
+
+    def test_async_identical_prompts_coalesced(self, monkeypatch):
+        import asyncio
+        from agents import utils
+        utils.response_cache.clear()
+        utils.model_router.reset()
+        _FakeModel.calls = []
+
+        class SlowModel(_FakeModel):
+            async def generate_content_async(self, content, request_options=None, generation_config=None):
+                await asyncio.sleep(0.01)
+                return self.generate_content(content, request_options, generation_config)
+
+        monkeypatch.setattr(utils.genai, "GenerativeModel", SlowModel)
+        before = utils.async_flights.stats()["coalesced"]
+
+        async def burst():
+            return await asyncio.gather(*[utils.generate_with_fallback_async("same prompt") for _ in range(5)])
+
+        responses = asyncio.run(burst())
+        assert len(_FakeModel.calls) == 1
+        assert all(r is responses[0] for r in responses)
+        assert utils.async_flights.stats()["coalesced"] - before == 4
+
+
+class TestHedging:
+    def test_slow_primary_loses_to_hedge(self):
+        import time
+        from agents.hedging import HedgeStats, run_hedged
+        stats = HedgeStats()
+
+        def slow_primary():
+            time.sleep(0.3)
+            return "primary"
+
+        result = run_hedged(slow_primary, lambda: "fallback", 0.02, stats, bool, lambda e: True)
+        assert result == "fallback"
+        snap = stats.snapshot()
+        assert (snap["hedged"], snap["hedge_wins"]) == (1, 1)
+
+    def test_fast_primary_never_hedges(self):
+        from agents.hedging import HedgeStats, run_hedged
+        stats = HedgeStats()
+
+        def fallback():
+            raise AssertionError("fallback should not run")
+
+        assert run_hedged(lambda: "primary", fallback, 1.0, stats, bool, lambda e: True) == "primary"
+        assert stats.snapshot()["hedge_rate"] == 0.0
+
+    def test_async_loser_is_cancelled(self):
+        import asyncio
+        from agents.hedging import HedgeStats, run_hedged_async
+        stats = HedgeStats()
+        cancelled = []
+
+        async def slow_primary():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def fallback():
+            return "fallback"
+
+        async def main():
+            result = await run_hedged_async(slow_primary, fallback, 0.01, stats, bool, lambda e: True)
+            await asyncio.sleep(0)
+            return result
+
+        assert asyncio.run(main()) == "fallback"
+        assert cancelled == [True]
+        assert stats.snapshot()["hedge_win_rate"] == 1.0
+
+
+class TestModelRouter:
+    def test_opens_after_sustained_failures_and_reorders(self):
+        from agents.model_router import ModelRouter, OPEN
+        router = ModelRouter(failure_threshold=3)
+        for _ in range(3):
+            router.record_failure("primary")
+        assert router.state("primary") == OPEN
+        assert router.order(["primary", "fallback"]) == ["fallback", "primary"]
+        assert not router.allow("primary")
+
+    def test_half_open_probe_closes_or_reopens(self):
+        from agents.model_router import ModelRouter, CLOSED, OPEN
+        now = [0.0]
+        router = ModelRouter(failure_threshold=1, open_seconds=10, clock=lambda: now[0])
+        router.record_failure("m")
+        now[0] = 11
+        assert router.allow("m")        # the single probe
+        assert not router.allow("m")    # concurrent callers wait for it
+        router.record_failure("m")
+        assert router.state("m") == OPEN
+        now[0] = 11 + 20                 # cool-down doubled after a failed probe
+        assert router.allow("m")
+        router.record_success("m", 0.5)
+        assert router.state("m") == CLOSED
+
+    def test_open_primary_skipped_without_round_trip(self, monkeypatch):
+        from agents import utils
+        utils.response_cache.clear()
+        utils.model_router.reset()
+        _FakeModel.calls = []
+        monkeypatch.setattr(utils.genai, "GenerativeModel", _RateLimitedPrimary)
+        for i in range(utils.model_router.failure_threshold):
+            utils.generate_with_fallback(f"prompt {i}")
+        _FakeModel.calls = []
+        utils.generate_with_fallback("fresh prompt")
+        assert [m for m, _ in _FakeModel.calls] == ["models/gemma-3-12b-it"]
+        utils.model_router.reset()
+
+    def _half_open(self, monkeypatch):
+        from agents import utils
+        from agents.model_router import ModelRouter
+        now = [0.0]
+        router = ModelRouter(failure_threshold=1, open_seconds=10, clock=lambda: now[0])
+        router.record_failure("gemini-2.5-flash")
+        now[0] = 11
+        monkeypatch.setattr(utils, "model_router", router)
+        return router
+
+    def test_probe_released_when_out_of_budget(self, monkeypatch):
+        import pytest
+        from agents import utils
+        from agents.deadline import DeadlineExceeded, deadline_scope
+        router = self._half_open(monkeypatch)
+        monkeypatch.setattr(utils.genai, "GenerativeModel", _FakeModel)
+        monkeypatch.setattr(utils.deadline, "MIN_ATTEMPT_SECONDS", 100)
+        assert router.allow("gemini-2.5-flash")
+        with deadline_scope(10), pytest.raises(DeadlineExceeded):
+            utils._call_model("gemini-2.5-flash", "prompt", utils._TEXT_CHAIN.timeout)
+        assert router.allow("gemini-2.5-flash")  # not stuck behind probe_timeout
+
+    def test_probe_released_when_cancelled(self, monkeypatch):
+        import asyncio
+        from agents import utils
+        router = self._half_open(monkeypatch)
+
+        class HangingModel(_FakeModel):
+            async def generate_content_async(self, content, request_options=None, generation_config=None):
+                await asyncio.sleep(5)
+
+        monkeypatch.setattr(utils.genai, "GenerativeModel", HangingModel)
+
+        async def main():
+            assert router.allow("gemini-2.5-flash")
+            task = asyncio.ensure_future(
+                utils._call_model_async("gemini-2.5-flash", "prompt", utils._TEXT_CHAIN.timeout)
+            )
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        asyncio.run(main())
+        assert router.allow("gemini-2.5-flash")
+
+    def test_probe_released_when_stream_abandoned(self, monkeypatch):
+        import asyncio
+        from agents import utils
+        router = self._half_open(monkeypatch)
+        router.record_failure("models/gemma-3-12b-it")  # so the probe is tried first
+
+        class Chunk:
+            text = "hello"
+
+        class StreamingModel(_FakeModel):
+            async def generate_content_async(self, content, stream=False, **kwargs):
+                async def chunks():
+                    for _ in range(3):
+                        yield Chunk()
+                return chunks()
+
+        monkeypatch.setattr(utils.genai, "GenerativeModel", StreamingModel)
+
+        async def main():
+            stream = utils.stream_with_fallback_async("prompt", use_cache=False)
+            assert await stream.__anext__() == "hello"
+            await stream.aclose()  # client went away mid-stream
+
+        asyncio.run(main())
+        assert router.allow("gemini-2.5-flash")
+
+
+class TestDeadline:
+    def setup_method(self):
+        from agents import utils
+        utils.response_cache.clear()
+        utils.model_router.reset()
+        _FakeModel.calls = []
+
+    def test_call_timeout_shrinks_to_remaining_budget(self, monkeypatch):
+        from agents import utils
+        from agents.deadline import deadline_scope
+        timeouts = []
+
+        class RecordingModel(_FakeModel):
+            def generate_content(self, content, request_options=None, generation_config=None):
+                timeouts.append(request_options["timeout"])
+                return super().generate_content(content, request_options, generation_config)
+
+        monkeypatch.setattr(utils.genai, "GenerativeModel", RecordingModel)
+        with deadline_scope(10):
+            utils.generate_with_fallback("prompt", use_cache=False)
+        utils.generate_with_fallback("prompt", use_cache=False)
+        assert 9 < timeouts[0] <= 10
+        assert timeouts[1] == utils._TEXT_CHAIN.timeout
+
+    def test_no_fallback_without_budget(self, monkeypatch):
+        import pytest
+        from agents import utils
+        from agents.deadline import DeadlineExceeded, deadline_scope
+
+        class SlowRateLimitedPrimary(_RateLimitedPrimary):
+            def generate_content(self, content, request_options=None, generation_config=None):
+                monkeypatch.setattr(utils.deadline, "MIN_ATTEMPT_SECONDS", 100)
+                return super().generate_content(content, request_options, generation_config)
+
+        monkeypatch.setattr(utils.genai, "GenerativeModel", SlowRateLimitedPrimary)
+        with deadline_scope(60), pytest.raises(DeadlineExceeded):
+            utils.generate_with_fallback("prompt")
+        assert [m for m, _ in _FakeModel.calls] == ["gemini-2.5-flash"]
+
+    def test_budget_truncated_timeouts_leave_the_breaker_closed(self, monkeypatch):
+        import pytest
+        from agents import utils
+        from agents.deadline import deadline_scope
+        from agents.model_router import CLOSED
+
+        class TimingOutModel(_FakeModel):
+            def generate_content(self, content, request_options=None, generation_config=None):
+                _FakeModel.calls.append((self.model_name, content))
+                raise RuntimeError("504 Deadline Exceeded")
+
+        monkeypatch.setattr(utils.genai, "GenerativeModel", TimingOutModel)
+        for i in range(utils.model_router.failure_threshold + 1):
+            with deadline_scope(10), pytest.raises(RuntimeError):
+                utils._call_model("gemini-2.5-flash", f"prompt {i}", utils._TEXT_CHAIN.timeout)
+        assert utils.model_router.state("gemini-2.5-flash") == CLOSED
+        # With its own timeout the same failure still counts
+        for i in range(utils.model_router.failure_threshold):
+            with pytest.raises(RuntimeError):
+                utils._call_model("gemini-2.5-flash", f"prompt {i}", utils._TEXT_CHAIN.timeout)
+        assert utils.model_router.state("gemini-2.5-flash") != CLOSED
+        utils.model_router.reset()
+
+    def test_agent_retries_stop_when_budget_runs_out(self, monkeypatch):
+        import pytest
+        from agents import nutrition_agent, utils
+        from agents.deadline import DeadlineExceeded, deadline_scope
+
+        class ProseModel(_FakeModel):
+            def generate_content(self, content, request_options=None, generation_config=None):
+                _FakeModel.calls.append((self.model_name, content))
+                monkeypatch.setattr(utils.deadline, "MIN_ATTEMPT_SECONDS", 100)
+                raise RuntimeError("500 internal error")
+
+        monkeypatch.setattr(nutrition_agent, "API_KEY", "x")
+        monkeypatch.setattr(utils.genai, "GenerativeModel", ProseModel)
+        with deadline_scope(60), pytest.raises(DeadlineExceeded):
+            nutrition_agent.analyze_meal("two eggs")
+        assert len(_FakeModel.calls) == 1  # no second attempt
+
+    def test_run_with_deadline_cancels_on_disconnect(self):
+        import asyncio
+        import pytest
+        from agents.deadline import ClientDisconnected, run_with_deadline
+        cancelled = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def disconnected():
+            return True
+
+        async def main():
+            with pytest.raises(ClientDisconnected):
+                await run_with_deadline(slow, 30, disconnected, poll_interval=0.01)
+            await asyncio.sleep(0)
+
+        asyncio.run(main())
+        assert cancelled == [True]
+
+    def test_run_with_deadline_propagates_budget(self):
+        import asyncio
+        from agents import deadline
+
+        async def left():
+            return deadline.remaining()
+
+        assert 4 < asyncio.run(deadline.run_with_deadline(left, 5)) <= 5
+        assert deadline.remaining() is None
+
+
+class TestJsonRepair:
+    def test_repairs_common_model_mistakes(self):
+        from agents.utils import repair_json
+        assert repair_json('[{"a": 1}, {"b": 2},]') == [{"a": 1}, {"b": 2}]
+        assert repair_json('Here: {"calories": 200,} Enjoy!') == {"calories": 200}
+        assert repair_json("{'name': 'it\\'s', 'q': 1}") == {"name": "it's", "q": 1}
+        assert repair_json('Sure [2 ideas]: [{"a": 1}]') == [{"a": 1}]
+        assert repair_json('{"a": [1, 2}') == {"a": [1, 2]}
+
+    def test_truncated_array_keeps_complete_elements(self):
+        from agents.utils import repair_json
+        text = '[{"name": "Omelette", "steps": ["Whisk", "Cook"]}, {"name": "Toast", "steps": ["Toa'
+        assert repair_json(text) == [{"name": "Omelette", "steps": ["Whisk", "Cook"]}]
+
+    def test_unrepairable_raises(self):
+        import pytest
+        from agents.utils import JsonParseError, parse_json_response
+        with pytest.raises(JsonParseError):
+            parse_json_response('{"calories": 200, "prot', expect=dict, required_keys=("calories", "protein"))
+        with pytest.raises(JsonParseError):
+            parse_json_response("no json here")
+
+    def test_repair_saves_a_regeneration(self, monkeypatch):
+        from agents import nutrition_agent, utils
+        utils.response_cache.clear()
+        utils.model_router.reset()
+        _FakeModel.calls = []
+
+        class TrailingCommaModel(_FakeModel):
+            def generate_content(self, content, request_options=None, generation_config=None):
+                _FakeModel.calls.append((self.model_name, content))
+                return _FakeResponse('{"meal_name": "Eggs", "calories": 150, "protein": 12, "carbs": 1, "fat": 10,}')
+
+        monkeypatch.setattr(nutrition_agent, "API_KEY", "x")
+        monkeypatch.setattr(utils.genai, "GenerativeModel", TrailingCommaModel)
+        before = utils.json_stats.snapshot()
+        assert nutrition_agent.analyze_meal("two eggs")["fat"] == 10
+        after = utils.json_stats.snapshot()
+        assert len(_FakeModel.calls) == 1
+        assert after["repaired"] - before["repaired"] == 1
+        assert after["retries"] == before["retries"]
+
+    def test_unrepairable_output_is_regenerated(self, monkeypatch):
+        from agents import nutrition_agent, utils
+        utils.response_cache.clear()
+        utils.model_router.reset()
+        _FakeModel.calls = []
+        outputs = ['I think it has about 150 calories.', '{"calories": 150, "protein": 12, "carbs": 1, "fat": 10}']
+
+        class FlakyModel(_FakeModel):
+            def generate_content(self, content, request_options=None, generation_config=None):
+                _FakeModel.calls.append((self.model_name, content))
+                return _FakeResponse(outputs[len(_FakeModel.calls) - 1])
+
+        monkeypatch.setattr(nutrition_agent, "API_KEY", "x")
+        monkeypatch.setattr(utils.genai, "GenerativeModel", FlakyModel)
+        before = utils.json_stats.snapshot()["retries"]
+        assert nutrition_agent.analyze_meal("two eggs")["calories"] == 150
+        assert len(_FakeModel.calls) == 2
+        assert utils.json_stats.snapshot()["retries"] - before == 1
+
+
+class _StructuredOutputModel(_FakeModel):
+    """
+    Stand-in for a model with and without structured output: given a
+    response_schema it answers with bare JSON, otherwise with the reasoning
+    block and markdown fence Gemma tends to wrap JSON in.
+    """
+    configs = []
+    payload = {"meal_name": "Eggs", "calories": 150, "protein": 12, "carbs": 1, "fat": 10}
+
+    def generate_content(self, content, request_options=None, generation_config=None):
+        import json
+        _FakeModel.calls.append((self.model_name, content))
+        _StructuredOutputModel.configs.append((self.model_name, generation_config))
+        if generation_config is not None:
+            return _FakeResponse(json.dumps(self.payload))
+        return _FakeResponse("<think>eggs...</think>\n```json\n" + json.dumps(self.payload) + "\n```")
+
+    async def generate_content_async(self, content, request_options=None, generation_config=None):
+        return self.generate_content(content, request_options, generation_config)
+
+
+class TestStructuredOutput:
+    def setup_method(self):
+        from agents import utils
+        utils.response_cache.clear()
+        utils.model_router.reset()
+        _FakeModel.calls = []
+        _StructuredOutputModel.configs = []
+
+    def test_schema_derived_from_pydantic_model(self):
+        import schemas
+        from agents.utils import response_schema_for
+        schema = response_schema_for(schemas.RecipeResponse, many=True)
+        item = schema["items"]
+        assert schema["type"] == "array" and item["type"] == "object"
+        assert item["properties"]["instructions"] == {"type": "array", "items": {"type": "string"}}
+        assert item["properties"]["servings"] == {"type": "integer", "nullable": True}
+        assert "servings" not in item["required"] and "name" in item["required"]
+        assert "title" not in item
+
+    def test_gemini_gets_json_mode(self, monkeypatch):
+        from agents import nutrition_agent, utils
+        monkeypatch.setattr(nutrition_agent, "API_KEY", "x")
+        monkeypatch.setattr(utils.genai, "GenerativeModel", _StructuredOutputModel)
+        assert nutrition_agent.analyze_meal("two eggs")["protein"] == 12
+        [(model, config)] = _StructuredOutputModel.configs
+        assert model == "gemini-2.5-flash"
+        assert config["response_mime_type"] == "application/json"
+        assert set(config["response_schema"]["required"]) >= {"calories", "protein", "carbs", "fat"}
+
+    def test_gemma_fallback_parses_text(self, monkeypatch):
+        import asyncio
+        from agents import orchestrator_agent, utils
+        monkeypatch.setattr(orchestrator_agent, "API_KEY", "x")
+        monkeypatch.setattr(orchestrator_agent, "classify_for_bypass", lambda message: None)
+        monkeypatch.setattr(_StructuredOutputModel, "payload", {"intent": "general_chat", "response": "Hi!"})
+        monkeypatch.setattr(utils.genai, "GenerativeModel", _StructuredOutputModel)
+        result = asyncio.run(orchestrator_agent.process_chat_async("hello there"))
+        assert result == {"intent": "general_chat", "response": "Hi!"}
+        assert _StructuredOutputModel.configs == [("models/gemma-3-27b-it", None)]
+
+
+class TestJsonExtractor:
+    TEXT = (
+        '<thinking>use the [eggs] first</thinking>Sure, here are "two" ideas:\n'
+        '```json\n[{"name": "Omelette \\"classic\\"", "steps": ["Whisk {3} eggs"]}]\n```'
+    )
+
+    def test_any_chunking_gives_same_result(self):
+        from agents.utils import JsonExtractor
+        expected = [{"name": 'Omelette "classic"', "steps": ["Whisk {3} eggs"]}]
+        for step in (1, 2, 5, 13, len(self.TEXT)):
+            extractor = JsonExtractor()
+            for i in range(0, len(self.TEXT), step):
+                extractor.feed(self.TEXT[i:i + step])
+            assert extractor.close() == expected
+
+    def test_first_value_wins_without_fences(self):
+        assert clean_json_response('{"a": [1, 2], "b": {"c": "}"}} trailing {"d": 1}') == {"a": [1, 2], "b": {"c": "}"}}
+        assert clean_json_response('<think>unclosed {"a": 1}') == {"a": 1}
+        assert clean_json_response('```json\n{"a": 1}') == {"a": 1}  # fence never closed
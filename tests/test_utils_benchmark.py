@@ -0,0 +1,127 @@
+"""
+Benchmarks for agents/utils.py JSON extraction: the single-pass
+JsonExtractor (behind clean_json_response) against the previous
+regex + bracket-counting implementation, on 2–20 KB model outputs.
+
+    pytest tests/test_utils_benchmark.py --benchmark-only
+"""
+import json
+import re
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from agents.utils import JsonExtractor, clean_json_response
+
+
+def _legacy_clean_json_response(text):
+    """The implementation clean_json_response replaced, kept as the baseline."""
+    text = text.strip()
+    text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL).strip()
+    text = re.sub(r'<thinking>.*?</thinking>', '', text, flags=re.DOTALL).strip()
+    matches = re.findall(r'```(?:json)?\s*(.*?)\s*```', text, re.DOTALL)
+    json_str = matches[-1].strip() if matches else _legacy_extract_first_json(text)
+    return json.loads(json_str)
+
+
+def _legacy_extract_first_json(text):
+    brace_idx = text.find('{')
+    bracket_idx = text.find('[')
+    if brace_idx == -1 and bracket_idx == -1:
+        return text
+    if brace_idx == -1:
+        pairs = [('[', ']')]
+    elif bracket_idx == -1:
+        pairs = [('{', '}')]
+    elif bracket_idx < brace_idx:
+        pairs = [('[', ']'), ('{', '}')]
+    else:
+        pairs = [('{', '}'), ('[', ']')]
+    for start_char, end_char in pairs:
+        idx = text.find(start_char)
+        if idx == -1:
+            continue
+        depth = 0
+        in_string = False
+        escape_next = False
+        for i, ch in enumerate(text[idx:], start=idx):
+            if escape_next:
+                escape_next = False
+                continue
+            if ch == '\\' and in_string:
+                escape_next = True
+                continue
+            if ch == '"' and not escape_next:
+                in_string = not in_string
+                continue
+            if in_string:
+                continue
+            if ch == start_char:
+                depth += 1
+            elif ch == end_char:
+                depth -= 1
+                if depth == 0:
+                    return text[idx:i + 1]
+    return text
+
+
+_RECIPE = {
+    "name": "Garlic Butter Chicken with \"crispy\" skin",
+    "reasoning": "Uses the chicken thighs and garlic already in the pantry before they expire.",
+    "missing_ingredients": ["butter", "parsley"],
+    "instructions": [
+        f"Step {i}: Heat 2 tbsp olive oil in a pan over medium heat for {i + 2} minutes, "
+        "then add 200 g chicken [skin side down]."
+        for i in range(1, 8)
+    ],
+    "estimated_calories": 650,
+    "estimated_protein": 48,
+    "servings": 2,
+    "cost_per_dish": 9.5,
+}
+
+
+def _recipes(kb):
+    recipes = []
+    while len(json.dumps(recipes, indent=2)) < kb * 1024:
+        recipes.append(_RECIPE)
+    return json.dumps(recipes, indent=2)
+
+
+def _wrap(shape, body):
+    if shape == "plain":
+        return body
+    if shape == "prose":
+        return "Sure! Here are a few ideas (based on your \"pantry\"):\n" + body + "\nLet me know what you think!"
+    reasoning = "The user has chicken, garlic and rice. Let me weigh {cost} against [time]. " * 20
+    return f"<think>{reasoning}</think>\nHere you go:\n```json\n{body}\n```"
+
+
+_CASES = [(kb, shape) for kb in (2, 8, 20) for shape in ("plain", "prose", "think_fence")]
+
+
+@pytest.mark.parametrize("kb,shape", _CASES)
+def test_single_pass(benchmark, kb, shape):
+    text = _wrap(shape, _recipes(kb))
+    assert benchmark(clean_json_response, text) == _legacy_clean_json_response(text)
+
+
+@pytest.mark.parametrize("kb,shape", _CASES)
+def test_legacy(benchmark, kb, shape):
+    benchmark(_legacy_clean_json_response, _wrap(shape, _recipes(kb)))
+
+
+@pytest.mark.parametrize("kb", (2, 20))
+def test_single_pass_streamed(benchmark, kb):
+    """Fed in ~60-character chunks, as they arrive from a streamed response."""
+    text = _wrap("think_fence", _recipes(kb))
+    chunks = [text[i:i + 60] for i in range(0, len(text), 60)]
+
+    def run():
+        extractor = JsonExtractor()
+        for chunk in chunks:
+            extractor.feed(chunk)
+        return extractor.close()
+
+    assert benchmark(run) == _legacy_clean_json_response(text)